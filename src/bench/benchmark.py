@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Benchmarks the extraction hot paths on synthetic interlaced clips generated with the ffmpeg testsrc source:
+probe, seek, decode, deinterlace, encode and tag per frame, and end to end extraction across the drop/yadif/none
+deinterlacing modes, step sizes and worker counts. Results are written as json, and compared to a baseline
+run to flag regressions between releases
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+from datetime import datetime
+
+MAIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main')
+sys.path.insert(0, MAIN_DIR)
+
+import probe
+import utils
+import tagging
+import encoders
+import extractor
+import scheduler
+from reader import FrameReader
+
+# interlaced clips are named {dive}_{start time} like dive videos so the extractor parses their dive and start
+# time; clips of each size are kept in a directory of their own
+CLIP_NAME = 'D0000_20200101T000000Z.mov'
+# modules the extractor only imports on the code paths that need them
+HEAVY_MODULES = ['cv2', 'numpy', 'lxml']
+# extensions of the frames the extractor writes
+FRAME_EXTENSIONS = tuple('.' + encoders.get_encoder(fmt).ext for fmt in encoders.FORMATS)
+
+
+def make_clip(output_dir, seconds=20, size='1920x1080', codec='mpeg2video'):
+    '''
+    generates an interlaced test clip: testsrc at 59.94 progressive frames per second is woven into
+    top field first frames at 29.97 frames per second
+    :param output_dir: directory to write the clip to
+    :param seconds: length of the clip
+    :param size: frame size
+    :param codec: ffmpeg video encoder; the encoder must support interlaced coding
+    :return: full path to the clip
+    '''
+    path = os.path.join(output_dir, size, CLIP_NAME)
+    if os.path.exists(path):
+        return path
+    utils.ensure_dir(os.path.dirname(path))
+    cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi', '-i',
+           'testsrc=size={}:rate=60000/1001'.format(size), '-t', str(seconds), '-vf', 'interlace=scan=tff',
+           '-c:v', codec, '-flags', '+ilme+ildct', '-top', '1', '-q:v', '2', path]
+    subprocess.check_call(cmd)
+    return path
+
+
+def timed(name, func, frames=None, **params):
+    '''
+    runs func once and times it
+    :param name: benchmark name
+    :param func: function to time; returns the number of frames it processed, or None
+    :param frames: number of frames processed, if func does not return it
+    :param params: benchmark parameters recorded with the result
+    :return: result dictionary
+    '''
+    t_start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - t_start
+    frames = result if frames is None else frames
+    print('{:<12} {:<60} {:8.3f} s{}'.format(name, json.dumps(params, sort_keys=True), seconds,
+                                             ' {:8.2f} ms/frame'.format(1e3 * seconds / frames) if frames else ''))
+    return {'name': name, 'params': params, 'seconds': seconds, 'frames': frames,
+            'ms_per_frame': 1e3 * seconds / frames if frames else None}
+
+
+def bench_startup(clip, output_dir, runs=5):
+    '''
+    times starting a worker: a python process that imports the extractor and constructs an Extractor for the clip,
+    and lists the heavy modules loaded once the Extractor is constructed
+    :param clip: full path to the clip
+    :param output_dir: directory the Extractor writes to
+    :param runs: number of starts
+    :return: (results, list of heavy modules loaded)
+    '''
+    check = 'import sys; sys.path.insert(0, {!r}); import extractor; e = extractor.Extractor({!r}, {!r}, "drop", 5); ' \
+            'print("heavy modules:", *(m for m in {!r} if m in sys.modules))'
+    cmd = [sys.executable, '-c', check.format(MAIN_DIR, clip, output_dir, HEAVY_MODULES)]
+    loaded = set()
+
+    def run():
+        for _ in range(runs):
+            # the Extractor prints the video details, so only the marker line is parsed
+            for line in subprocess.check_output(cmd).decode().splitlines():
+                if line.startswith('heavy modules:'):
+                    loaded.update(line.split()[2:])
+        return None
+    results = [timed('startup', run, frames=runs, runs=runs)]
+    return results, sorted(loaded)
+
+
+def bench_probe(clip, cache_dir):
+    results = [timed('probe', lambda: probe.run_ffprobe(clip) and None, cached=False)]
+    probe.probe(clip, cache_dir)
+    results.append(timed('probe', lambda: probe.probe(clip, cache_dir) and None, cached=True))
+    return results
+
+
+def bench_seek(clip, info, seeks=10):
+    '''
+    times accurate seeks to evenly spaced points, decoding the one frame at each
+    '''
+    duration = info['duration']
+
+    def run():
+        for k in range(seeks):
+            subprocess.check_call('ffmpeg -loglevel error -accurate_seek -ss {:.3f} -i {} -frames:v 1 -f null -'.format(
+                duration * k / seeks, clip), shell=True)
+        return None
+    return [timed('seek', run, frames=seeks, seeks=seeks)]
+
+
+def decode_frames(clip, info, frames):
+    '''
+    decodes the first frames of a clip into memory for the deinterlace and encode benchmarks
+    '''
+    reader = FrameReader('ffmpeg -loglevel error -i {}'.format(clip), info['width'], info['height'],
+                         info['bit_depth'], frames=frames)
+    return [img.copy() for img in reader]
+
+
+def bench_decode(clip, info, frames=100):
+    '''
+    times decoding to raw frames without deinterlacing, with drop deinterlacing in memory, and with yadif in ffmpeg
+    '''
+    results = []
+    for threads in (1, multiprocessing.cpu_count()):
+        input_string = 'ffmpeg -loglevel error -threads {} -i {}'.format(threads, clip)
+        reader = FrameReader(input_string, info['width'], info['height'], info['bit_depth'])
+        results.append(timed('decode', lambda: sum(1 for _ in reader), threads=threads, deinterlace='none'))
+    frames = decode_frames(clip, info, frames)
+    results.append(timed('deinterlace', lambda: sum(1 for img in frames if img[::2, 1::2].copy().size),
+                         deinterlace='drop'))
+    reader = FrameReader('ffmpeg -loglevel error -i {} -vf yadif=1:-1:0'.format(clip), info['width'], info['height'],
+                         info['bit_depth'])
+    results.append(timed('decode', lambda: sum(1 for _ in reader), deinterlace='yadif'))
+    return results, frames
+
+
+def bench_encode(frames, tags):
+    '''
+    times encoding, and embedding the tags, per frame for every output format
+    '''
+    results = []
+    for fmt in encoders.FORMATS:
+        encoder = encoders.get_encoder(fmt)
+        results.append(timed('encode', lambda: sum(1 for img in frames if encoder.encode(img, None)), format=fmt))
+    png = encoders.get_encoder('png').encode(frames[0], None)
+    results.append(timed('tag', lambda: sum(1 for _ in frames if tagging.add_text(png, tags)), format='png'))
+    return results
+
+
+def extract(clip, output_dir, deinterlace, step, milliseconds, workers, segment):
+    '''
+    extracts a clip end to end with the extractor, split into segments across workers as with -g
+    :return: number of frames extracted
+    '''
+    start_time = datetime.strptime('00:00:00', '%H:%M:%S')
+    jobs = []
+    for cost, segment_start, segment_end, start_number in scheduler.video_segments(clip, step, milliseconds,
+                                                                                   start_time, None, segment):
+        jobs.append((cost, clip, dict(video=clip, output_dir=output_dir, deinterlace=deinterlace,
+                                      milliseconds=milliseconds, step=step, start_time=segment_start,
+                                      end_time=segment_end, prefix='f', workers=workers, start_number=start_number,
+                                      resume=False)))
+    scheduler.run(jobs, extractor.process_helper, workers)
+    return count_frames(output_dir)
+
+
+def count_frames(output_dir):
+    '''
+    counts the frames an extraction wrote: frame files in {key}/imgs, and the frames indexed in {key}/shards
+    :param output_dir: extractor output directory
+    :return: number of frames
+    '''
+    frames = 0
+    for root, _, files in os.walk(output_dir):
+        if os.path.basename(root) == 'imgs':
+            frames += len([f for f in files if f.endswith(FRAME_EXTENSIONS)])
+        elif os.path.basename(root) == 'shards':
+            for f in files:
+                if f.endswith('-index.jsonl'):
+                    with open(os.path.join(root, f), 'r') as index:
+                        frames += sum(1 for line in index if line.strip())
+    return frames
+
+
+def bench_extract(clip, work_dir, steps, workers_list, segment):
+    results = []
+    for deinterlace in ('drop', 'yadif', None):
+        for step in steps:
+            for workers in workers_list:
+                output_dir = tempfile.mkdtemp(dir=work_dir)
+                try:
+                    results.append(timed('extract', lambda: extract(clip, output_dir, deinterlace, step, 1000,
+                                                                    workers, segment),
+                                         deinterlace=deinterlace or 'none', step=step, workers=workers))
+                finally:
+                    shutil.rmtree(output_dir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline_path, threshold):
+    '''
+    compares results to a baseline run, matching benchmarks by name and parameters
+    :return: list of (name, params, baseline seconds, seconds) for benchmarks slower by more than threshold
+    '''
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+    before = dict((json.dumps([r['name'], r['params']], sort_keys=True), r['seconds']) for r in baseline['results'])
+    regressions = []
+    for r in results:
+        previous = before.get(json.dumps([r['name'], r['params']], sort_keys=True))
+        if previous and r['seconds'] > previous * (1 + threshold):
+            regressions.append((r['name'], r['params'], previous, r['seconds']))
+    return regressions
+
+
+def process_command_line():
+    import argparse
+    from argparse import RawTextHelpFormatter
+
+    examples = 'Examples:' + '\n\n'
+    examples += sys.argv[0] + " -o bench.json --baseline bench_previous.json \n"
+    parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter,
+                                     description='Benchmark the extraction hot paths on synthetic interlaced clips',
+                                     epilog=examples)
+    parser.add_argument('-o', '--output', action='store', help='json file to write the results to', default='bench.json', required=False)
+    parser.add_argument('-w', '--work_dir', action='store', help='directory for the clips and extracted frames; defaults to a temporary directory', required=False)
+    parser.add_argument('--seconds', action='store', help='length of the test clip in seconds', default=20, required=False, type=int)
+    parser.add_argument('--size', action='store', help='frame size of the test clip', default='1920x1080', required=False)
+    parser.add_argument('--steps', action='store', help='step sizes in seconds to extract with', nargs='*', default=[1, 5], required=False, type=int)
+    parser.add_argument('--workers', action='store', help='worker counts to extract with', nargs='*', default=[1, 4], required=False, type=int)
+    parser.add_argument('--segment', action='store', help='segment length in seconds when extracting with several workers', default=5, required=False, type=int)
+    parser.add_argument('--baseline', action='store', help='results of an earlier run to compare against', required=False)
+    parser.add_argument('--startup_budget', action='store', help='maximum milliseconds to start the extractor', default=500, required=False, type=float)
+    parser.add_argument('--threshold', action='store', help='fraction slower than the baseline that counts as a regression', default=0.2, required=False, type=float)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = process_command_line()
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='frameextractor_bench_')
+    cache_dir = os.path.join(work_dir, 'cache')
+    clip = make_clip(work_dir, args.seconds, args.size)
+    info = probe.run_ffprobe(clip)
+    ffmpeg_version = subprocess.check_output(['ffmpeg', '-version']).decode().splitlines()[0]
+    print('{} {}x{} {} fps, {}'.format(clip, info['width'], info['height'], info['fps'], ffmpeg_version))
+
+    results, loaded = bench_startup(clip, os.path.join(work_dir, 'startup'))
+    results.extend(bench_probe(clip, cache_dir))
+    results.extend(bench_seek(clip, info))
+    decode_results, frames = bench_decode(clip, info)
+    results.extend(decode_results)
+    results.extend(bench_encode(frames, [('Dive', 'D0000'), ('Datetime', '20200101T000000.000Z')]))
+    del frames
+    results.extend(bench_extract(clip, work_dir, args.steps, args.workers, args.segment))
+
+    report = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'host': platform.node(),
+              'platform': platform.platform(), 'python': platform.python_version(), 'cpus': multiprocessing.cpu_count(),
+              'ffmpeg': ffmpeg_version, 'clip': {'seconds': args.seconds, 'size': args.size, 'fps': info['fps'],
+                                                 'field_order': info['field_order']},
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Wrote {} results to {}'.format(len(results), args.output))
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    failed = False
+    startup_ms = results[0]['ms_per_frame']
+    if startup_ms > args.startup_budget or loaded:
+        print('Startup {:.0f} ms, budget {:.0f} ms; constructing an Extractor loads {}'.format(
+            startup_ms, args.startup_budget, ', '.join(loaded) or 'no heavy modules'))
+        failed = True
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.threshold)
+        for name, params, before, after in regressions:
+            print('Regression {} {}: {:.3f} s -> {:.3f} s'.format(name, json.dumps(params, sort_keys=True), before, after))
+        failed = failed or bool(regressions)
+    if failed:
+        exit(1)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Reads and writes PASCAL VOC annotation xml files in memory with lxml
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import shutil
+from lxml import etree
+import utils
+
+BOX_TAGS = ('xmin', 'ymin', 'xmax', 'ymax')
+
+
+def read(xml_path):
+    '''
+    parses an annotation; blank text is dropped so the annotation can be pretty printed when written
+    :param xml_path: full path to the annotation xml
+    :return: lxml root element, i.e. <annotation>
+    '''
+    parser = etree.XMLParser(remove_blank_text=True)
+    return etree.parse(xml_path, parser).getroot()
+
+
+def write(root, xml_path, backup=True):
+    '''
+    pretty prints an annotation and atomically replaces the xml file with it
+    :param root: lxml root element
+    :param xml_path: full path to the annotation xml
+    :param backup: if True, keep a copy of the original as xml_path.bak
+    :return:
+    '''
+    if backup and os.path.exists(xml_path):
+        shutil.copyfile(xml_path, xml_path + '.bak')
+    utils.write_atomic(xml_path, etree.tostring(root, pretty_print=True, xml_declaration=True, encoding='utf-8'))
+
+
+def image_path(root, xml_path, ext='png'):
+    '''
+    finds the image of an annotation; images are in the directory named by the <folder> tag
+    that contains the annotation, and share its root filename
+    :param root: lxml root element
+    :param xml_path: full path to the annotation xml
+    :param ext: image extension
+    :return: full path to the image
+    '''
+    folder = root.findtext('folder')
+    name = os.path.basename(xml_path).split('.')[0]
+    parent_path = xml_path.split(folder)[0] + folder
+    return '{}/{}.{}'.format(parent_path, name, ext)
+
+
+def size(root):
+    '''
+    :param root: lxml root element
+    :return: width, height from the <size> tag, or 0, 0 if it is missing
+    '''
+    try:
+        return int(float(root.findtext('size/width'))), int(float(root.findtext('size/height')))
+    except (TypeError, ValueError):
+        return 0, 0
+
+
+def box(obj):
+    '''
+    :param obj: lxml <object> element
+    :return: [xmin, ymin, xmax, ymax] as floats
+    '''
+    return [float(obj.findtext('bndbox/' + tag)) for tag in BOX_TAGS]
+
+
+def set_box(obj, values):
+    '''
+    sets the bounding box of an object, rounded to whole pixels
+    :param obj: lxml <object> element
+    :param values: [xmin, ymin, xmax, ymax]
+    :return:
+    '''
+    for tag, value in zip(BOX_TAGS, values):
+        obj.find('bndbox/' + tag).text = str(int(round(value)))
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Frame-accurate timestamps computed with numpy from the exact rational frame rate, and a per-video
+frame catalog mapping each frame to its number, presentation time, UTC datetime and dive so frames
+can be joined with navigation or CTD data without reading the tags of every frame
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import sys
+import csv
+import glob
+import numpy as np
+import utils
+
+COLUMNS = ['frame', 'number', 'pts', 'time', 'dive']
+
+
+def frame_pts(numbers, frame_rate):
+    '''
+    computes the presentation time of frames from their numbers with integer arithmetic, so times do not
+    drift over long videos
+    :param numbers: frame numbers counted from 0 at the start of the video
+    :param frame_rate: exact frame rate as a Fraction, e.g. Fraction(30000, 1001)
+    :return: int64 array of presentation times in microseconds, rounded to the nearest microsecond
+    '''
+    numbers = np.asarray(numbers, dtype=np.int64)
+    num, den = frame_rate.numerator, frame_rate.denominator
+    return (numbers * (2 * den * 1000000) + num) // (2 * num)
+
+
+def frame_times(start_iso_time, numbers, frame_rate):
+    '''
+    :param start_iso_time: datetime of the first frame of the video, e.g. parsed from its name
+    :param numbers: frame numbers counted from 0 at the start of the video
+    :param frame_rate: exact frame rate as a Fraction
+    :return: datetime64[us] array of the frame datetimes
+    '''
+    return np.datetime64(start_iso_time, 'us') + frame_pts(numbers, frame_rate).astype('timedelta64[us]')
+
+
+def datetime_tags(times):
+    '''
+    formats frame datetimes as Datetime tags, truncated to milliseconds
+    :param times: datetime64 array
+    :return: list of strings, e.g. 20160501T000035.033Z
+    '''
+    s = np.datetime_as_string(np.asarray(times).astype('datetime64[ms]'), unit='ms')
+    s = np.char.replace(np.char.replace(s, '-', ''), ':', '')
+    return [t + 'Z' for t in s.tolist()]
+
+
+class Catalog():
+    def __init__(self, path):
+        '''
+        the Catalog class appends the frames of each finished window to a csv file with the frame name, number,
+        presentation time in seconds, UTC datetime and dive. Like the manifest, each window is appended with a
+        single write so segments of the same video running in different processes can share a catalog
+
+        :param path: full path to the catalog, e.g. {output_dir}/{key}/catalog.csv
+
+        :Example:
+        c = Catalog('/Volumes/data/out/D008_03HD/catalog.csv')
+        c.record(['D008_03HD_00-00-05_001.png'], numbers, times, 'D008')
+        '''
+        self.path = path
+        self.fd = None
+
+    def record(self, frames, numbers, pts, times, dive):
+        '''
+        appends the frames of a window
+        :param frames: frame names
+        :param numbers: frame numbers
+        :param pts: presentation times in microseconds, as returned by frame_pts()
+        :param times: datetime64 array of the frame datetimes
+        :param dive: dive name
+        :return:
+        '''
+        if not len(frames):
+            return
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        lines = []
+        if os.fstat(self.fd).st_size == 0:
+            lines.append(','.join(COLUMNS))
+        iso = np.datetime_as_string(np.asarray(times).astype('datetime64[ms]'), unit='ms')
+        for frame, number, p, t in zip(frames, np.asarray(numbers).tolist(), np.asarray(pts).tolist(), iso.tolist()):
+            lines.append('{},{},{:.6f},{}Z,{}'.format(frame, number, p / 1e6, t, dive))
+        # one write on an O_APPEND descriptor so windows from concurrent segments never interleave
+        os.write(self.fd, ('\n'.join(lines) + '\n').encode())
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def read_rows(path):
+    '''
+    reads the records of a catalog, keeping the last record of frames extracted again by a later run
+    :param path: full path to the catalog csv
+    :return: dictionary of frame name to its csv row
+    '''
+    rows = {}
+    with open(path, 'r') as f:
+        for row in csv.reader(f):
+            # segments that created the catalog at the same time may each have written the header
+            if len(row) != len(COLUMNS) or row[0] == COLUMNS[0]:
+                continue
+            rows[row[0]] = row
+    return rows
+
+
+def to_records(rows):
+    '''
+    :param rows: csv rows
+    :return: numpy record array with frame, number, pts (seconds), time (datetime64[ms]) and dive fields,
+    sorted by frame number
+    '''
+    rows = sorted(rows, key=lambda r: int(r[1]))
+    frames = np.array([r[0] for r in rows], dtype=str)
+    dives = np.array([r[4] for r in rows], dtype=str)
+    return np.rec.fromarrays([frames,
+                              np.array([int(r[1]) for r in rows], dtype=np.int64),
+                              np.array([float(r[2]) for r in rows], dtype=np.float64),
+                              np.array([r[3].rstrip('Z') for r in rows], dtype='datetime64[ms]'),
+                              dives],
+                             names=COLUMNS)
+
+
+def load(path):
+    '''
+    loads a catalog, keeping the last record of frames extracted again by a later run
+    :param path: full path to the catalog csv
+    :return: numpy record array, as returned by to_records()
+    '''
+    return to_records(read_rows(path).values())
+
+
+def save(path, rows):
+    '''
+    rewrites a catalog sorted by frame number, and saves it as npy
+    :param path: full path to the catalog csv
+    :param rows: csv rows
+    :return: (number of frames, full path to the npy catalog)
+    '''
+    rows = sorted(rows, key=lambda r: int(r[1]))
+    lines = [','.join(COLUMNS)] + [','.join(row) for row in rows]
+    utils.write_atomic(path, ('\n'.join(lines) + '\n').encode())
+    npy = os.path.splitext(path)[0] + '.npy'
+    np.save(npy, to_records(rows))
+    return len(rows), npy
+
+
+def compact(path):
+    '''
+    rewrites a catalog sorted by frame number without the records of frames extracted again, and saves it as npy
+    :param path: full path to the catalog csv
+    :return: (number of frames, full path to the npy catalog)
+    '''
+    return save(path, read_rows(path).values())
+
+
+def process_command_line():
+    import argparse
+    from argparse import RawTextHelpFormatter
+
+    examples = 'Examples:' + '\n\n'
+    examples += sys.argv[0] + " -i /Volumes/Tempbox/danelle/benthic/ \n"
+    parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter,
+                                     description='Compact the per-video frame catalogs of the extractor output to npy',
+                                     epilog=examples)
+    parser.add_argument('-i', '--input_dir', action='store', help='extractor output directory with {key}/catalog.csv files', required=True)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = process_command_line()
+    for path in sorted(glob.glob('{}/*/catalog.csv'.format(args.input_dir))):
+        frames, npy = compact(path)
+        print('Wrote {} frames to {}'.format(frames, npy))
@@ -8,7 +8,7 @@ __maintainer__ = "Danelle Cline"
 __email__ = "dcline at mbari.org"
 __doc__ = '''
 
-Utility for swapping ymin/ymax in annotation xml files
+Utility for fixing bounding box coordinates in annotation xml files, e.g. swapping ymin/ymax
 
 @author: __author__
 @status: __status__
@@ -16,10 +16,10 @@ Utility for swapping ymin/ymax in annotation xml files
 '''
 
 import sys
-import os
-import subprocess
-import glob
-import shutil
+import multiprocessing
+import annotation
+import dataset
+import imageinfo
 
 def process_command_line():
   import argparse
@@ -27,27 +27,147 @@ def process_command_line():
 
   examples = 'Examples:' + '\n\n'
   examples += sys.argv[0] + "-s 'python clean.py' " \
-                            "-i /mnt/RAID/data/imgs/annotations "
+                            "-i /mnt/RAID/data/imgs/annotations " + '\n'
+  examples += sys.argv[0] + "-s 'python clean.py' " \
+                            "-i /mnt/RAID/data/imgs/annotations --scale_to 960 540 --clamp -n"
   parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter,
-                                   description='Extract still jpeg frames from video',
+                                   description='Fix bounding box coordinates in annotation xml files. Fixups are applied in the order '
+                                               'swap, order, scale, flip, clamp; with no fixups given, ymin/ymax are swapped',
                                    epilog=examples)
   parser.add_argument('-i', '--input_dir', action='store', help='full path to base directory where prores files are',
                       default='', required=True)
+  parser.add_argument('--swap', action='store_true', help='swap ymin and ymax', required=False)
+  parser.add_argument('--order', action='store_true', help='swap min and max values only where they are reversed', required=False)
+  parser.add_argument('--scale_to', action='store', help='scale boxes and size from the annotated size to WIDTH HEIGHT',
+                      nargs=2, type=int, metavar=('WIDTH', 'HEIGHT'), required=False)
+  parser.add_argument('--flip', action='store', help='mirror boxes horizontally (h) or vertically (v)',
+                      choices=['h', 'v'], required=False)
+  parser.add_argument('--clamp', action='store_true', help='clamp boxes to the image size', required=False)
+  parser.add_argument('-j', '--jobs', action='store', help='number of annotations to process in parallel; defaults to the number of CPUs',
+                      default=multiprocessing.cpu_count(), required=False, type=int)
+  parser.add_argument('-n', '--dry_run', action='store_true', help='report which annotations would change without writing them',
+                      required=False)
   args = parser.parse_args()
   return args
 
+def get_fixups(args):
+  '''
+  builds the list of fixups from the command line, in the order they are applied
+  :return: list of (name, value) tuples
+  '''
+  fixups = []
+  if args.swap:
+    fixups.append(('swap', None))
+  if args.order:
+    fixups.append(('order', None))
+  if args.scale_to:
+    fixups.append(('scale', tuple(args.scale_to)))
+  if args.flip:
+    fixups.append(('flip', args.flip))
+  if args.clamp:
+    fixups.append(('clamp', None))
+  return fixups or [('swap', None)]
+
+def transform(b, fixups, w, h):
+  '''
+  applies fixups to a bounding box
+  :param b: [xmin, ymin, xmax, ymax] as floats; the result is not rounded
+  :param fixups: list of (name, value) tuples
+  :param w: image width
+  :param h: image height
+  :return: transformed [xmin, ymin, xmax, ymax] and the image width, height after scaling
+  '''
+  xmin, ymin, xmax, ymax = b
+  for name, value in fixups:
+    if name == 'swap':
+      ymin, ymax = ymax, ymin
+    elif name == 'order':
+      xmin, xmax = min(xmin, xmax), max(xmin, xmax)
+      ymin, ymax = min(ymin, ymax), max(ymin, ymax)
+    elif name == 'scale':
+      sx, sy = float(value[0]) / w, float(value[1]) / h
+      xmin, xmax, ymin, ymax = xmin * sx, xmax * sx, ymin * sy, ymax * sy
+      w, h = value
+    elif name == 'flip' and value == 'h':
+      xmin, xmax = w - xmax, w - xmin
+    elif name == 'flip' and value == 'v':
+      ymin, ymax = h - ymax, h - ymin
+    elif name == 'clamp':
+      xmin, xmax = [min(max(x, 0), w) for x in (xmin, xmax)]
+      ymin, ymax = [min(max(y, 0), h) for y in (ymin, ymax)]
+  return [xmin, ymin, xmax, ymax], w, h
+
+def clean(xml_in, fixups, dry_run=False, dims=None):
+  '''
+  parses an annotation once, applies the fixups to every bounding box and atomically replaces the
+  annotation if anything changed; the original is kept as xml_in.bak
+  :param xml_in: full path to the annotation xml
+  :param fixups: list of (name, value) tuples
+  :param dry_run: if True, do not write
+  :param dims: (w, h) of the image, e.g. from the dataset index, used if the annotation has no size
+  :return: (xml_in, number of boxes changed, error message or None)
+  '''
+  try:
+    root = annotation.read(xml_in)
+    w, h = annotation.size(root)
+    if (not w or not h) and dims:
+      w, h = dims
+    if not w or not h:
+      # fall back to the image header when the annotation has no size
+      info = imageinfo.read_header(annotation.image_path(root, xml_in))
+      w, h = info['width'], info['height']
+    changed = 0
+    for o in root.iter('object'):
+      if o.find('bndbox') is None:
+        continue
+      # boxes are transformed in float and rounded once, by set_box, so fixups never compound rounding errors
+      b = annotation.box(o)
+      new_b, _, _ = transform(b, fixups, w, h)
+      if [int(round(v)) for v in new_b] != b:
+        annotation.set_box(o, new_b)
+        changed += 1
+    _, new_w, new_h = transform([0, 0, 0, 0], fixups, w, h)
+    if (new_w, new_h) != (w, h) and root.find('size') is not None:
+      root.find('size/width').text = str(new_w)
+      root.find('size/height').text = str(new_h)
+      changed += 1
+    if changed and not dry_run:
+      annotation.write(root, xml_in)
+    return xml_in, changed, None
+  except Exception as ex:
+    return xml_in, 0, str(ex)
+
+def clean_helper(args):
+  return clean(*args)
+
 if __name__ == '__main__':
   args = process_command_line()
-
-  for xml_in in glob.iglob(args.input_dir + '/*.xml'):
-    print('Found {}'.format(xml_in))
-    with open(xml_in, 'r') as myfile:
-      data = myfile.read().replace('\n', '')
-      if 'ymin' in data and 'ymax' in data:
-        command = "sed -i .bak  " \
-              "'s#ymin#YMAX#g;" \
-              "s#ymax#YMIN#g;" \
-              "s#YMAX#ymax#g;" \
-              "s#YMIN#ymin#g;' {} ".format(xml_in)
-        print(command)
-        subprocess.Popen(command, env=os.environ, shell=True)
+  fixups = get_fixups(args)
+  pool = multiprocessing.Pool(processes=max(1, args.jobs))
+  index = dataset.DatasetIndex(args.input_dir)
+  index.update(pool)
+  rows = index.query()
+  xml_files = [row['xml'] for row in rows]
+  print('Found {} annotations, applying {}'.format(len(xml_files), ', '.join(name for name, _ in fixups)))
+  work = [(row['xml'], fixups, args.dry_run, (row['width'], row['height']) if row['width'] else None) for row in rows]
+  files_changed = 0
+  boxes_changed = 0
+  failed = 0
+  changed_files = []
+  for xml_in, changed, error in pool.imap_unordered(clean_helper, work, chunksize=64):
+    if error:
+      print('Error {}: {}'.format(xml_in, error))
+      failed += 1
+    elif changed:
+      print('{} {}'.format('Would change' if args.dry_run else 'Changed', xml_in))
+      files_changed += 1
+      boxes_changed += changed
+      changed_files.append(xml_in)
+  if changed_files and not args.dry_run:
+    index.update(pool, changed_files)
+  pool.close()
+  pool.join()
+  index.close()
+  print('{} annotations: {} {}changed ({} boxes/sizes), {} unchanged, {} failed'.format(
+    len(xml_files), files_changed, 'would be ' if args.dry_run else '', boxes_changed,
+    len(xml_files) - files_changed - failed, failed))
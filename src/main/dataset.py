@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Persistent SQLite index of an annotation dataset: each annotation with its image path, image and
+annotated dimensions, frame timestamp, dive, label counts and file modification times. The index
+is updated incrementally, so only annotations or images that changed since the last run are read
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import sys
+import glob
+import json
+import sqlite3
+import annotation
+import imageinfo
+import tagging
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS annotations (
+    xml TEXT PRIMARY KEY,
+    xml_size INTEGER,
+    xml_mtime INTEGER,
+    image TEXT,
+    image_size INTEGER,
+    image_mtime INTEGER,
+    width INTEGER,
+    height INTEGER,
+    size_width INTEGER,
+    size_height INTEGER,
+    timestamp TEXT,
+    dive TEXT,
+    labels TEXT
+);
+CREATE INDEX IF NOT EXISTS annotations_image ON annotations (image);
+CREATE INDEX IF NOT EXISTS annotations_dive ON annotations (dive, timestamp);
+'''
+COLUMNS = ['xml', 'xml_size', 'xml_mtime', 'image', 'image_size', 'image_mtime', 'width', 'height',
+           'size_width', 'size_height', 'timestamp', 'dive', 'labels']
+INDEX_NAME = '.dataset.sqlite'
+
+
+def stat(path):
+    '''
+    :return: (size, integer mtime) of a file, or (None, None) if it does not exist
+    '''
+    try:
+        s = os.stat(path)
+        return s.st_size, int(s.st_mtime)
+    except OSError:
+        return None, None
+
+
+def scan(xml_in, row=None):
+    '''
+    reads the index row of an annotation; the image header and tags are only read again if the
+    image changed since row was indexed
+    :param xml_in: full path to the annotation xml
+    :param row: the previous row of the annotation as a dictionary, or None
+    :return: row dictionary
+    '''
+    root = annotation.read(xml_in)
+    xml_size, xml_mtime = stat(xml_in)
+    image_path = annotation.image_path(root, xml_in)
+    image_size, image_mtime = stat(image_path)
+    size_width, size_height = annotation.size(root)
+    labels = {}
+    for o in root.iter('object'):
+        name = o.findtext('name') or ''
+        labels[name] = labels.get(name, 0) + 1
+    new = {'xml': xml_in, 'xml_size': xml_size, 'xml_mtime': xml_mtime, 'image': image_path,
+           'image_size': image_size, 'image_mtime': image_mtime, 'width': None, 'height': None,
+           'size_width': size_width, 'size_height': size_height, 'timestamp': None, 'dive': None,
+           'labels': json.dumps(labels, sort_keys=True)}
+    if row and (row['image'], row['image_size'], row['image_mtime']) == (image_path, image_size, image_mtime):
+        for key in ('width', 'height', 'timestamp', 'dive'):
+            new[key] = row[key]
+    elif image_size is not None:
+        try:
+            info = imageinfo.read_header(image_path)
+            new['width'], new['height'] = info['width'], info['height']
+            tags = tagging.read_tags(image_path)
+            new['timestamp'], new['dive'] = tags.get('Datetime'), tags.get('Dive')
+        except Exception as ex:
+            print('Cannot read {}: {}'.format(image_path, ex))
+    return new
+
+
+def scan_helper(args):
+    try:
+        return args[0], scan(*args), None
+    except Exception as ex:
+        return args[0], None, str(ex)
+
+
+class DatasetIndex():
+    def __init__(self, input_dir, index_path=None):
+        '''
+        the DatasetIndex class keeps the index of the annotations in a directory in SQLite
+
+        :param input_dir: directory of the annotation xml files
+        :param index_path: full path to the index; defaults to {input_dir}/.dataset.sqlite
+
+        :Example:
+        index = DatasetIndex('/mnt/RAID/data/imgs/annotations')
+        index.update()
+        for row in index.query(dive='D0232'):
+            print(row['image'], row['width'], row['height'])
+        '''
+        self.input_dir = os.path.abspath(input_dir)
+        self.index_path = index_path or os.path.join(input_dir, INDEX_NAME)
+        self.db = sqlite3.connect(self.index_path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def rows(self):
+        '''
+        :return: dictionary of xml path to row of all indexed annotations
+        '''
+        return dict((r['xml'], dict(r)) for r in self.db.execute('SELECT * FROM annotations'))
+
+    def update(self, pool=None, xml_files=None):
+        '''
+        brings the index up to date, reading only annotations whose xml or image changed and
+        dropping annotations that were removed
+        :param pool: optional multiprocessing pool to read changed annotations in parallel
+        :param xml_files: annotations to check; defaults to every xml in the input directory
+        :return: (number of annotations read, number removed)
+        '''
+        rows = self.rows()
+        if xml_files is None:
+            xml_files = glob.glob(self.input_dir + '/*.xml')
+            found = set(xml_files)
+            removed = set(xml for xml in rows if xml not in found)
+        else:
+            removed = set(xml for xml in xml_files if xml in rows and not os.path.exists(xml))
+        changed = []
+        for xml_in in xml_files:
+            row = rows.get(xml_in)
+            if xml_in in removed:
+                continue
+            if row is None or (row['xml_size'], row['xml_mtime']) != stat(xml_in) or \
+                    (row['image_size'], row['image_mtime']) != stat(row['image']):
+                changed.append((xml_in, row))
+        results = pool.imap_unordered(scan_helper, changed, chunksize=64) if pool else map(scan_helper, changed)
+        with self.db:
+            self.db.executemany('DELETE FROM annotations WHERE xml = ?', [(xml,) for xml in removed])
+            for xml_in, row, error in results:
+                if error:
+                    print('Cannot index {}: {}'.format(xml_in, error))
+                    continue
+                self.db.execute('INSERT OR REPLACE INTO annotations ({}) VALUES ({})'.format(
+                    ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))), [row[c] for c in COLUMNS])
+        return len(changed), len(removed)
+
+    def query(self, where=None, params=(), dive=None, label=None):
+        '''
+        queries indexed annotations, sorted by xml path
+        :param where: optional SQL condition, e.g. 'width != ? OR height != ?'
+        :param params: parameters of the condition
+        :param dive: only annotations of frames from this dive
+        :param label: only annotations with at least one object with this label
+        :return: list of row dictionaries; labels are decoded to a dictionary of label to count
+        '''
+        conditions = [where] if where else []
+        params = list(params)
+        if dive is not None:
+            conditions.append('dive = ?')
+            params.append(dive)
+        sql = 'SELECT * FROM annotations'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join('({})'.format(c) for c in conditions)
+        rows = []
+        for r in self.db.execute(sql + ' ORDER BY xml', params):
+            row = dict(r)
+            row['labels'] = json.loads(row['labels'] or '{}')
+            if label is None or label in row['labels']:
+                rows.append(row)
+        return rows
+
+    def close(self):
+        self.db.close()
+
+
+def process_command_line():
+    import argparse
+    from argparse import RawTextHelpFormatter
+
+    examples = 'Examples:' + '\n\n'
+    examples += sys.argv[0] + " -i /mnt/RAID/data/imgs/annotations --dive D0232"
+    parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter,
+                                     description='Update and query the dataset index of an annotation directory',
+                                     epilog=examples)
+    parser.add_argument('-i', '--input_dir', action='store', help='full path to the directory of annotation xml files',
+                        required=True)
+    parser.add_argument('--dive', action='store', help='list annotations of this dive', required=False)
+    parser.add_argument('-l', '--label', action='store', help='list annotations with this label', required=False)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = process_command_line()
+    index = DatasetIndex(args.input_dir)
+    changed, removed = index.update()
+    print('Indexed {} changed and {} removed annotations in {}'.format(changed, removed, index.index_path))
+    if args.dive or args.label:
+        for row in index.query(dive=args.dive, label=args.label):
+            print('{} {} {}x{} {} {}'.format(row['xml'], row['image'], row['width'], row['height'], row['timestamp'],
+                                             ' '.join('{}:{}'.format(k, v) for k, v in sorted(row['labels'].items()))))
+    index.close()
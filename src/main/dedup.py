@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Finds near-duplicate extracted frames with 64-bit perceptual hashes (dHash and aHash) computed in
+batches on frames downscaled with numpy, and reports, deletes or hard links the duplicates within
+each video or across all videos of an output directory
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import sys
+import glob
+import json
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import catalog
+from manifest import Manifest
+
+EXTENSIONS = ('.png', '.jpg', '.webp', '.npy')
+ACTIONS = ['report', 'delete', 'link']
+
+
+def find_frames(input_dir):
+    '''
+    finds the frames the extractor wrote to {input_dir}/{key}/imgs
+    :param input_dir: extractor output directory
+    :return: dictionary of video key to sorted list of full paths to its frames
+    '''
+    frames = {}
+    for imgs in sorted(glob.glob('{}/*/imgs'.format(input_dir))):
+        key = os.path.basename(os.path.dirname(imgs))
+        frames[key] = sorted(os.path.join(imgs, f) for f in os.listdir(imgs) if f.endswith(EXTENSIONS))
+    return frames
+
+
+def block_mean(img, rows, cols):
+    '''
+    downscales an image to rows x cols by averaging equal blocks, cropping the remainder
+    :param img: 2d array
+    :return: rows x cols float array
+    '''
+    h, w = img.shape[0] // rows, img.shape[1] // cols
+    return img[:h*rows, :w*cols].reshape(rows, h, cols, w).mean(axis=(1, 3))
+
+
+def load_grids(path):
+    '''
+    loads a frame as grayscale, decoded at a quarter size when the format allows, and downscales it to
+    the 8x9 dHash grid and the 8x8 aHash grid
+    :param path: full path to the frame
+    :return: (8x9 grid, 8x8 grid), or None if the frame cannot be read
+    '''
+    if path.endswith('.npy'):
+        img = np.load(path, mmap_mode='r')
+        img = img[::4, ::4].mean(axis=2) if img.ndim == 3 else img[::4, ::4]
+    else:
+        img = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if img is None or img.shape[0] < 8 or img.shape[1] < 9:
+        return None
+    img = np.asarray(img, dtype=np.float32)
+    return block_mean(img, 8, 9), block_mean(img, 8, 8)
+
+
+def pack(bits):
+    '''
+    packs rows of 64 booleans to 64-bit hashes
+    :param bits: N x 64 boolean array
+    :return: list of N integer hashes
+    '''
+    return [int(h) for h in np.packbits(bits, axis=1).view('>u8').ravel()]
+
+
+def hash_batch(grids):
+    '''
+    computes the hashes of a batch of frames at once
+    :param grids: list of (8x9 grid, 8x8 grid) as returned by load_grids()
+    :return: (list of dHashes, list of aHashes)
+    '''
+    grid9 = np.stack([g[0] for g in grids])
+    grid8 = np.stack([g[1] for g in grids])
+    n = len(grids)
+    # dHash: is each pixel brighter than its left neighbor; aHash: is each pixel brighter than the mean
+    dhash = (grid9[:, :, 1:] > grid9[:, :, :-1]).reshape(n, 64)
+    ahash = (grid8 > grid8.mean(axis=(1, 2), keepdims=True)).reshape(n, 64)
+    return pack(dhash), pack(ahash)
+
+
+def distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class HammingIndex():
+    def __init__(self, max_distance):
+        '''
+        the HammingIndex class finds hashes within a Hamming distance by splitting each 64-bit hash into
+        max_distance + 1 bands; two hashes within max_distance bits must share at least one band exactly,
+        so only hashes sharing a band are compared
+
+        :param max_distance: maximum number of differing bits
+
+        :Example:
+        index = HammingIndex(4)
+        index.add(0xf0f0f0f0f0f0f0f0, 'a.png')
+        index.query(0xf0f0f0f0f0f0f0f1)
+        '''
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        edges = [64 * i // bands for i in range(bands + 1)]
+        self.masks = [(shift, (1 << (end - shift)) - 1) for shift, end in zip(edges[:-1], edges[1:])]
+        self.buckets = {}
+
+    def keys(self, h):
+        return [(i, (h >> shift) & mask) for i, (shift, mask) in enumerate(self.masks)]
+
+    def add(self, h, item):
+        for key in self.keys(h):
+            self.buckets.setdefault(key, []).append((h, item))
+
+    def query(self, h):
+        '''
+        :param h: hash
+        :return: list of (distance, item) within max_distance, closest first
+        '''
+        found = {}
+        for key in self.keys(h):
+            for other, item in self.buckets.get(key, []):
+                d = distance(h, other)
+                if d <= self.max_distance:
+                    found[id(item)] = (d, item)
+        return sorted(found.values(), key=lambda f: f[0])
+
+
+def find_duplicates(frames, max_distance=4, across=False, batch=256, threads=4):
+    '''
+    hashes every frame in batches and matches each against the earlier frames kept so far, so the first
+    frame of a run of near-duplicates is kept
+    :param frames: dictionary of video key to sorted list of frames, as returned by find_frames()
+    :param max_distance: maximum number of differing bits in both the dHash and aHash of a duplicate
+    :param across: if True, match frames across all videos, otherwise only within each video
+    :param batch: number of frames hashed at once
+    :param threads: number of threads decoding frames
+    :return: (list of (duplicate, original, dhash distance, ahash distance), number of frames hashed, unreadable frames)
+    '''
+    duplicates = []
+    unreadable = []
+    hashed = 0
+    index = HammingIndex(max_distance)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for key in sorted(frames):
+            if not across:
+                index = HammingIndex(max_distance)
+            paths = frames[key]
+            for i in range(0, len(paths), batch):
+                chunk = paths[i:i + batch]
+                grids = list(pool.map(load_grids, chunk))
+                unreadable.extend(p for p, g in zip(chunk, grids) if g is None)
+                chunk = [p for p, g in zip(chunk, grids) if g is not None]
+                grids = [g for g in grids if g is not None]
+                if not grids:
+                    continue
+                dhashes, ahashes = hash_batch(grids)
+                hashed += len(grids)
+                for path, dh, ah in zip(chunk, dhashes, ahashes):
+                    match = None
+                    for d, (original, original_ah) in index.query(dh):
+                        if distance(ah, original_ah) <= max_distance:
+                            match = (path, original, d, distance(ah, original_ah))
+                            break
+                    if match:
+                        duplicates.append(match)
+                    else:
+                        index.add(dh, (path, ah))
+    return duplicates, hashed, unreadable
+
+
+def link(original, path):
+    '''
+    atomically replaces path with a hard link to original
+    '''
+    tmp = '{}.tmp{}'.format(path, os.getpid())
+    os.link(original, tmp)
+    os.rename(tmp, path)
+
+
+def remove_duplicate(duplicate, original, action):
+    '''
+    deletes a duplicate frame and its json sidecar, or replaces both with hard links to the original, so the
+    duplicate carries the tags of the original
+    :return: True if the duplicate was changed
+    '''
+    if action == 'delete':
+        os.remove(duplicate)
+        sidecar = os.path.splitext(duplicate)[0] + '.json'
+        if os.path.exists(sidecar):
+            os.remove(sidecar)
+        return True
+    if action == 'link':
+        # a link must keep the format its name says, and links cannot cross file systems
+        if os.path.splitext(duplicate)[1] != os.path.splitext(original)[1] or os.path.samefile(duplicate, original):
+            return False
+        try:
+            link(original, duplicate)
+            original_sidecar = os.path.splitext(original)[0] + '.json'
+            if os.path.exists(original_sidecar):
+                link(original_sidecar, os.path.splitext(duplicate)[0] + '.json')
+        except OSError as ex:
+            print('Cannot link {} to {}: {}'.format(duplicate, original, ex))
+            return False
+        return True
+    return False
+
+
+def update_manifests(input_dir, changed):
+    '''
+    records again every manifest window with a deleted or relinked frame, so resumed extraction sees the
+    window as finished with the frames that remain
+    :param input_dir: extractor output directory
+    :param changed: list of full paths to the changed frames
+    :return:
+    '''
+    by_key = {}
+    for path in changed:
+        key_dir = os.path.dirname(os.path.dirname(path))
+        by_key.setdefault(key_dir, set()).add(os.path.relpath(path, key_dir))
+    for key_dir, names in by_key.items():
+        path = os.path.join(key_dir, 'manifest.jsonl')
+        if not os.path.exists(path):
+            continue
+        manifest = Manifest(path)
+        for window, record in list(manifest.windows.items()):
+            if names.intersection(record['files']):
+                files = [os.path.join(key_dir, f) for f in sorted(record['files']) if os.path.exists(os.path.join(key_dir, f))]
+                manifest.record(window, files)
+        manifest.close()
+
+
+def update_catalogs(links):
+    '''
+    rewrites the catalog records of duplicates replaced with links to the frame number, time and dive of their
+    original, so the catalog matches the Datetime tags the linked files now carry
+    :param links: list of (duplicate, original) full paths
+    :return:
+    '''
+    rows = {}
+
+    def catalog_rows(path):
+        catalog_path = os.path.join(os.path.dirname(os.path.dirname(path)), 'catalog.csv')
+        if catalog_path not in rows:
+            rows[catalog_path] = catalog.read_rows(catalog_path) if os.path.exists(catalog_path) else {}
+        return catalog_path, rows[catalog_path]
+
+    changed = set()
+    for duplicate, original in links:
+        _, originals = catalog_rows(original)
+        path, duplicates = catalog_rows(duplicate)
+        name = os.path.basename(duplicate)
+        row = originals.get(os.path.basename(original))
+        if row is not None and name in duplicates:
+            duplicates[name] = [name] + row[1:]
+            changed.add(path)
+    for path in sorted(changed):
+        catalog.save(path, rows[path].values())
+
+
+def process_command_line():
+    import argparse
+    from argparse import RawTextHelpFormatter
+
+    examples = 'Examples:' + '\n\n'
+    examples += sys.argv[0] + " -i /Volumes/Tempbox/danelle/benthic/ --across_videos --action link \n"
+    parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter,
+                                     description='Find near-duplicate frames in the extractor output',
+                                     epilog=examples)
+    parser.add_argument('-i', '--input_dir', action='store', help='extractor output directory with {key}/imgs directories', required=True)
+    parser.add_argument('-a', '--action', action='store', help='report duplicates, delete them, or replace them with hard links to the frame they duplicate',
+                        choices=ACTIONS, default='report', required=False)
+    parser.add_argument('-d', '--distance', action='store', help='maximum number of differing bits of 64 in both hashes of a duplicate', default=4, required=False, type=int)
+    parser.add_argument('--across_videos', action='store_true', help='find duplicates across videos, not only within each video', required=False)
+    parser.add_argument('--batch', action='store', help='number of frames hashed at once', default=256, required=False, type=int)
+    parser.add_argument('--threads', action='store', help='number of threads decoding frames', default=4, required=False, type=int)
+    parser.add_argument('--report', action='store', help='json lines report of the duplicates; defaults to {input_dir}/dedup.jsonl', required=False)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = process_command_line()
+    frames = find_frames(args.input_dir)
+    print('Found {} frames in {} videos'.format(sum(len(f) for f in frames.values()), len(frames)))
+    duplicates, hashed, unreadable = find_duplicates(frames, args.distance, args.across_videos, args.batch, args.threads)
+    changed = []
+    links = []
+    report_path = args.report or os.path.join(args.input_dir, 'dedup.jsonl')
+    with open(report_path, 'w') as f:
+        for duplicate, original, d, a in duplicates:
+            done = remove_duplicate(duplicate, original, args.action)
+            if done:
+                changed.append(duplicate)
+                if args.action == 'link':
+                    links.append((duplicate, original))
+            f.write(json.dumps({'duplicate': duplicate, 'original': original, 'dhash_distance': d,
+                                'ahash_distance': a, 'action': args.action if done else 'report'}) + '\n')
+    update_manifests(args.input_dir, changed)
+    update_catalogs(links)
+    for path in unreadable:
+        print('Cannot read {}'.format(path))
+    print('Hashed {} frames: {} duplicates, {} {}, {} unreadable; report in {}'.format(
+        hashed, len(duplicates), len(changed), 'deleted' if args.action == 'delete' else 'linked',
+        len(unreadable), report_path))
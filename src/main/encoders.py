@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Output frame encoders. Each encoder turns a decoded frame into file bytes and carries the
+Dive/Datetime tags, either embedded in the file or in a json sidecar
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import io
+import tagging
+import utils
+
+FORMATS = ['png', 'jpeg', 'webp', 'npy']
+
+
+def to_8bit(img):
+    '''
+    scales a 16-bit frame to 8 bits for formats that cannot store 16 bits
+    :param img: frame
+    :return: 8-bit frame
+    '''
+    if img.dtype.itemsize == 2:
+        return (img >> 8).astype('u1')
+    return img
+
+
+def imencode(ext, img, params):
+    '''
+    encodes a frame with opencv
+    :param ext: extension of the format, e.g. .png
+    :param img: frame
+    :param params: opencv encoding parameters
+    :return: encoded bytes
+    '''
+    import cv2
+    ok, encoded = cv2.imencode(ext, img, params)
+    if not ok:
+        raise Exception('Cannot encode a {} {} frame as {}'.format('x'.join(str(d) for d in img.shape), img.dtype, ext))
+    return encoded.tobytes()
+
+
+class Encoder():
+    ext = None
+    # True if the tags are stored in the encoded file, False if they go in a json sidecar
+    embeds_tags = True
+
+    def encode(self, img, tags):
+        '''
+        encodes a frame
+        :param img: frame, 8 or 16-bit
+        :param tags: list of (keyword, text) tuples to embed, or None
+        :return: encoded bytes
+        '''
+        raise NotImplementedError
+
+    def write(self, path, img, tags=None):
+        '''
+        encodes a frame and writes it, and its sidecar if the format cannot embed the tags
+        :param path: full path to the output frame
+        :param img: frame
+        :param tags: list of (keyword, text) tuples, or None
+        :return: number of bytes written
+        '''
+        return self.save(path, self.encode(img, tags), tags)
+
+    def save(self, path, data, tags=None):
+        '''
+        writes an encoded frame, and its sidecar if the format cannot embed the tags
+        :param path: full path to the output frame
+        :param data: encoded bytes, as returned by encode()
+        :param tags: list of (keyword, text) tuples, or None
+        :return: number of bytes written
+        '''
+        utils.write_atomic(path, data)
+        if tags and not self.embeds_tags:
+            tagging.write_sidecar(path, tags)
+        return len(data)
+
+
+class PngEncoder(Encoder):
+    ext = 'png'
+
+    def __init__(self, compression=None):
+        '''
+        :param compression: png compression level 0-9; 0 is fastest, defaults to the opencv default of 3
+        '''
+        self.compression = compression
+
+    def encode(self, img, tags):
+        # cv2 and numpy are imported on the first frame, so workers that never encode do not load them
+        import cv2
+        params = [cv2.IMWRITE_PNG_COMPRESSION, self.compression] if self.compression is not None else []
+        # 16-bit frames are written as 16-bit pngs
+        encoded = imencode('.png', img, params)
+        if tags:
+            return tagging.add_text(encoded, tags)
+        return encoded
+
+
+class JpegEncoder(Encoder):
+    ext = 'jpg'
+
+    def __init__(self, quality=None):
+        '''
+        :param quality: jpeg quality 0-100, defaults to 95
+        '''
+        self.quality = quality if quality is not None else 95
+
+    def encode(self, img, tags):
+        import cv2
+        encoded = imencode('.jpg', to_8bit(img), [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if tags:
+            return tagging.add_jpeg_comment(encoded, tags)
+        return encoded
+
+
+class WebpEncoder(Encoder):
+    ext = 'webp'
+    embeds_tags = False
+
+    def __init__(self, quality=None):
+        '''
+        :param quality: webp quality 1-100, above 100 is lossless; defaults to 90
+        '''
+        self.quality = quality if quality is not None else 90
+
+    def encode(self, img, tags):
+        import cv2
+        return imencode('.webp', to_8bit(img), [cv2.IMWRITE_WEBP_QUALITY, self.quality])
+
+
+class NpyEncoder(Encoder):
+    ext = 'npy'
+    embeds_tags = False
+
+    def __init__(self, quality=None):
+        '''
+        :param quality: unused; npy frames are stored uncompressed and can be loaded with np.load(mmap_mode='r')
+        '''
+
+    def encode(self, img, tags):
+        import numpy as np
+        f = io.BytesIO()
+        np.save(f, np.ascontiguousarray(img))
+        return f.getvalue()
+
+
+def get_encoder(output_format, quality=None):
+    '''
+    gets the encoder for an output format
+    :param output_format: one of FORMATS
+    :param quality: jpeg/webp quality, or png compression level
+    :return: Encoder
+    '''
+    if output_format == 'png':
+        return PngEncoder(quality)
+    if output_format == 'jpeg':
+        return JpegEncoder(quality)
+    if output_format == 'webp':
+        return WebpEncoder(quality)
+    if output_format == 'npy':
+        return NpyEncoder(quality)
+    raise Exception('{} not in {}'.format(output_format, FORMATS))
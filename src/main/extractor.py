@@ -15,21 +15,52 @@ Utility module for converting video to still frames and deinterlacing using the
 @license: __license__
 '''
 
-import logging
-from logging import handlers
 import sys
 import os
 import utils  
+import scheduler
+import probe
+from keyframes import KeyframeIndex
+import tagging
+import encoders
+import remote
+import runner
+import asyncio
+import collections
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from manifest import Manifest
+from shards import ShardWriter
+from stats import RunStats
 import multiprocessing
-import subprocess 
-import cv2
 import signal
 import re 
 from datetime import datetime, timedelta 
+from fractions import Fraction
 import glob
+import shutil
+import tempfile
+import time
+import json
+import fcntl
+
+# manifest of the video being processed in this process, flushed on SIGTERM
+active_manifest = None
+# length of the windows a range is recorded in, so a killed run only redoes the window in progress
+RANGE_WINDOW_SECONDS = 10
+# seconds between checks for the frames ffmpeg finished writing to a staging directory
+STAGE_POLL_SECONDS = 0.5
+# seconds a staging directory must exist before it is swept, so a run is never swept between creating its
+# lock file and locking it
+STAGING_GRACE_SECONDS = 60
 
 class Extractor():
-    def __init__(self, input_video_path, output_dir, deinterlace='drop', step=5, duration=1000, start=None, end=None, prefix=None):
+    def __init__(self, input_video_path, output_dir, deinterlace='drop', step=5, duration=1000, start=None, end=None, prefix=None,
+                 single_pass=False, realtime=False, workers=1, threads=None, pipe=False, start_number=1,
+                 resume=True, keyframe_index=False, output_format='png', quality=None, encode_threads=2,
+                 scene_threshold=None, scene_max=1, shard_bytes=None, report=None, cache_bytes=remote.CACHE_BYTES,
+                 max_procs=None, timeout=None, retries=2):
         '''
         the Extractor class contains all the necessary information to extract
         images from a video using ffmpeg. By default, it will extract a frame
@@ -39,9 +70,32 @@ class Extractor():
         :param output_dir: directory to store transcoded frames to
         :param step: extract a frame every 'step' seconds
         :param duration: duration in milliseconds to extract every step seconds
-        :param start: starting time to extracting images
+        :param start: starting time to extracting images; defaults to the start of the video
         :param end: ending time to finish extracting images
         :param prefix: frame starting prefix to prepend to extracted frames
+        :param single_pass: if True, decode the video once and extract every step window from that single stream
+        :param realtime: if True, read a live or streamed url input at its native frame rate; ignored for files
+        :param workers: number of extractors running concurrently on this host, used to divide the decoder threads
+        :param threads: number of ffmpeg decoder threads; defaults to the cpus available to each worker
+        :param pipe: if True, read raw frames from ffmpeg over a pipe and encode each frame once, deinterlacing in memory
+        :param start_number: number of the first frame when extracting all frames, e.g. for a segment of a longer range
+        :param resume: if True, skip the windows the video manifest records as finished
+        :param keyframe_index: if True, build or load the keyframe index of the video to seek exactly to keyframes and
+        decode through short gaps between windows instead of seeking
+        :param output_format: output frame format, one of encoders.FORMATS; formats other than png are encoded in pipe mode
+        :param quality: jpeg/webp quality or png compression level
+        :param encode_threads: number of threads encoding frames in pipe mode
+        :param scene_threshold: if set, decode every frame over a pipe and keep only frames whose color histogram differs
+        from the last kept frame by more than this threshold (0-1), instead of a fixed duration every step
+        :param scene_max: maximum number of frames kept per step window in scene mode, or None for no limit
+        :param shard_bytes: if set, write the frames and their json tags to tar shards of at most this many bytes in
+        {output_dir}/{key}/shards instead of one file per frame in {output_dir}/{key}/imgs
+        :param report: json lines file to append the per-window and per-video timing and throughput records to
+        :param cache_bytes: maximum size of the on-disk block cache http videos are read through, or 0 to have ffmpeg
+        read http videos directly
+        :param max_procs: maximum number of ffmpeg processes running at once on this host, across all workers
+        :param timeout: seconds before an ffmpeg or ffprobe process is killed, or None for no timeout
+        :param retries: number of times a window whose ffmpeg failed or timed out is extracted again
         
         :Example:
         Extract every 5th frame using drop deinterlacing
@@ -52,22 +106,75 @@ class Extractor():
         self.key = fname.split('.')[0]
         self.output_dir = '{0}/{1}/imgs'.format(output_dir, self.key)
         utils.ensure_dir(self.output_dir)
+        # frames are staged outside imgs, in a directory per run created on first use
+        self.staging_root = '{0}/{1}/staging'.format(output_dir, self.key)
+        self.staging_dir = None
+        self.staging_lock = None
+        self.resume = resume
+        self.stats = RunStats(input_video_path, report)
+        self.runner = runner.Runner(max_procs, timeout, retries)
+        self.manifest = Manifest('{0}/{1}/manifest.jsonl'.format(output_dir, self.key))
+        # numpy, cv2 and the modules using them are imported on the code paths that need them, so starting a
+        # worker for a short clip stays fast; the catalog is opened with the first recorded window
+        self.catalog = None
+        self.catalog_path = '{0}/{1}/catalog.csv'.format(output_dir, self.key)
         self.seconds_counter = 0
         self.duration = duration
         self.step = step
-        self.start = start
+        # the command line defaults to the start of the video; do the same for callers of the API
+        self.start = start or datetime.strptime('00:00:00', '%H:%M:%S')
         self.end = end
         self.prefix = prefix
-        self.video_length = utils.get_length(input_video_path)
-        self.fps = 29.97 #utils.get_framerate(input_video_path)
+        self.start_number = start_number
+        self.single_pass = single_pass
+        self.realtime = realtime and utils.is_url(input_video_path)
+        if realtime and not self.realtime:
+            print('Ignoring realtime for {}; real-time pacing is only used for url inputs'.format(input_video_path))
+        if threads is None:
+            threads = max(1, multiprocessing.cpu_count() // max(1, workers))
+        self.threads = threads
+        info = probe.probe(input_video_path, runner=self.runner)
+        self.video_length = int(round(info['duration']))
+        self.frame_rate = probe.frame_rate(info)
+        self.fps = float(self.frame_rate)
+        self.width = info['width']
+        self.height = info['height']
+        self.bit_depth = info['bit_depth']
+        self.encoder = encoders.get_encoder(output_format, quality)
+        self.encode_threads = max(1, encode_threads)
+        # ffmpeg only writes default pngs, so other formats and png compression levels are encoded from the pipe
+        self.pipe = pipe or output_format != 'png' or quality is not None or scene_threshold is not None or \
+                    shard_bytes is not None
+        self.scene_threshold = scene_threshold
+        self.scene_max = scene_max
+        self.input_url = input_video_path
+        self.remote = None
+        if cache_bytes and not self.realtime and remote.is_http(input_video_path):
+            self.remote = remote.RemoteInput(input_video_path, info['duration'], cache_bytes)
+            self.input_url = self.remote.url
+        self.keyframes = None
+        if keyframe_index and not utils.is_url(input_video_path):
+            self.keyframes = KeyframeIndex(input_video_path, runner=self.runner)
+        self.shards = None
+        if shard_bytes is not None:
+            # each segment writes its own shards so concurrent segments never share a file
+            first = self.start
+            self.shards = ShardWriter('{0}/{1}/shards'.format(output_dir, self.key),
+                                      '{0}_{1:02}-{2:02}-{3:02}'.format(self.key, first.hour, first.minute, first.second),
+                                      shard_bytes)
         self.single_frame = False
         if duration is None:
             self.duration = 1e3/self.fps + 1  # default to a single frame
             self.single_frame = True
+        # the single pass select filter gives each frame to one window at most, so windows longer than the step,
+        # which overlap, are each decoded on their own like without --single_pass
+        self.overlapping = step is not None and self.duration > step*1e3
+        if self.single_pass and self.overlapping:
+            print('Extracting {} window by window; {} ms windows every {} seconds overlap, which a single pass cannot '
+                  'extract'.format(input_video_path, self.duration, step))
+            self.single_pass = False
         if prefix is None:
             self.prefix = "f"
-        # To time methods, uncomment line below
-        #self.times = []
         self.deinterlace = deinterlace 
         self.start_iso_time = datetime.now()
         self.dive = 'Unknown'
@@ -87,63 +194,76 @@ class Extractor():
                 if match.group('dive'):
                     self.dive = match.group('dive') 
     
-        print('Dive {} timecode start {} length {} seconds'.format(self.dive, self.start_iso_time, self.video_length))  
+        print('Dive {} timecode start {} length {} seconds {}x{} {} fps {} {}'.format(self.dive, self.start_iso_time,
+                                                                               self.video_length, self.width,
+                                                                               self.height, self.frame_rate,
+                                                                               info['pix_fmt'], info['field_order']))
     
     def __del__(self):
         print('Done')
-        # To time methods, uncomment line below
-        #if self.times and len(self.times) > 0:
-        #    import numpy as np
-        #    m = np.array(self.times)
-        #    print('Mean {}'.format(m.mean()))
 
-    def extract_all_images(self, start, end):
+    def call_ffmpeg(self, shell_string):
         '''
-        extracts image(s) from video between timecodes and saves it to output_path
-        :param start:  starting time
-        :param end:  ending time
+        runs an ffmpeg command without a shell in a process slot of the runner, adding its run time to the
+        ffmpeg stage
+        :param shell_string: ffmpeg command
+        :return:
+        :raises runner.ProcessError: if ffmpeg fails or times out
+        '''
+        with self.stats.timer('ffmpeg'):
+            asyncio.run(self.runner.run(runner.split(shell_string)))
+
+    def ffmpeg_prefix(self, continuous):
+        '''
+        builds the start of the ffmpeg command line common to all extractions
+        :param continuous: True if decoding a continuous range, False if decoding short windows after a seek
+        :return: ffmpeg command string up to the input options
+        '''
+        shell_string = 'ffmpeg -y'
+        if self.realtime:
+            shell_string += ' -re'
+        # frame threads add a frame of latency per thread after every seek, so short windows only use slice threads
+        thread_type = 'frame+slice' if continuous else 'slice'
+        shell_string += ' -loglevel error -threads {} -thread_type {}'.format(self.threads, thread_type)
+        return shell_string
+
+    def extract_all_images(self, windows):
+        '''
+        extracts every frame of a run of consecutive range windows in one ffmpeg call, recording each window as
+        soon as its last frame is written
+        :param windows:  list of consecutive (start, end) windows as generated by range_windows()
         :return: total frames extracted
         :Example:
-        self.extract_all_images('00:11:40', '00:11:41')
+        self.extract_all_images(self.range_windows(self.start, self.end))
         '''
-        timecode_str = '{0:02}:{1:02}:{2:02}.{3:03}'.format(start.hour, start.minute, start.second,
-                                                            int(start.microsecond / 1e3))
-        output_path = '{}/{}%06d.png'.format(self.output_dir, self.prefix)
-        frames = int((end - start).total_seconds() * self.fps)
-        if self.deinterlace == 'drop':
-            shell_string = 'ffmpeg -y -re -loglevel error -accurate_seek -ss {} -i {} -an -frames:v {} {}'.format(timecode_str,
-                                                                       self.input_video_path, frames, output_path)
-            print(shell_string)
-            subprocess.call(shell_string, shell=True)
-            for i in glob.glob('{}/{}*.png'.format(self.output_dir, self.prefix)):
-                # retain 16-bit depth if exists
-                img = cv2.imread(i, cv2.IMREAD_UNCHANGED)
-                de_interlaced_img = img[::2, 1::2]
-                cv2.imwrite(i, de_interlaced_img)
-        elif self.deinterlace == 'yadif':
-            shell_string = 'ffmpeg -y -re -loglevel error -accurate_seek -ss {} -i {} -vf yadif=1:-1:0 -an -frames:v {} {}'.\
-                                                                        format(timecode_str,
-                                                                       self.input_video_path, frames, output_path)
-            subprocess.call(shell_string, shell=True)
+        first = self.range_offset(windows[0][0])
+        bounds = [self.range_offset(end) - first for _, end in windows]
+        frames = bounds[-1]
+        output_pngs = ['{}/{}{:06d}.{}'.format(self.output_dir, self.prefix, self.start_number + first + i,
+                                              self.encoder.ext) for i in range(frames)]
+        numbers = self.frame_numbers(self.start, first + frames)[first:]
+        recorded = [0]
+
+        def record(k, extracted):
+            a = bounds[k - 1] if k else 0
+            b = max(a, min(bounds[k], extracted))
+            self.record_window(windows[k][0], windows[k][1], output_pngs[a:b], numbers[a:b])
+
+        def written(count):
+            while recorded[0] < len(windows) and bounds[recorded[0]] <= count:
+                record(recorded[0], count)
+                recorded[0] += 1
+
+        vf = ' -vf yadif=1:-1:0' if self.deinterlace == 'yadif' else ''
+        input_string = self.ffmpeg_prefix(continuous=True) + self.seek_input(windows[0][0]) + vf
+        if self.pipe:
+            extracted = self.pipe_images(input_string, output_pngs, self.window_tags(numbers), numbers, written)
         else:
-            shell_string = 'ffmpeg -y -re -loglevel error -accurate_seek -ss {} -i {} -an -frames:v {} {}'.format(timecode_str,
-                                                                                                 self.input_video_path,  frames, output_path)
-            subprocess.call(shell_string, shell=True)
-
-        return int((end - start).total_seconds() * self.fps)
-        '''frames = int((end - start).total_seconds() * self.fps)
-        inc_microseconds = int(1e6/self.fps)
-        dt = self.start_iso_time + timedelta(seconds=start.second)
-        for i in range(frames):
-            output_path = '{0}/{1}_{2:03}.png'.format(self.output_dir,filename_prefix, i+1)
-            s = dt.strftime('%Y%m%dT%H%M%S.%f')
-            dt_iso_str = s[:-3] + 'Z' #here we simply truncate; this may be off by by half a millisecond
-            print('Datetime {}'.format(dt_iso_str))
-            shell_string = 'exiftool -config mbari.config -PNG:Dive="{}" -PNG:Datetime="{}" {}'.format(self.dive, dt_iso_str, output_path)
-            subprocess.call(shell_string, shell=True, stdout=file_out, stderr=file_out)
-            output_path_original = '{}_original'.format(output_path)
-            os.remove(output_path_original)
-            dt += timedelta(microseconds=inc_microseconds)'''
+            extracted = self.stage_frames(input_string + ' -an -frames:v {}'.format(frames), output_pngs, written)
+        # windows past the end of the video get the frames ffmpeg found
+        for k in range(recorded[0], len(windows)):
+            record(k, extracted)
+        return extracted
 
     def extract_images(self, start, end):
         ''''
@@ -154,101 +274,909 @@ class Extractor():
         :Example:
         self.extract_images('00:11:40', '00:11:41')
         '''
-        file_out = open('/dev/null', 'w')
+        if not self.pipe:
+            return self.finish_window((start, end), asyncio.run(self.decode_window((start, end))))
+        frames = int((end - start).total_seconds() * self.fps)
+        vf = ' -vf yadif=1:-1:0' if self.deinterlace == 'yadif' else ''
+        input_string = self.ffmpeg_prefix(continuous=False) + self.seek_input(start) + vf
+        numbers = self.frame_numbers(start, frames)
+        frames = self.pipe_images(input_string, [self.output_frame(start, i) for i in range(frames)],
+                                  self.window_tags(numbers), numbers)
+        self.record_window(start, end, self.window_paths(start, frames))
+        return frames
+
+    async def decode_window(self, window):
+        '''
+        runs ffmpeg for a window, writing its frames to the output directory, or to a staging directory
+        when drop deinterlacing so only the frames from this window are deinterlaced
+        :param window:  (start, end) window
+        :return: (frames, staging directory or None)
+        '''
+        start, end = window
         filename_prefix = '{0}_{1:02}-{2:02}-{3:02}'.format(self.key, start.hour, start.minute, start.second)
-        timecode_str = '{0:02}:{1:02}:{2:02}.{3:03}'.format(start.hour, start.minute, start.second, int(start.microsecond/1e3))
         frames = int((end - start).total_seconds() * self.fps)
         if self.single_frame:
             output_path = '{0}/{1}.png'.format(self.output_dir,filename_prefix)
         else:
             output_path = '{0}/{1}_%03d.png'.format(self.output_dir,filename_prefix)
+        staging_dir = None
         if self.deinterlace == 'drop':
-            shell_string = 'ffmpeg -y -re -loglevel error -accurate_seek -ss {} -i {} -frames:v {} -an {}'.format(timecode_str,
-                                                                       self.input_video_path, frames,
-                                                                       output_path)
-            subprocess.call(shell_string, shell=True, stdout=file_out, stderr=file_out)
-            for i in glob.glob('{}/f*.png'.format(self.output_dir)):
-                img = cv2.imread(i)
-                de_interlaced_img = img[::2, 1::2]
-                cv2.imwrite(i, de_interlaced_img)
+            staging_dir = tempfile.mkdtemp(prefix='drop_', dir=self.staging())
+            output_string = ' -frames:v {} -an {}/%08d.png'.format(frames, staging_dir)
         elif self.deinterlace == 'yadif':
-            shell_string = 'ffmpeg -y -re -loglevel error -accurate_seek -ss {} -i {} -vf yadif=1:-1:0 -frames:v {} -an {}'.format(timecode_str,
-                                                                       self.input_video_path, frames,
-                                                                       output_path)
-            subprocess.call(shell_string, shell=True, stdout=file_out, stderr=file_out)
-        else: 
-            shell_string = 'ffmpeg -y -re -loglevel error -accurate_seek -ss {} -i {} -frames:v {} -an {}'.format(timecode_str,
-                                                                       self.input_video_path, frames,
-                                                                       output_path)
-            print(shell_string)
-            subprocess.call(shell_string, shell=True, stdout=file_out, stderr=file_out)
-             
-        inc_microseconds = int(1e6/self.fps)
-        dt = self.start_iso_time + timedelta(seconds=start.second)
-        for i in range(frames):
-            if self.single_frame:
-                output_png = '{0}/{1}.png'.format(self.output_dir, filename_prefix)
+            output_string = ' -vf yadif=1:-1:0 -frames:v {} -an {}'.format(frames, output_path)
+        else:
+            output_string = ' -frames:v {} -an {}'.format(frames, output_path)
+        shell_string = self.ffmpeg_prefix(continuous=False) + self.seek_input(start) + output_string
+        print(shell_string)
+        try:
+            with self.stats.timer('ffmpeg'):
+                await self.runner.run(runner.split(shell_string))
+        except BaseException:
+            # also when the decode ahead is cancelled or the worker exits on SIGTERM
+            if staging_dir is not None:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        return frames, staging_dir
+
+    def finish_window(self, window, decoded):
+        '''
+        moves and drop deinterlaces the staged frames of a decoded window, tags them and records the window
+        :param window:  (start, end) window
+        :param decoded:  (frames, staging directory or None) as returned by decode_window(), or the exception
+        raised decoding the window
+        :return: frames extracted
+        '''
+        if isinstance(decoded, Exception):
+            raise decoded
+        start, end = window
+        frames, staging_dir = decoded
+        if staging_dir is not None:
+            try:
+                frames = self.move_staged(self.staged_pngs(staging_dir), [self.output_frame(start, i) for i in range(frames)])
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+        self.tag_images(start, frames)
+        self.record_window(start, end, self.window_paths(start, frames))
+        return frames
+
+    def extract_windows(self, windows):
+        '''
+        extracts step windows to files, running ffmpeg for the next window while the frames of the current
+        window are deinterlaced, tagged and recorded
+        :param windows:  list of (start, end) windows
+        :return: total frames extracted
+        '''
+        def finish(window, decoded):
+            # decode_window was already retried by the pipeline
+            return self.run_window(self.manifest_key(*window), self.finish_window, window, decoded, retries=0)
+        return sum(self.runner.pipeline(windows, self.decode_window, finish))
+
+    def record_window(self, start, end, paths, numbers=None):
+        '''
+        records a finished window in the catalog and the manifest
+        :param start:  starting time of the window
+        :param end:  ending time of the window
+        :param paths:  full paths to the frames extracted in the window; in shard mode only their number is recorded
+        :param numbers:  number of each frame in the video; defaults to consecutive frames from the window start
+        :return:
+        '''
+        self.stats.count('frames', len(paths))
+        if numbers is None:
+            numbers = self.frame_numbers(start, len(paths))
+        import catalog
+        if self.catalog is None:
+            self.catalog = catalog.Catalog(self.catalog_path)
+        pts = catalog.frame_pts(numbers, self.frame_rate)
+        times = catalog.frame_times(self.start_iso_time, numbers, self.frame_rate)
+        with self.stats.timer('fs'):
+            # frames are named as in imgs, or as the tar members in shard mode
+            self.catalog.record([os.path.basename(path) for path in paths], numbers, pts, times, self.dive)
+            if self.shards is not None:
+                # the frames are in the shard before their window is recorded as finished
+                self.shards.flush()
+                shards = self.shards.take([os.path.splitext(os.path.basename(path))[0] for path in paths])
+                self.manifest.record(self.manifest_key(start, end), [], frames=len(paths), shards=shards)
             else:
-                output_png = '{0}/{1}_{2:03}.png'.format(self.output_dir, filename_prefix, i+1)
-            s = dt.strftime('%Y%m%dT%H%M%S.%f')
-            dt_iso_str = s[:-3] + 'Z' #here we simply truncate; this may be off by by half a millisecond
-            print('Datetime {}'.format(dt_iso_str))
-            shell_string = 'exiftool -config /app/mbari.config -PNG:Dive="{}" -PNG:Datetime="{}" {}'.format(self.dive, dt_iso_str, output_png)
+                self.stats.count('bytes', sum(os.path.getsize(path) for path in paths))
+                self.manifest.record(self.manifest_key(start, end), paths)
+
+    def pipe_images(self, input_string, output_paths, tags=None, numbers=None, on_written=None):
+        '''
+        reads raw frames from ffmpeg over a pipe and encodes each frame once to its output format; drop
+        deinterlacing is a strided view of the decoded frame so no intermediate png is written. Frames are
+        encoded in a thread pool while the next frames are read, with at most two frames per thread queued
+        :param input_string: ffmpeg command up to and including the input and filter options
+        :param output_paths: list of frames to write, one per frame to read
+        :param tags: optional list of tags to write with each frame, as returned by frame_tags()
+        :param numbers: optional list of the number of each frame in the video, as returned by frame_number()
+        :param on_written: optional function called with the number of frames written so far after each frame
+        :return: number of frames written
+        '''
+        if not output_paths:
+            return 0
+        from reader import FrameReader
+        reader = FrameReader(input_string, self.width, self.height, self.bit_depth, frames=len(output_paths),
+                             runner=self.runner)
+        try:
+            read = self.encode_frames(((img, path, tags[i] if tags is not None else None,
+                                        int(numbers[i]) if numbers is not None else None)
+                                       for i, (img, path) in enumerate(zip(reader, output_paths))), on_written)
+        finally:
+            # stops ffmpeg if encoding failed before the end of the pipe
+            reader.close()
+        reader.check()
+        return read
+
+    def encode_frames(self, frames, on_written=None):
+        '''
+        encodes frames in a thread pool while the next frames are read, with at most two frames per thread queued.
+        In shard mode the encoded frames are appended to the shards in order, from this thread
+        :param frames: iterable of (frame, output path, tags or None, frame number or None) tuples
+        :param on_written: optional function called from this thread with the number of frames written so far
+        after each frame, in order, e.g. to record the windows whose frames are all written
+        :return: number of frames written
+        '''
+        written = 0
+        finished = [0]
+        pending = collections.deque()
+
+        def finish(item):
+            future, path, tags, number = item
+            if self.shards is None:
+                future.result()
+            else:
+                meta = dict(tags or [])
+                meta['frame'] = number
+                data = future.result()
+                with self.stats.timer('fs'):
+                    self.shards.write(os.path.splitext(os.path.basename(path))[0], self.encoder.ext, data, meta)
+                self.stats.count('bytes', len(data))
+            finished[0] += 1
+            if on_written is not None:
+                on_written(finished[0])
+
+        frames = iter(frames)
+        with ThreadPoolExecutor(max_workers=self.encode_threads) as pool:
+            while True:
+                # waiting for the next frame is time spent decoding in ffmpeg
+                with self.stats.timer('ffmpeg'):
+                    item = next(frames, None)
+                if item is None:
+                    break
+                img, path, tags, number = item
+                # the reader reuses its buffer for the next frame, so hand the encoder a copy
+                with self.stats.timer('deinterlace'):
+                    img = img[::2, 1::2].copy() if self.deinterlace == 'drop' else img.copy()
+                if self.shards is None:
+                    future = pool.submit(self.write_frame, path, img, tags)
+                else:
+                    future = pool.submit(self.encode_frame, img, tags)
+                pending.append((future, path, tags, number))
+                written += 1
+                if len(pending) >= 2*self.encode_threads:
+                    finish(pending.popleft())
+            while pending:
+                finish(pending.popleft())
+        if self.shards is not None:
+            # the frames are in the shard before their windows are recorded as finished
+            self.shards.flush()
+        return written
+
+    def encode_frame(self, img, tags):
+        '''
+        encodes a frame, adding the time to the encode stage
+        :return: encoded bytes
+        '''
+        with self.stats.timer('encode'):
+            return self.encoder.encode(img, tags)
+
+    def write_frame(self, path, img, tags):
+        '''
+        encodes and writes a frame, adding the time to the encode and fs stages
+        :return:
+        '''
+        data = self.encode_frame(img, tags)
+        with self.stats.timer('fs'):
+            self.encoder.save(path, data, tags)
+
+    def extract_scene_images(self, windows):
+        '''
+        decodes a run of consecutive windows in one pass over a pipe and keeps the frames where the scene changes,
+        at most scene_max per window. Kept frames are named by their window and numbered within it, even when a
+        single frame is extracted per step, and tagged with their own datetime
+        :param windows:  list of consecutive (start, end) windows, each step seconds long
+        :return: total frames extracted
+        '''
+        if not windows:
+            return 0
+        first_start = windows[0][0]
+        window_seconds = (windows[0][1] - windows[0][0]).total_seconds()
+        pass_seconds = (windows[-1][1] - first_start).total_seconds()
+        vf = ' -vf yadif=1:-1:0' if self.deinterlace == 'yadif' else ''
+        input_string = self.ffmpeg_prefix(continuous=True) + self.seek_input(first_start) + \
+                       ' -t {:.3f}{}'.format(pass_seconds, vf)
+        # yadif=1 emits one frame per field
+        rate = 2*self.fps if self.deinterlace == 'yadif' else self.fps
+        import scene
+        from reader import FrameReader
+        reader = FrameReader(input_string, self.width, self.height, self.bit_depth, runner=self.runner)
+        detector = scene.SceneDetector(self.scene_threshold)
+        kept = [[] for _ in windows]
+        kept_numbers = [[] for _ in windows]
+        reached = [0]
+        recorded = [0]
+        recorded_frames = [0]
+        written = [0]
+
+        def record_finished():
+            # a window is recorded once the decode moved past it and its kept frames are written
+            while recorded[0] < reached[0] and written[0] >= recorded_frames[0] + len(kept[recorded[0]]):
+                k = recorded[0]
+                self.record_window(windows[k][0], windows[k][1], kept[k], kept_numbers[k])
+                recorded_frames[0] += len(kept[k])
+                recorded[0] += 1
+
+        def on_written(count):
+            written[0] = count
+            record_finished()
+
+        def changed_frames():
+            for n, img in enumerate(reader):
+                seconds = n / rate
+                k = int(seconds // window_seconds)
+                if k >= len(windows):
+                    break
+                if k > reached[0]:
+                    reached[0] = k
+                    record_finished()
+                if self.scene_max is not None and len(kept[k]) >= self.scene_max:
+                    continue
+                if not detector.changed(img):
+                    continue
+                start = windows[k][0]
+                path = self.output_frame(start, len(kept[k]), indexed=True)
+                index = int(round((seconds - k*window_seconds) * self.fps))
+                kept[k].append(path)
+                kept_numbers[k].append(self.frame_number(start, index))
+                yield img, path, self.frame_tags(start, index), kept_numbers[k][-1]
+
+        try:
+            total = self.encode_frames(changed_frames(), on_written)
+        finally:
+            reader.close()
+        # a failed decode is retried; the windows recorded so far are kept
+        reader.check()
+        for k in range(recorded[0], len(windows)):
+            self.record_window(windows[k][0], windows[k][1], kept[k], kept_numbers[k])
+        return total
+
+    def tag_images(self, start, frames):
+        '''
+        tags the frames extracted for the window starting at start with the dive and frame datetime
+        :param start:  starting time of the window
+        :param frames:  number of frames extracted in the window
+        :return:
+        '''
+        with self.stats.timer('tag'):
+            for i, tags in enumerate(self.window_tags(self.frame_numbers(start, frames))):
+                tagging.tag_png(self.output_frame(start, i), tags)
+
+    def frame_tags(self, start, index):
+        '''
+        gets the PNG:Dive and PNG:Datetime tags of a frame in the window starting at start
+        :param start:  starting time of the window
+        :param index:  zero-based index of the frame within the window
+        :return: list of (keyword, text) tuples
+        '''
+        return self.window_tags([self.frame_number(start, index)])[0]
+
+    def frame_number(self, start, index):
+        '''
+        gets the number of a frame in the video, counted from 0 at the start of the video
+        :param start:  starting time of the window
+        :param index:  zero-based index of the frame within the window
+        :return: frame number
+        '''
+        seconds = Fraction(int(round(utils.to_seconds(start) * 1e6)), 1000000)
+        return int(round(seconds * self.frame_rate)) + index
+
+    def frame_numbers(self, start, frames):
+        '''
+        gets the numbers of the frames in the window starting at start
+        :param start:  starting time of the window
+        :param frames:  number of frames in the window
+        :return: range of frame numbers
+        '''
+        first = self.frame_number(start, 0)
+        return range(first, first + frames)
+
+    def window_tags(self, numbers):
+        '''
+        gets the PNG:Dive and PNG:Datetime tags of frames all at once
+        :param numbers:  frame numbers
+        :return: list of tags for each frame, as returned by frame_tags()
+        '''
+        import catalog
+        times = catalog.frame_times(self.start_iso_time, numbers, self.frame_rate)
+        return [[('Dive', self.dive), ('Datetime', t)] for t in catalog.datetime_tags(times)]
+
+    def frame_time(self, start, index):
+        '''
+        gets the datetime of a frame in the window starting at start, from the video start time in its name
+        and the exact frame rate
+        :param start:  starting time of the window
+        :param index:  zero-based index of the frame within the window
+        :return: datetime
+        '''
+        import catalog
+        return catalog.frame_times(self.start_iso_time, [self.frame_number(start, index)], self.frame_rate)[0].item()
+
+    def window_paths(self, start, frames):
+        '''
+        gets the names of the frames extracted in the window starting at start
+        :param start:  starting time of the window
+        :param frames:  number of frames extracted in the window
+        :return: list of full paths to the frames
+        '''
+        return [self.output_frame(start, i) for i in range(frames)]
+
+    def manifest_key(self, start, end):
+        '''
+        gets the key a window is recorded under in the manifest
+        :param start:  starting time of the window
+        :param end:  ending time of the window
+        :return: window key, e.g. 00:00:05.000-00:00:06.000
+        '''
+        return '{}-{}'.format(start.strftime('%H:%M:%S.%f')[:-3], end.strftime('%H:%M:%S.%f')[:-3])
+
+    def output_frame(self, start, index, indexed=False):
+        '''
+        gets the name of a frame extracted in the window starting at start
+        :param start:  starting time of the window
+        :param index:  zero-based index of the frame within the window
+        :param indexed:  if True, number the frame even when a single frame is extracted per step
+        :return: full path to the frame
+        '''
+        filename_prefix = '{0}_{1:02}-{2:02}-{3:02}'.format(self.key, start.hour, start.minute, start.second)
+        if self.single_frame and not indexed:
+            return '{0}/{1}.{2}'.format(self.output_dir, filename_prefix, self.encoder.ext)
+        return '{0}/{1}_{2:03}.{3}'.format(self.output_dir, filename_prefix, index+1, self.encoder.ext)
+
+    def extract_stepped_images(self, windows):
+        '''
+        extracts the frames for every step window in a single ffmpeg pass; the video is opened and
+        seeked once and a select filter keeps only the frames falling into each window
+        :param windows:  list of (start, end) windows as generated by step_windows()
+        :return: total frames extracted
+        '''
+        if not windows:
+            return 0
+        first_start = windows[0][0]
+        last_end = windows[-1][1]
+        pass_seconds = (last_end - first_start).total_seconds()
+        frames = int((windows[0][1] - windows[0][0]).total_seconds() * self.fps)
+        if frames < 1:
+            return 0
+        vf = self.stepped_filter(frames)
+        recorded = [0]
+
+        def record(k, extracted):
+            start, end = windows[k]
+            window_frames = min(frames, max(0, extracted - k*frames))
+            if not self.pipe:
+                self.tag_images(start, window_frames)
+            self.record_window(start, end, self.window_paths(start, window_frames))
+
+        def written(count):
+            # a window is recorded as soon as its last frame is written, so a killed pass only redoes that window
+            while recorded[0] < len(windows) and count >= (recorded[0] + 1)*frames:
+                record(recorded[0], count)
+                recorded[0] += 1
+
+        if self.pipe:
+            input_string = self.ffmpeg_prefix(continuous=True) + self.seek_input(first_start, keyframe=False) + ' -t {:.3f} -vf "{}" ' \
+                           '-vsync 0'.format(pass_seconds, vf)
+            numbers = [n for start, _ in windows for n in self.frame_numbers(start, frames)]
+            extracted = self.pipe_images(input_string, [self.output_frame(start, i) for start, _ in windows
+                                                        for i in range(frames)],
+                                         self.window_tags(numbers), numbers, written)
+        else:
+            extracted = self.stage_stepped_images(first_start, pass_seconds, vf, windows, frames, written)
+
+        for k in range(recorded[0], len(windows)):
+            record(k, extracted)
+        return min(extracted, frames*len(windows))
+
+    def stepped_filter(self, frames):
+        '''
+        builds the filter graph that selects the frames of every step window from a single pass
+        :param frames:  number of frames per window
+        :return: ffmpeg filter graph
+        '''
+        # yadif=1 emits one frame per field, so there are twice as many frames per step
+        rate = 2*self.fps if self.deinterlace == 'yadif' else self.fps
+        # every window starts at the first frame past a multiple of step frames and keeps the next frames frames,
+        # which selects exactly frames frames per window
+        select = "select='lt(mod(n,{0:.6f}),{1})'".format(self.step * rate, frames)
+        if self.deinterlace == 'yadif':
+            return 'yadif=1:-1:0,{}'.format(select)
+        return select
+
+    def frame_passes(self):
+        '''
+        plans the ffmpeg passes that decode the frames of the range, or of every step window, to a pipe
+        :return: list of (ffmpeg input string, list of (window start, frame index) for each frame of the pass)
+        '''
+        if self.step is None:
+            end = self.end or self.start + timedelta(milliseconds=self.duration*1e3)
+            frames = int((end - self.start).total_seconds() * self.fps)
+            vf = ' -vf yadif=1:-1:0' if self.deinterlace == 'yadif' else ''
+            input_string = self.ffmpeg_prefix(continuous=True) + self.seek_input(self.start) + vf
+            return [(input_string, [(self.start, i) for i in range(frames)])]
+        windows = self.step_windows()
+        if not windows:
+            return []
+        frames = int((windows[0][1] - windows[0][0]).total_seconds() * self.fps)
+        if self.overlapping:
+            vf = ' -vf yadif=1:-1:0' if self.deinterlace == 'yadif' else ''
+            return [(self.ffmpeg_prefix(continuous=False) + self.seek_input(start) + vf,
+                     [(start, i) for i in range(frames)]) for start, _ in windows]
+        pass_seconds = (windows[-1][1] - windows[0][0]).total_seconds()
+        input_string = self.ffmpeg_prefix(continuous=True) + self.seek_input(windows[0][0], keyframe=False) + \
+                       ' -t {:.3f} -vf "{}" -vsync 0'.format(pass_seconds, self.stepped_filter(frames))
+        return [(input_string, [(start, i) for start, _ in windows for i in range(frames)])]
+
+    def iter_frames(self, buffer=8):
+        '''
+        decodes the frames of the range, or of every step window, straight from an ffmpeg pipe without writing
+        anything to disk. A background thread decodes and deinterlaces up to buffer frames ahead of the consumer
+        and blocks when the consumer falls behind; closing the generator early stops ffmpeg
+        :param buffer:  maximum number of decoded frames waiting for the consumer
+        :return: generator of (datetime, dive, frame) tuples; each frame is a height x width x 3 bgr array that
+        the consumer owns
+        :Example:
+        for timestamp, dive, img in Extractor('/Volumes/data/D008_03HD.mov', '/tmp', 'drop', 5).iter_frames():
+            detector.predict(img)
+        '''
+        frames = queue.Queue(maxsize=max(1, buffer))
+        stop = threading.Event()
+        finished = object()
+        readers = []
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    frames.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def decode():
+            try:
+                for input_string, positions in self.frame_passes():
+                    if stop.is_set():
+                        break
+                    from reader import FrameReader
+                    reader = FrameReader(input_string, self.width, self.height, self.bit_depth, frames=len(positions),
+                                         runner=self.runner)
+                    readers.append(reader)
+                    for img, (start, index) in zip(reader, positions):
+                        if self.deinterlace == 'drop':
+                            img = img[::2, 1::2]
+                        # the reader reuses its buffer for the next frame, so hand the consumer a copy
+                        if not put((self.frame_time(start, index), self.dive, img.copy())):
+                            break
+                    if stop.is_set():
+                        reader.close()
+                        break
+                    # a failed decode is raised to the consumer instead of ending the frames early
+                    reader.check()
+                put(finished)
+            except Exception as ex:
+                put(ex)
+
+        thread = threading.Thread(target=decode)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                item = frames.get()
+                if item is finished:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.close()
+            thread.join()
+
+    def stage_stepped_images(self, first_start, pass_seconds, vf, windows, frames, on_written=None):
+        '''
+        runs the single pass extraction to png files in a staging directory, moving each frame to the name of its
+        step window as soon as it is written
+        :param first_start:  starting time of the pass
+        :param pass_seconds:  duration of the pass in seconds
+        :param vf:  ffmpeg filter graph selecting the frames of each window
+        :param windows:  list of (start, end) windows
+        :param frames:  number of frames per window
+        :param on_written:  optional function called with the number of frames moved so far
+        :return: total frames extracted
+        '''
+        shell_string = self.ffmpeg_prefix(continuous=True) + self.seek_input(first_start, keyframe=False) + \
+                       ' -t {:.3f} -vf "{}" -vsync 0 -frames:v {} -an'.format(pass_seconds, vf, frames*len(windows))
+        return self.stage_frames(shell_string, [self.output_frame(start, i) for start, _ in windows
+                                                for i in range(frames)], on_written)
+
+    def stage_frames(self, shell_string, output_pngs, on_written=None):
+        '''
+        runs an ffmpeg call writing sequentially numbered pngs to a staging directory, so frames from earlier calls
+        are never touched again, and moves each png to its output name as soon as ffmpeg has moved on to the next
+        one, so finished frames are recorded while ffmpeg is still running
+        :param shell_string:  ffmpeg command up to the output
+        :param output_pngs:  output png for each staged frame, in order
+        :param on_written:  optional function called with the number of frames moved so far each time frames are moved
+        :return: number of frames moved
+        :raises runner.ProcessError: if ffmpeg fails or times out, after the frames it finished were moved
+        '''
+        staging_dir = tempfile.mkdtemp(prefix='stage_', dir=self.staging())
+        try:
+            shell_string += ' {}/%08d.png'.format(staging_dir)
             print(shell_string)
-            subprocess.call(shell_string, shell=True, stdout=file_out, stderr=file_out)
-            original = '{}_original'.format(output_png)
-            os.remove(original)
-            dt += timedelta(microseconds=inc_microseconds)
-        return frames
+            return asyncio.run(self.watch_staged(shell_string, staging_dir, output_pngs, on_written))
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    async def watch_staged(self, shell_string, staging_dir, output_pngs, on_written):
+        task = asyncio.ensure_future(self.runner.run(runner.split(shell_string)))
+        moved = 0
+        while True:
+            with self.stats.timer('ffmpeg'):
+                await asyncio.wait([task], timeout=STAGE_POLL_SECONDS)
+            staged = self.staged_pngs(staging_dir)
+            # ffmpeg writes the pngs in order, so all but the last are complete until it exits cleanly
+            if not task.done() or task.exception() is not None:
+                staged = staged[:-1]
+            count = self.move_staged(staged, output_pngs[moved:])
+            if count:
+                moved += count
+                if on_written is not None:
+                    on_written(moved)
+            if task.done():
+                task.result()
+                return moved
+
+    def staging(self):
+        '''
+        creates the staging directory of this run on first use, after sweeping the staging directories of runs that
+        were killed. Each run holds a lock on its staging directory, released by the kernel if the run dies, so
+        segments of the same video running concurrently never sweep each other's frames
+        :return: full path to the staging directory of this run
+        '''
+        if self.staging_dir is None:
+            utils.ensure_dir(self.staging_root)
+            self.sweep_staging()
+            fd, lock_path = tempfile.mkstemp(prefix='run_', suffix='.lock', dir=self.staging_root)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            self.staging_lock = fd
+            self.staging_dir = lock_path[:-len('.lock')]
+            os.mkdir(self.staging_dir)
+        return self.staging_dir
+
+    def sweep_staging(self):
+        '''
+        removes the staging directories of runs that died, e.g. when a worker was killed or preempted, and the
+        .drop_ and .stage_ directories earlier releases left in imgs
+        '''
+        now = time.time()
+        for lock_path in glob.glob('{}/run_*.lock'.format(self.staging_root)):
+            try:
+                if now - os.path.getmtime(lock_path) < STAGING_GRACE_SECONDS:
+                    continue
+                fd = os.open(lock_path, os.O_RDWR)
+            except OSError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # the run is still going
+                os.close(fd)
+                continue
+            print('Removing staged frames of an earlier run in {}'.format(lock_path[:-len('.lock')]))
+            shutil.rmtree(lock_path[:-len('.lock')], ignore_errors=True)
+            os.remove(lock_path)
+            os.close(fd)
+        for staging_dir in glob.glob('{0}/.drop_*'.format(self.output_dir)) + \
+                           glob.glob('{0}/.stage_*'.format(self.output_dir)):
+            if now - os.path.getmtime(staging_dir) >= STAGING_GRACE_SECONDS:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def remove_staging(self):
+        '''
+        removes the staging directory of this run and releases its lock
+        '''
+        if self.staging_dir is None:
+            return
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        os.remove(self.staging_dir + '.lock')
+        os.close(self.staging_lock)
+        self.staging_dir = None
+        self.staging_lock = None
+
+    def staged_pngs(self, staging_dir):
+        '''
+        :param staging_dir:  directory ffmpeg writes sequentially numbered pngs to
+        :return: full paths to the staged pngs, in the order ffmpeg wrote them
+        '''
+        return sorted(glob.glob('{}/*.png'.format(staging_dir)))
+
+    def move_staged(self, staged, output_pngs):
+        '''
+        moves pngs ffmpeg wrote to a staging directory to their output names, drop deinterlacing them on the way
+        :param staged:  full paths to the staged pngs, in order
+        :param output_pngs:  output png for each staged frame, in order
+        :return: number of frames moved
+        '''
+        for png, output_png in zip(staged, output_pngs):
+            if self.deinterlace == 'drop':
+                # retain 16-bit depth if exists
+                with self.stats.timer('deinterlace'):
+                    import cv2
+                    img = cv2.imread(png, cv2.IMREAD_UNCHANGED)
+                    cv2.imwrite(output_png, img[::2, 1::2])
+                    os.remove(png)
+            else:
+                with self.stats.timer('fs'):
+                    os.rename(png, output_png)
+        return min(len(staged), len(output_pngs))
+
+    def plan_runs(self, windows, contiguous=False):
+        '''
+        groups the windows that still need extracting into runs, each decoded by one ffmpeg call. In single pass
+        mode runs only break at finished windows; otherwise consecutive windows share a run when the keyframe
+        index shows that decoding through the gap between them costs no more than seeking to the next window
+        :param windows:  list of (start, end) windows as generated by step_windows()
+        :param contiguous:  if True, every run of consecutive unfinished windows is decoded in one pass
+        :return: list of runs, each a list of (start, end) windows, and the number of frames in finished windows
+        '''
+        runs = []
+        finished_frames = 0
+        previous = None
+        for start, end in windows:
+            window = self.manifest_key(start, end)
+            if self.resume and self.manifest.done(window):
+                print('Skipping finished frame {} from {}'.format(self.input_video_path, window))
+                finished_frames += self.manifest.frames(window)
+                self.stats.count('skipped')
+                previous = None
+                continue
+            # each run selects frames at a fixed step from its first window, so finished windows split runs
+            if previous is not None and (contiguous or self.single_pass or self.continue_decoding(previous[1], start)):
+                runs[-1].append((start, end))
+            else:
+                runs.append([(start, end)])
+            previous = (start, end)
+        return runs, finished_frames
+
+    def continue_decoding(self, end, start):
+        '''
+        checks if decoding on from the end of a window to the start of the next is no more expensive than
+        seeking, which decodes from the keyframe at or before the next start
+        :param end:  ending time of the window
+        :param start:  starting time of the next window
+        :return: True if the windows should be decoded in one run
+        '''
+        if self.keyframes is None or self.overlapping:
+            return False
+        point = self.keyframes.seek_point(utils.to_seconds(start))
+        if point is None:
+            return False
+        return utils.to_seconds(start) - utils.to_seconds(end) <= utils.to_seconds(start) - point[0]
+
+    def seek_input(self, start, keyframe=True):
+        '''
+        builds the ffmpeg seek and input options to start decoding at start. With a keyframe index, the input
+        is opened exactly at the keyframe at or before start and only the frames from there to start are
+        decoded and dropped
+        :param start:  starting time
+        :param keyframe:  False to always seek the input with -accurate_seek, e.g. when a filter counts frames
+        from the seek point
+        :return: ffmpeg options string
+        '''
+        seconds = utils.to_seconds(start)
+        point = self.keyframes.seek_point(seconds) if self.keyframes is not None and keyframe else None
+        if point is None:
+            # without a keyframe at or before start, e.g. an empty index, ffmpeg seeks the input itself
+            timecode_str = '{0:02}:{1:02}:{2:02}.{3:03}'.format(start.hour, start.minute, start.second,
+                                                                int(start.microsecond/1e3))
+            return ' -accurate_seek -ss {} -i {}'.format(timecode_str, self.input_url)
+        keyframe_seconds = point[0]
+        return ' -ss {:.6f} -i {} -ss {:.6f}'.format(keyframe_seconds, self.input_url, seconds - keyframe_seconds)
+
+    def range_windows(self, start, end):
+        '''
+        splits a range into consecutive windows of RANGE_WINDOW_SECONDS at frame boundaries, each recorded in the
+        manifest on its own
+        :param start:  starting time of the range
+        :param end:  ending time of the range
+        :return: list of (start, end) windows
+        '''
+        frames = utils.range_frames((end - start).total_seconds(), self.fps)
+        chunk = max(1, int(round(RANGE_WINDOW_SECONDS * self.fps)))
+        bounds = list(range(0, frames, chunk)) + [frames]
+        # boundaries are rounded down so a seek to a window never passes its first frame
+        return [(start + timedelta(microseconds=int(a * 1e6 / self.fps)),
+                 start + timedelta(microseconds=int(b * 1e6 / self.fps))) for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def range_offset(self, time):
+        '''
+        :param time:  boundary of a window generated by range_windows()
+        :return: number of frames from the start of the range to time
+        '''
+        return int(round((time - self.start).total_seconds() * self.fps))
+
+    def step_windows(self, duration=None):
+        '''
+        generates the (start, end) windows to extract every step seconds
+        :param duration:  window duration in milliseconds; defaults to the duration extracted every step
+        :return: list of (start, end) windows
+        '''
+        if duration is None:
+            duration = self.duration
+        windows = []
+        seconds_counter = self.seconds_counter + utils.to_seconds(self.start)
+        start = self.start
+        end = start + timedelta(milliseconds=duration)
+        while seconds_counter < self.video_length:
+            if self.end and end > self.end:
+                break
+            windows.append((start, end))
+            start = start + timedelta(seconds=self.step)
+            end = start + timedelta(milliseconds=duration)
+            seconds_counter += self.step
+        return windows
+
+    def run_window(self, window, func, *args, **kwargs):
+        '''
+        runs the extraction of a window, or of a pass over several windows, and reports its stats. A window whose
+        ffmpeg fails or times out is extracted again up to retries times. A failure is reported with its traceback
+        and the remaining windows are still extracted; the manifest does not record the failed window, so a
+        resumed run redoes it
+        :param window: window key, or a range of window keys for a pass
+        :param func: extraction method
+        :param args: arguments of func
+        :param retries: number of retries; defaults to the runner retries
+        :return: frames extracted, 0 if the window failed
+        '''
+        retries = kwargs.get('retries', self.runner.retries)
+        try:
+            with self.stats.window(window):
+                for attempt in range(retries + 1):
+                    try:
+                        return func(*args)
+                    except runner.ProcessError as ex:
+                        if attempt == retries:
+                            raise
+                        print('Retrying {} {} after {}'.format(self.input_video_path, window, ex))
+        except Exception as ex:
+            print('Failed extracting {} {}: {}'.format(self.input_video_path, window, ex))
+            return 0
+
+    def prefetch(self, start, end):
+        '''
+        prefetches the bytes of an http video between start and end in the background while the current
+        window decodes
+        :param start:  starting time
+        :param end:  ending time
+        :return:
+        '''
+        if self.remote is not None:
+            self.remote.prefetch(utils.to_seconds(start), utils.to_seconds(end))
+
+    def run_key(self, run):
+        '''
+        :param run: list of (start, end) windows
+        :return: report key of a run of windows, from the start of the first to the end of the last
+        '''
+        return self.manifest_key(run[0][0], run[-1][1])
 
     def process_video(self):
         '''
         extract all the frames from video_name specified in __init__
-        :return:
+        :return: True if every window was extracted, False if any failed
         '''
         try:
+            t_start = time.time()
+            if self.scene_threshold is not None:
+                # windows span the whole step so every frame is checked for scene changes
+                if self.step is None:
+                    windows = self.range_windows(self.start, self.end or
+                                                 self.start + timedelta(milliseconds=self.duration*1e3))
+                else:
+                    windows = self.step_windows(self.step*1e3)
+                runs, total = self.plan_runs(windows, contiguous=True)
+                print('Extracting scene changes in {} of {} windows from {} and saving to {}'.format(
+                    sum(len(run) for run in runs), len(windows), self.input_video_path, self.output_dir))
+                for k, run in enumerate(runs):
+                    if k + 1 < len(runs):
+                        self.prefetch(runs[k + 1][0][0], runs[k + 1][-1][1])
+                    total += self.run_window(self.run_key(run), self.extract_scene_images, run)
             # if not stepping through incrementally, process the range
-            if self.step is None:
+            elif self.step is None:
                 if self.end:
                   end = self.end
                   #TODO put in check if this is within bounds of ending
                 else:
                   end = self.start + timedelta(milliseconds=self.duration*1e3)
 
-                start_str = self.start.strftime('%H:%M:%S.%f')[:-3]
-                end_str = end.strftime('%H:%M:%S.%f')[:-3]
-                print('Extracting image frames {} from {} to {} and saving to {}'.format(self.input_video_path,
-                                                                                         start_str, end_str,
-                                                                                         self.output_dir))
-                total = self.extract_all_images(self.start, end)
+                windows = self.range_windows(self.start, end)
+                runs, total = self.plan_runs(windows, contiguous=True)
+                print('Extracting image frames {} from {} to {} in {} of {} windows and saving to {}'.format(
+                    self.input_video_path, self.start.strftime('%H:%M:%S.%f')[:-3], end.strftime('%H:%M:%S.%f')[:-3],
+                    sum(len(run) for run in runs), len(windows), self.output_dir))
+                for k, run in enumerate(runs):
+                    if k + 1 < len(runs):
+                        self.prefetch(runs[k + 1][0][0], runs[k + 1][-1][1])
+                    total += self.run_window(self.run_key(run), self.extract_all_images, run)
+            elif self.single_pass or self.keyframes is not None:
+                windows = self.step_windows()
+                runs, total = self.plan_runs(windows)
+                print('Extracting {} of {} windows from {} in {} passes and saving to {}'.format(
+                    sum(len(run) for run in runs), len(windows), self.input_video_path, len(runs), self.output_dir))
+                for k, run in enumerate(runs):
+                    if k + 1 < len(runs):
+                        self.prefetch(runs[k + 1][0][0], runs[k + 1][-1][1])
+                    if len(run) == 1 and not self.single_pass:
+                        total += self.run_window(self.run_key(run), self.extract_images, *run[0])
+                    else:
+                        total += self.run_window(self.run_key(run), self.extract_stepped_images, run)
+                self.seconds_counter += len(windows)*self.step
             else:
-                self.seconds_counter += self.start.hour*3600 * self.start.minute*60 + self.start.second
-                start = self.start
-                end = start + timedelta(milliseconds=self.duration)
+                windows = self.step_windows()
+                todo = []
                 total = 0
-                while self.seconds_counter < self.video_length:
-                    # To time methods, uncomment line below
-                    # import timeit
-                    #func = utils.wrapper(self.extract_images, output_path, timecode)
-                    #self.times.append(timeit.timeit(func, number=1))
-                    if self.end and end > self.end:
-                        break
-                    start_str = start.strftime('%H:%M:%S.%f')[:-3]
-                    end_str = end.strftime('%H:%M:%S.%f')[:-3]
-                    print('Extracting image frame {} from {} to {} and saving to {}'.format(start_str, end_str,
-                                                                                            self.input_video_path,
-                                                                                            self.output_dir))
-                    frames = self.extract_images(start, end)
-                    start = start + timedelta(seconds=self.step)
-                    end = start + timedelta(milliseconds=self.duration)
-                    self.seconds_counter += self.step
-                    print('Seconds {}'.format(self.seconds_counter))
-                    total += frames
-            print('Extracted {} total frames'.format(total))
-            return True
+                for start, end in windows:
+                    window = self.manifest_key(start, end)
+                    if self.resume and self.manifest.done(window):
+                        print('Skipping finished frame {} from {}'.format(self.input_video_path, window))
+                        total += self.manifest.frames(window)
+                        self.stats.count('skipped')
+                    else:
+                        todo.append((start, end))
+                print('Extracting {} of {} windows from {} and saving to {}'.format(len(todo), len(windows),
+                                                                                   self.input_video_path,
+                                                                                   self.output_dir))
+                if self.pipe:
+                    for k, (start, end) in enumerate(todo):
+                        if k + 1 < len(todo):
+                            self.prefetch(*todo[k + 1])
+                        total += self.run_window(self.manifest_key(start, end), self.extract_images, start, end)
+                else:
+                    # the next window decodes while this one is tagged, which also prefetches http inputs
+                    total += self.extract_windows(todo)
+                self.seconds_counter += len(windows)*self.step
+            elapsed = time.time() - t_start
+            print('Extracted {} total frames in {:.2f} seconds, {:.2f} frames/sec'.format(total, elapsed,
+                                                                                     total / max(elapsed, 1e-6)))
         except Exception as ex:
-            print(ex)
-            return False
+            print('Failed extracting {}: {}'.format(self.input_video_path, ex))
+            self.stats.failure(None, ex)
+        finally:
+            # staged frames of windows that never finished, e.g. decoded ahead when the worker got SIGTERM
+            self.remove_staging()
+            self.manifest.close()
+            if self.catalog is not None:
+                self.catalog.close()
+            if self.shards is not None:
+                self.shards.close()
+            record = self.stats.close()
+            print('{} {}; {}'.format(self.input_video_path,
+                                     ', '.join('{} {:.2f}s'.format(k, v) for k, v in sorted(record['stages'].items())),
+                                     ', '.join('{} {}'.format(k, v) for k, v in sorted(record['counters'].items()))))
+        return record['counters']['failures'] == 0
 
 def process_command_line():
     import argparse
@@ -263,9 +1191,9 @@ def process_command_line():
                             "-i /Volumes/DeepLearningTests/benthic/D0232_03HD_10s.mov " \
                             "-o /Volumes/Tempbox/danelle/benthic/ \n"
     parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter,
-                                   description='Extract still jpeg frames from video',
+                                   description='Extract still frames from video',
                                    epilog=examples)
-    parser.add_argument('-i', '--input', action='store', help='full path to base directory where video files are, or single video file. If using directory, specify glob to search for files', default='', required=True)
+    parser.add_argument('-i', '--input', action='store', help='full path to base directory where video files are, or single video file. If using directory, specify glob to search for files', default='', required=False)
     parser.add_argument('-o', '--output_dir', action='store', help='full path to output directory to store frames', default='', required=False)
     # default to drop fields interlace if none specified
     parser.add_argument('-d', '--deinterlace', action='store', help='deinterlace choice, drop = drop fields, yadif = ffmpeg filter', required=False)
@@ -275,10 +1203,36 @@ def process_command_line():
     parser.add_argument('-t', '--start', action='store', help='Start time in HH:MM:SS format', default="00:00:00", required=False)
     parser.add_argument('-e', '--end', action='store', help='End time in HH:MM:SS format', required=False)
     parser.add_argument('-p', '--prefix', action='store', help='Optional prefix to prepend to extracted filest', required=False)
+    parser.add_argument('--single_pass', action='store_true', help='Decode each video once and extract every step from that single pass', required=False)
+    parser.add_argument('--realtime', action='store_true', help='Read live or streamed url inputs at their native frame rate', required=False)
+    parser.add_argument('--threads', action='store', help='Number of ffmpeg decoder threads per video; defaults to the cpus available to each worker', required=False, type=int)
+    parser.add_argument('--pipe', action='store_true', help='Read raw frames from ffmpeg over a pipe and deinterlace in memory, encoding each frame once', required=False)
+    parser.add_argument('--overwrite', action='store_true', help='Extract every window again, even those the manifest records as finished', required=False)
+    parser.add_argument('--keyframe_index', action='store_true', help='Index the keyframes of each video to seek exactly and skip seeks that save no decoding', required=False)
+    parser.add_argument('-f', '--format', action='store', help='Output frame format', choices=encoders.FORMATS, default='png', required=False)
+    parser.add_argument('-q', '--quality', action='store', help='Jpeg/webp quality 0-100 or png compression level 0-9', required=False, type=int)
+    parser.add_argument('--encode_threads', action='store', help='Number of threads encoding frames per video', default=2, required=False, type=int)
+    parser.add_argument('--scene', action='store', help='Keep only frames whose color histogram differs from the last kept frame by more than this threshold, 0-1, e.g. 0.3', required=False, type=float)
+    parser.add_argument('--scene_max', action='store', help='Maximum number of scene change frames kept per step window', default=1, required=False, type=int)
+    parser.add_argument('--shard_size', action='store', help='Write frames and their json tags to tar shards of at most this many MB instead of one file per frame', required=False, type=int)
+    parser.add_argument('--segment', action='store', help='Length in seconds of the segments videos are split into when using --glob', default=300, required=False, type=int)
+    parser.add_argument('--report', action='store', help='Json lines run report of the time spent per stage and window; defaults to {output_dir}/run_report.jsonl', required=False)
+    parser.add_argument('--cache_size', action='store', help='Maximum size in MB of the on-disk block cache http videos are read through; 0 reads them directly', default=remote.CACHE_BYTES >> 20, required=False, type=int)
+    parser.add_argument('--max_procs', action='store', help='Maximum number of ffmpeg processes running at once on this host; defaults to the number of cpus', required=False, type=int)
+    parser.add_argument('--timeout', action='store', help='Seconds before an ffmpeg process is killed and its window retried', required=False, type=int)
+    parser.add_argument('--retries', action='store', help='Number of times a window whose ffmpeg failed or timed out is extracted again', default=2, required=False, type=int)
+    parser.add_argument('--ledger', action='store', help='Shared SQLite ledger to claim the segments of the videos from, e.g. on shared storage; every node runs the same command', required=False)
+    parser.add_argument('--lease', action='store', help='Seconds a segment claimed from the ledger stays leased to a worker that stopped renewing it', default=600, required=False, type=int)
+    parser.add_argument('--serve', action='store_true', help='Extract the videos requested as json lines on stdin, one per line, without restarting; the other options are the defaults of each request', required=False)
+    parser.add_argument('--profile', action='store', help='Profile each video or segment with cProfile and write the stats to this directory', required=False)
     args = parser.parse_args()
     return args
 
-def process_video(video, output_dir, deinterlace, milliseconds, step, start_time=None, end_time=None, prefix='f'):
+def process_video(video, output_dir, deinterlace, milliseconds, step, start_time=None, end_time=None, prefix='f',
+                  single_pass=False, realtime=False, workers=1, threads=None, pipe=False, start_number=1, resume=True,
+                  keyframe_index=False, output_format='png', quality=None, encode_threads=2, scene_threshold=None,
+                  scene_max=1, shard_bytes=None, report=None, profile_dir=None, cache_bytes=remote.CACHE_BYTES,
+                  max_procs=None, timeout=None, retries=2):
     '''
     processes a video given its the name of the video
     :param video: absolute path or url to the input video to be processed 
@@ -289,6 +1243,26 @@ def process_video(video, output_dir, deinterlace, milliseconds, step, start_time
     :param start_time: starting time to extracting images
     :param end_time: ending time to finish extracting images
     :param prefix: frame starting prefix to prepend to extracted frames
+    :param single_pass: if True, extract every step from a single pass through the video
+    :param realtime: if True, read url inputs at their native frame rate
+    :param workers: number of videos processed concurrently on this host
+    :param threads: number of ffmpeg decoder threads; defaults to the cpus available to each worker
+    :param pipe: if True, read raw frames from ffmpeg over a pipe instead of writing intermediate pngs
+    :param start_number: number of the first frame when extracting all frames
+    :param resume: if True, skip windows the video manifest records as finished
+    :param keyframe_index: if True, use the keyframe index of the video to seek and plan the windows
+    :param output_format: output frame format: png, jpeg, webp or npy
+    :param quality: jpeg/webp quality or png compression level
+    :param encode_threads: number of threads encoding frames
+    :param scene_threshold: if set, keep only frames where the scene changes by more than this threshold (0-1)
+    :param scene_max: maximum number of frames kept per step window in scene mode
+    :param shard_bytes: if set, write frames to tar shards of at most this many bytes instead of one file per frame
+    :param report: json lines run report to append the timing records to
+    :param profile_dir: if set, profile the extraction with cProfile and dump the stats to this directory
+    :param cache_bytes: maximum size of the block cache http videos are read through, or 0 to read them directly
+    :param max_procs: maximum number of ffmpeg processes running at once on this host
+    :param timeout: seconds before an ffmpeg process is killed
+    :param retries: number of times a failed window is extracted again
     :return:  True is success, False is exception
 
     :Example:
@@ -297,16 +1271,159 @@ def process_video(video, output_dir, deinterlace, milliseconds, step, start_time
     '''
     print("Starting: {} saving to {} using deinterlacing method {} prefix {}".format(video, output_dir, deinterlace, prefix))
     extractor = Extractor(input_video_path=video, output_dir=output_dir, deinterlace=deinterlace, step=step,
-                          duration=milliseconds, start=start_time, end=end_time, prefix=prefix)
-    result = extractor.process_video()
+                          duration=milliseconds, start=start_time, end=end_time, prefix=prefix,
+                          single_pass=single_pass, realtime=realtime, workers=workers, threads=threads, pipe=pipe,
+                          start_number=start_number, resume=resume, keyframe_index=keyframe_index,
+                          output_format=output_format, quality=quality, encode_threads=encode_threads,
+                          scene_threshold=scene_threshold, scene_max=scene_max, shard_bytes=shard_bytes,
+                          report=report, cache_bytes=cache_bytes, max_procs=max_procs, timeout=timeout,
+                          retries=retries)
+    global active_manifest
+    active_manifest = extractor.manifest
+    if profile_dir:
+        import cProfile
+        utils.ensure_dir(profile_dir)
+        first = start_time or datetime.strptime('00:00:00', '%H:%M:%S')
+        profile_path = '{0}/{1}_{2:02}-{3:02}-{4:02}.prof'.format(profile_dir, extractor.key, first.hour,
+                                                                    first.minute, first.second)
+        profiler = cProfile.Profile()
+        result = profiler.runcall(extractor.process_video)
+        profiler.dump_stats(profile_path)
+        print('Wrote profile to {}'.format(profile_path))
+    else:
+        result = extractor.process_video()
     print("Finished: {}".format(video))
     return result
 
-def process_helper(args):
-    print('Running process helper with args {}'.format(args))
-    return process_video(*args)
+def process_helper(kwargs):
+    print('Running process helper with args {}'.format(kwargs))
+    return process_video(**kwargs)
+
+def find_videos(input_dir, patterns):
+    '''
+    :param input_dir: base directory of the videos
+    :param patterns: list of glob search patterns
+    :return: list of full paths to the matching videos
+    '''
+    video_files = []
+    for pattern in patterns:
+        video_files.extend(glob.glob('{}/{}'.format(input_dir, pattern)))
+    print(video_files)
+    return video_files
+
+def plan_jobs(video_files, args, options, workers):
+    '''
+    splits videos into segments balanced across workers
+    :param video_files: list of videos
+    :param args: command line arguments
+    :param options: dictionary of process_video arguments
+    :param workers: number of workers each segment shares the host with
+    :return: list of (cost, video, process_video arguments) jobs
+    '''
+    jobs = []
+    # scene mode windows span the whole step
+    milliseconds = args.step*1000 if args.scene is not None and args.step else args.milliseconds
+    # videos are probed in the same process slots and with the same timeout as ffmpeg
+    probe_runner = runner.Runner(args.max_procs, args.timeout, args.retries)
+    for f in video_files:
+        for cost, segment_start, segment_end, start_number in scheduler.video_segments(f, args.step, milliseconds,
+                options['start_time'], options['end_time'], args.segment, probe_runner):
+            jobs.append((cost, f, dict(options, video=f, start_time=segment_start, end_time=segment_end,
+                                       workers=workers, start_number=start_number)))
+    return jobs
+
+def ledger_helper(kwargs):
+    '''
+    runs a segment claimed from the ledger, writing its run report to a part of its own
+    :param kwargs: process_video arguments as stored in the ledger
+    :return: True is success, False is exception
+    '''
+    import stats
+    kwargs = dict(kwargs, workers=max(1, multiprocessing.cpu_count() - 1))
+    for key in ('start_time', 'end_time'):
+        if kwargs.get(key):
+            kwargs[key] = parse_time(kwargs[key])
+    if kwargs.get('report'):
+        kwargs['report'] = stats.part_path(kwargs['report'])
+    return process_video(**kwargs)
+
+def merge_outputs(output_dir, report, work):
+    '''
+    merges the outputs of every node once the ledger is finished: the run report parts into the run report,
+    each video catalog sorted and compacted to npy, and the state of every segment into
+    {output_dir}/ledger_summary.json
+    :param output_dir: output directory shared by the nodes
+    :param report: full path to the run report
+    :param work: ledger
+    :return:
+    '''
+    import stats
+    import catalog
+    print('Merged {} run report records into {}'.format(stats.merge_reports(report), report))
+    for path in sorted(glob.glob('{}/*/catalog.csv'.format(output_dir))):
+        frames, npy = catalog.compact(path)
+        print('Wrote {} frames to {}'.format(frames, npy))
+    summary = work.summary()
+    utils.write_atomic(os.path.join(output_dir, 'ledger_summary.json'), json.dumps(summary, indent=2).encode())
+    for video, jobs in sorted(summary.items()):
+        print('{} segments of {} finished, {} failed'.format(len(jobs), video,
+                                                             sum(1 for job in jobs if job['state'] != 'done')))
+
+def parse_time(timecode):
+    '''
+    parses a timecode
+    :param timecode: HH:MM:SS or HH:MM:SS.fff
+    :return: datetime
+    '''
+    if '.' in timecode:
+        return datetime.strptime(timecode, '%H:%M:%S.%f')
+    return datetime.strptime(timecode, '%H:%M:%S')
+
+def serve(defaults, requests=None, responses=None):
+    '''
+    extracts the videos requested as json lines in this process, so modules are imported once for any number of
+    videos. Each request is a json object with the video and any process_video arguments overriding the defaults,
+    with start_time and end_time as timecodes. A json line with the video, ok, seconds and any error is written per
+    request; log messages go to stderr so the responses can be read from stdout
+    :param defaults: dictionary of process_video arguments
+    :param requests: file to read the requests from; defaults to stdin
+    :param responses: file to write the responses to; defaults to stdout
+    :return:
+    :Example:
+    echo '{"video": "/data/D0232_20160501T000030Z.mov", "step": 2}' | python extractor.py --serve -o /desktop -s 5
+    '''
+    requests = requests or sys.stdin
+    responses = responses or sys.stdout
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        for line in requests:
+            if not line.strip():
+                continue
+            t_start = time.time()
+            response = {'video': None}
+            try:
+                kwargs = dict(defaults)
+                kwargs.update(json.loads(line))
+                for key in ('start_time', 'end_time'):
+                    if isinstance(kwargs.get(key), str):
+                        kwargs[key] = parse_time(kwargs[key])
+                response['video'] = kwargs.get('video')
+                response['ok'] = bool(process_video(**kwargs))
+            except Exception as ex:
+                response['ok'] = False
+                response['error'] = str(ex)
+            response['seconds'] = round(time.time() - t_start, 3)
+            responses.write(json.dumps(response) + '\n')
+            responses.flush()
+    finally:
+        sys.stdout = stdout
 
 def sigterm_handler(signal, frame):
+    # flush the manifest so a restart only redoes the window in progress; the SystemExit raised by exit() unwinds
+    # process_video, which kills the running ffmpeg and removes the staged frames of the run
+    if active_manifest is not None:
+        active_manifest.close()
     print("extractor.py done")
     exit(0)
 
@@ -314,21 +1431,15 @@ if __name__ == '__main__':
 
     args = process_command_line()
 
-    if len(args.input) < 1:
+    if len(args.input) < 1 and not args.serve:
         print ('Need to specify input directory -i or --input option')
         exit(-1)
     start_time = None
     end_time = None
     if args.start:
-        if '.' in args.start:
-            start_time = datetime.strptime(args.start, '%H:%M:%S.%f')
-        else:
-            start_time = datetime.strptime(args.start, '%H:%M:%S')
+        start_time = parse_time(args.start)
     if args.end:
-        if '.' in args.end:
-            end_time = datetime.strptime(args.end, '%H:%M:%S.%f')
-        else:
-            end_time = datetime.strptime(args.end, '%H:%M:%S')
+        end_time = parse_time(args.end)
 
     if not args.output_dir:
       output_dir = os.getcwd()
@@ -341,19 +1452,44 @@ if __name__ == '__main__':
         exit(-1)
  
     signal.signal(signal.SIGTERM, sigterm_handler)
+    shard_bytes = args.shard_size << 20 if args.shard_size else None
+    report = args.report or os.path.join(output_dir, 'run_report.jsonl')
+    cache_bytes = args.cache_size << 20
+    options = dict(output_dir=output_dir, deinterlace=args.deinterlace, milliseconds=args.milliseconds, step=args.step,
+                   start_time=start_time, end_time=end_time, prefix=args.prefix, single_pass=args.single_pass,
+                   realtime=args.realtime, threads=args.threads, pipe=args.pipe, resume=not args.overwrite,
+                   keyframe_index=args.keyframe_index, output_format=args.format, quality=args.quality,
+                   encode_threads=args.encode_threads, scene_threshold=args.scene, scene_max=args.scene_max,
+                   shard_bytes=shard_bytes, report=report, profile_dir=args.profile, cache_bytes=cache_bytes,
+                   max_procs=args.max_procs, timeout=args.timeout, retries=args.retries)
 
     utils.ensure_dir(output_dir)
     try:
-        if args.glob:
-            print('CPU pool count {}; using {} CPUs'.format(multiprocessing.cpu_count(), multiprocessing.cpu_count() - 1))
-            pool = multiprocessing.Pool(processes=multiprocessing.cpu_count() - 1)
-            for pattern in args.glob:
-                video_files = glob.iglob('{}/{}'.format(args.input,pattern))
-                print(video_files)
-                process_args = [(f, output_dir, args.deinterlace, args.milliseconds, args.step, start_time, end_time, args.prefix) for f in video_files]
-            results = pool.map(process_helper, process_args)
+        if args.serve:
+            serve(options)
+        elif args.ledger:
+            import ledger
+            workers = max(1, multiprocessing.cpu_count() - 1)
+            work = ledger.Ledger(args.ledger, args.lease, args.retries + 1)
+            video_files = find_videos(args.input, args.glob) if args.glob else [args.input]
+            # every node plans the same segments, and the first to add them wins; workers is set by the node
+            # running each segment
+            added = work.add(plan_jobs(video_files, args, options, None))
+            print('Added {} segments to {}; {}'.format(added, args.ledger, work.counts()))
+            completed = ledger.run_workers(args.ledger, ledger_helper, workers, args.lease, args.retries + 1)
+            print('Completed {} segments on this node; {}'.format(completed, work.counts()))
+            if work.claim_merge(ledger.owner_name()):
+                merge_outputs(output_dir, report, work)
+        elif args.glob:
+            workers = max(1, multiprocessing.cpu_count() - 1)
+            print('CPU pool count {}; using {} CPUs'.format(multiprocessing.cpu_count(), workers))
+            jobs = plan_jobs(find_videos(args.input, args.glob), args, options, workers)
+            results = scheduler.run(jobs, process_helper, workers)
+            for video, segment_results in results.items():
+                print('{} segments of {} finished, {} failed'.format(len(segment_results), video,
+                                                                     segment_results.count(False)))
         else:
-            process_video(args.input, output_dir, args.deinterlace, args.milliseconds, args.step, start_time, end_time, args.prefix)
+            process_video(args.input, **options)
     
     except Exception as ex:
         print(ex) 
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Reads image dimensions and bit depth from PNG IHDR and JPEG SOF headers without decoding any
+pixels
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import struct
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# channels of each png color type: gray, rgb, palette, gray+alpha, rgba
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+# jpeg start of frame markers; c4, c8 and cc are not frames
+JPEG_SOF = set(range(0xc0, 0xd0)) - set([0xc4, 0xc8, 0xcc])
+
+
+def read_png(f):
+    header = f.read(29)
+    if len(header) < 29 or header[12:16] != b'IHDR':
+        return None
+    width, height, bit_depth, color_type = struct.unpack('>IIBB', header[16:26])
+    return {'format': 'png', 'width': width, 'height': height, 'bit_depth': bit_depth,
+            'channels': PNG_CHANNELS.get(color_type, 0)}
+
+
+def read_jpeg(f):
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0:1] != b'\xff':
+            return None
+        code = ord(marker[1:2])
+        # standalone markers have no length
+        if code == 0xff:
+            f.seek(-1, 1)
+            continue
+        if code in (0x01, 0xd8) or 0xd0 <= code <= 0xd7:
+            continue
+        length = struct.unpack('>H', f.read(2))[0]
+        if code in JPEG_SOF:
+            bit_depth, height, width, channels = struct.unpack('>BHHB', f.read(6))
+            return {'format': 'jpeg', 'width': width, 'height': height, 'bit_depth': bit_depth,
+                    'channels': channels}
+        f.seek(length - 2, 1)
+
+
+def read_header(image):
+    '''
+    reads the dimensions of a png or jpeg from its header
+    :param image: full path to the image
+    :return: dictionary with format, width, height, bit_depth and channels
+    '''
+    with open(image, 'rb') as f:
+        signature = f.read(8)
+        f.seek(0)
+        if signature == PNG_SIGNATURE:
+            info = read_png(f)
+        elif signature[:2] == b'\xff\xd8':
+            info = read_jpeg(f)
+        else:
+            info = None
+    if info is None:
+        raise Exception('Cannot find height/width for image {}'.format(image))
+    return info
+
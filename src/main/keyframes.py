@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Persistent keyframe index of a video, mapping keyframe presentation times to byte offsets, used to
+pick the cheapest seek point for a window and to estimate how many frames a window costs to decode
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import bisect
+import asyncio
+import subprocess
+import probe
+from runner import Runner
+
+
+def run_ffprobe(input_video_path, runner=None):
+    '''
+    lists the keyframe packets of the first video stream; only packets are read, nothing is decoded
+    :param input_video_path: full path to the video
+    :param runner: runner.Runner whose process slots and timeout ffprobe runs with; defaults to a new Runner
+    :return: list of (pts time in seconds, byte offset) tuples sorted by time
+    '''
+    cmd = ['ffprobe', '-v', 'quiet', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,pos,flags',
+           '-of', 'csv=p=0', input_video_path]
+    runner = runner or Runner()
+    out = asyncio.run(runner.run(cmd, stdout=subprocess.PIPE))
+    keyframes = []
+    for line in out.decode().splitlines():
+        fields = line.strip().split(',')
+        if len(fields) < 3 or 'K' not in fields[2] or fields[0] in ('', 'N/A'):
+            continue
+        pos = int(fields[1]) if fields[1] not in ('', 'N/A') else -1
+        keyframes.append((float(fields[0]), pos))
+    keyframes.sort()
+    return keyframes
+
+
+class KeyframeIndex():
+    def __init__(self, input_video_path, cache_dir=None, build=True, runner=None):
+        '''
+        the KeyframeIndex class loads the keyframe index of a video from the probe cache, building it
+        with ffprobe the first time. Keyframe times are relative to the start time of the container, like
+        the ffmpeg -ss option
+
+        :param input_video_path: full path to the video
+        :param cache_dir: cache directory; defaults to probe.CACHE_DIR
+        :param build: if False, only load an index that is already cached
+        :param runner: runner.Runner to run ffprobe with when building the index
+
+        :Example:
+        index = KeyframeIndex('/Volumes/data/D008_03HD.mov')
+        point = index.seek_point(700.5)
+        '''
+        self.times = []
+        self.positions = []
+        path = probe.cache_path(input_video_path, 'keyframes', cache_dir)
+        keyframes = probe.read_cache(path)
+        if keyframes is None and build:
+            keyframes = run_ffprobe(input_video_path, runner)
+            probe.write_cache(path, keyframes)
+        # ffprobe packet times are absolute; ffmpeg adds the start time of the container to every seek
+        start_time = probe.probe(input_video_path, cache_dir, runner)['start_time'] if keyframes else 0.
+        for seconds, pos in keyframes or []:
+            self.times.append(seconds - start_time)
+            self.positions.append(pos)
+
+    def __len__(self):
+        return len(self.times)
+
+    def seek_point(self, seconds):
+        '''
+        finds the last keyframe at or before a time; decoding from it is the cheapest way to reach that time
+        :param seconds: time in seconds
+        :return: (keyframe time in seconds, byte offset) or None if there is no earlier keyframe, e.g. when the
+        index is empty; callers then seek the input like without an index
+        '''
+        i = bisect.bisect_right(self.times, seconds + 1e-6) - 1
+        if i < 0:
+            return None
+        return self.times[i], self.positions[i]
+
+    def decode_seconds(self, start, end):
+        '''
+        estimates the cost of decoding a window after seeking to it
+        :param start: window start in seconds
+        :param end: window end in seconds
+        :return: seconds of video decoded, from the keyframe before start to end, or from start without one
+        '''
+        point = self.seek_point(start)
+        return end - (point[0] if point is not None else start)
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+A work ledger shared by extractor instances on many nodes: an SQLite file on shared storage listing
+every video segment to extract. Workers claim segments in transactions holding the database write lock,
+keep a lease on each segment while they extract it, and record its completion; segments whose lease
+expired because their worker died are claimed again. Every transition of a leased segment checks its
+owner, so a worker whose lease expired can neither renew nor complete a segment another worker claimed.
+Any local directory works as a stand-in for the shared storage when testing
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+import multiprocessing
+from datetime import datetime
+from contextlib import contextmanager
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE,
+    video TEXT,
+    cost REAL,
+    kwargs TEXT,
+    state TEXT,
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER,
+    result TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, cost);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+STATES = ['pending', 'leased', 'done', 'failed']
+
+
+def owner_name():
+    '''
+    :return: name of this worker, unique across nodes
+    '''
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def encode(kwargs):
+    '''
+    encodes job arguments as json, with datetimes as HH:MM:SS.ffffff timecodes
+    :param kwargs: dictionary of job arguments
+    :return: json string
+    '''
+    return json.dumps(kwargs, sort_keys=True,
+                      default=lambda v: v.strftime('%H:%M:%S.%f') if isinstance(v, datetime) else str(v))
+
+
+class Ledger():
+    def __init__(self, path, lease_seconds=600, max_attempts=3):
+        '''
+        the Ledger class keeps the jobs of a distributed batch in an SQLite file. Every call opens its own
+        short-lived connection and writes in a BEGIN IMMEDIATE transaction, so any number of processes on any
+        number of nodes can share the file as long as the shared storage supports file locks
+
+        :param path: full path to the ledger file on shared storage
+        :param lease_seconds: seconds a claimed job stays leased without being renewed
+        :param max_attempts: number of times a job is claimed before it is marked failed
+
+        :Example:
+        ledger = Ledger('/mnt/shared/benthic.ledger')
+        ledger.add([(120.0, 'D0232.mov', {'video': 'D0232.mov', 'start_time': '00:00:00.000000'})])
+        job = ledger.claim(owner_name())
+        '''
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with self.transaction() as conn:
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+
+    @contextmanager
+    def transaction(self):
+        '''
+        opens a connection and runs the block in a transaction holding the write lock
+        :return: sqlite3 connection
+        '''
+        conn = sqlite3.connect(self.path, timeout=120, isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+    def add(self, jobs):
+        '''
+        adds jobs; jobs already in the ledger are left as they are, so every node can plan the same batch
+        :param jobs: list of (cost, video, kwargs dictionary) tuples
+        :return: number of jobs added
+        '''
+        now = time.time()
+        with self.transaction() as conn:
+            before = conn.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+            for cost, video, kwargs in jobs:
+                args = encode(kwargs)
+                key = '{}|{}|{}'.format(video, kwargs.get('start_time'), kwargs.get('end_time'))
+                conn.execute('INSERT OR IGNORE INTO jobs (key, video, cost, kwargs, state, attempts, updated) '
+                             'VALUES (?, ?, ?, ?, ?, 0, ?)', (key, video, cost, args, 'pending', now))
+            return conn.execute('SELECT COUNT(*) FROM jobs').fetchone()[0] - before
+
+    def claim(self, owner):
+        '''
+        claims the costliest pending job, or a job whose lease expired; expired jobs out of attempts are
+        marked failed
+        :param owner: name of the claiming worker
+        :return: (job id, kwargs dictionary), or None if no job can be claimed now
+        '''
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute("UPDATE jobs SET state = 'failed', updated = ? WHERE state = 'leased' AND lease_expires < ? "
+                         "AND attempts >= ?", (now, now, self.max_attempts))
+            row = conn.execute("SELECT id, kwargs FROM jobs WHERE state = 'pending' OR "
+                               "(state = 'leased' AND lease_expires < ?) ORDER BY cost DESC LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            cursor = conn.execute("UPDATE jobs SET state = 'leased', owner = ?, lease_expires = ?, "
+                                  "attempts = attempts + 1, updated = ? WHERE id = ? AND (state = 'pending' OR "
+                                  "(state = 'leased' AND lease_expires < ?))",
+                                  (owner, now + self.lease_seconds, now, row[0], now))
+            if cursor.rowcount != 1:
+                return None
+            return row[0], json.loads(row[1])
+
+    def renew(self, job_id, owner):
+        '''
+        extends the lease of a job
+        :return: True if owner still holds the lease
+        '''
+        now = time.time()
+        with self.transaction() as conn:
+            cursor = conn.execute("UPDATE jobs SET lease_expires = ?, updated = ? WHERE id = ? AND owner = ? "
+                                  "AND state = 'leased'", (now + self.lease_seconds, now, job_id, owner))
+            return cursor.rowcount == 1
+
+    def complete(self, job_id, owner, ok, result=None):
+        '''
+        records the end of a job. Only the worker holding the lease of the job can complete it; the completion of
+        a worker whose lease expired and was claimed by another worker is ignored, so it never overwrites the
+        state of a live lease
+        :param job_id: job id
+        :param owner: name of the worker
+        :param ok: True if the job succeeded; a failed job is pending again until it runs out of attempts
+        :param result: dictionary stored with the job
+        :return: True if this call recorded the completion
+        '''
+        now = time.time()
+        with self.transaction() as conn:
+            cursor = conn.execute("UPDATE jobs SET state = CASE WHEN ? THEN 'done' WHEN attempts >= ? THEN 'failed' "
+                                  "ELSE 'pending' END, lease_expires = NULL, result = ?, updated = ? "
+                                  "WHERE id = ? AND owner = ? AND state = 'leased'",
+                                  (bool(ok), self.max_attempts, json.dumps(result), now, job_id, owner))
+            return cursor.rowcount == 1
+
+    def counts(self):
+        '''
+        :return: dictionary of job state to number of jobs
+        '''
+        with self.transaction() as conn:
+            counts = dict(conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+        return dict((state, counts.get(state, 0)) for state in STATES)
+
+    def claim_merge(self, owner):
+        '''
+        claims the final merge once every job is done or failed; only one worker ever gets it
+        :param owner: name of the worker
+        :return: True if owner should run the merge
+        '''
+        with self.transaction() as conn:
+            remaining = conn.execute("SELECT COUNT(*) FROM jobs WHERE state IN ('pending', 'leased')").fetchone()[0]
+            if remaining:
+                return False
+            cursor = conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('merge', ?)", (owner,))
+            return cursor.rowcount == 1
+
+    def summary(self):
+        '''
+        :return: dictionary of video to list of its jobs, each a dictionary with the job arguments, state,
+        owner, attempts and result
+        '''
+        with self.transaction() as conn:
+            rows = conn.execute('SELECT video, kwargs, state, owner, attempts, result FROM jobs ORDER BY id').fetchall()
+        videos = {}
+        for video, kwargs, state, owner, attempts, result in rows:
+            videos.setdefault(video, []).append({'kwargs': json.loads(kwargs), 'state': state, 'owner': owner,
+                                                 'attempts': attempts,
+                                                 'result': json.loads(result) if result else None})
+        return videos
+
+
+class Lease():
+    def __init__(self, ledger, job_id, owner):
+        '''
+        the Lease class renews the lease of a job from a background thread while the job runs
+
+        :Example:
+        with Lease(ledger, job_id, owner):
+            process_video(**kwargs)
+        '''
+        self.ledger = ledger
+        self.job_id = job_id
+        self.owner = owner
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.renew)
+        self.thread.daemon = True
+
+    def renew(self):
+        while not self.stop.wait(self.ledger.lease_seconds / 3.):
+            try:
+                if not self.ledger.renew(self.job_id, self.owner):
+                    print('Lost the lease of job {}'.format(self.job_id))
+                    return
+            except sqlite3.Error as ex:
+                # the lease expires if the ledger stays unreachable, and another worker redoes the job
+                print('Cannot renew the lease of job {}: {}'.format(self.job_id, ex))
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop.set()
+        self.thread.join()
+
+
+def work(path, func, lease_seconds=600, max_attempts=3, poll=30):
+    '''
+    claims and runs jobs until every job in the ledger is done or failed, waiting for jobs leased by
+    other workers in case their lease expires
+    :param path: full path to the ledger
+    :param func: function run with the kwargs dictionary of each job; returns True on success
+    :param lease_seconds: seconds a job stays leased without being renewed
+    :param max_attempts: number of times a job is claimed before it is marked failed
+    :param poll: seconds between claims while other workers hold the remaining jobs
+    :return: number of jobs this worker completed
+    '''
+    ledger = Ledger(path, lease_seconds, max_attempts)
+    owner = owner_name()
+    completed = 0
+    while True:
+        job = ledger.claim(owner)
+        if job is None:
+            counts = ledger.counts()
+            if not counts['pending'] and not counts['leased']:
+                return completed
+            time.sleep(poll)
+            continue
+        job_id, kwargs = job
+        t_start = time.time()
+        with Lease(ledger, job_id, owner):
+            try:
+                ok = bool(func(kwargs))
+                error = None
+            except Exception as ex:
+                ok = False
+                error = str(ex)
+        if ledger.complete(job_id, owner, ok, {'ok': ok, 'seconds': time.time() - t_start, 'error': error}):
+            completed += 1
+
+
+def work_helper(args):
+    return work(*args)
+
+
+def run_workers(path, func, workers, lease_seconds=600, max_attempts=3):
+    '''
+    runs workers on a local pool, each claiming jobs from the ledger
+    :param path: full path to the ledger
+    :param func: function run for each job; must be picklable
+    :param workers: number of worker processes
+    :return: number of jobs completed on this node
+    '''
+    pool = multiprocessing.Pool(processes=workers)
+    try:
+        completed = pool.map(work_helper, [(path, func, lease_seconds, max_attempts)] * workers, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return sum(completed)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Durable per-video progress manifest recording which extraction windows finished, so an
+interrupted run can resume without redoing or overwriting finished frames
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import json
+import tarfile
+import hashlib
+
+
+def checksum(path):
+    '''
+    computes the sha1 checksum of a file
+    :param path: full path to the file
+    :return: hex digest
+    '''
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def tar_members(path):
+    '''
+    :param path: full path to a tar file, possibly cut short
+    :return: set of the names of the complete members
+    '''
+    names = set()
+    try:
+        with tarfile.open(path, 'r') as tar:
+            for member in tar:
+                names.add(member.name)
+    except (tarfile.TarError, OSError):
+        pass
+    return names
+
+
+class Manifest():
+    def __init__(self, path):
+        '''
+        the Manifest class keeps an append-only json lines file with one record per finished window.
+        Each record is appended with a single write and synced to disk, so segments of the same video
+        running in different processes can share a manifest and a killed run loses at most the window
+        in progress
+
+        :param path: full path to the manifest file, e.g. {output_dir}/{key}/manifest.jsonl
+
+        :Example:
+        Record a finished window
+        m = Manifest('/Volumes/data/out/D008_03HD/manifest.jsonl')
+        m.record('00:00:05.000-00:00:06.000', ['/Volumes/data/out/D008_03HD/imgs/D008_03HD_00-00-05_001.png'])
+        '''
+        self.path = path
+        self.windows = {}
+        self.fd = None
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # a line cut short when the run was killed; that window is redone
+                        continue
+                    self.windows[record['window']] = record
+
+    def done(self, window, verify=False):
+        '''
+        checks if a window finished; every frame it recorded must still exist with the same size, and every tar
+        shard it wrote to must still hold at least the bytes up to its last frame
+        :param window: window key
+        :param verify: if True, also verify the checksum of every frame, or the member names of every shard
+        :return: True if the window can be skipped
+        '''
+        record = self.windows.get(window)
+        if record is None:
+            return False
+        output_dir = os.path.dirname(self.path)
+        for name, (size, sha1) in record['files'].items():
+            path = os.path.join(output_dir, name)
+            if not os.path.exists(path) or os.path.getsize(path) != size:
+                return False
+            if verify and checksum(path) != sha1:
+                return False
+        for name, (size, members) in record.get('shards', {}).items():
+            path = os.path.join(output_dir, name)
+            if not os.path.exists(path) or os.path.getsize(path) < size:
+                return False
+            if verify and not set(members).issubset(tar_members(path)):
+                return False
+        return True
+
+    def frames(self, window):
+        '''
+        :param window: window key
+        :return: number of frames recorded for a finished window
+        '''
+        return self.windows[window]['frames']
+
+    def record(self, window, files, frames=None, shards=None):
+        '''
+        records a finished window with the size and checksum of each of its frames
+        :param window: window key
+        :param files: full paths to the frames extracted in the window
+        :param frames: number of frames extracted, if they are not files of their own, e.g. in tar shards
+        :param shards: dictionary of full path to each tar shard holding frames of the window to (bytes the shard
+        holds up to the last frame of the window, list of the member names of its frames), as returned by
+        ShardWriter.take()
+        :return:
+        '''
+        output_dir = os.path.dirname(self.path)
+        record = {'window': window, 'frames': len(files) if frames is None else frames,
+                  'files': dict((os.path.relpath(f, output_dir), [os.path.getsize(f), checksum(f)]) for f in files)}
+        if shards:
+            record['shards'] = dict((os.path.relpath(path, output_dir), [size, list(members)])
+                                    for path, (size, members) in shards.items())
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        # one write on an O_APPEND descriptor so records from concurrent segments never interleave
+        os.write(self.fd, (json.dumps(record) + '\n').encode())
+        self.flush()
+        self.windows[window] = record
+
+    def flush(self):
+        '''
+        syncs the manifest to disk
+        :return:
+        '''
+        if self.fd is not None:
+            os.fsync(self.fd)
+
+    def close(self):
+        '''
+        flushes and closes the manifest
+        :return:
+        '''
+        if self.fd is not None:
+            self.flush()
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Probes a video once with ffprobe for its duration, exact frame rate, dimensions, pixel format,
+bit depth and interlacing, caching the result on disk so re-runs over archived video skip probing
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import re
+import json
+import asyncio
+import hashlib
+import subprocess
+from fractions import Fraction
+import utils
+
+# override with the FRAMEEXTRACTOR_CACHE environment variable, e.g. to share the cache between nodes
+CACHE_DIR = os.environ.get('FRAMEEXTRACTOR_CACHE',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'deepsea-frameextractor'))
+
+
+def cache_path(input_video_path, kind, cache_dir=None):
+    '''
+    gets the path of a cache entry for a video file, keyed by its path, size and modification time so
+    the entry is invalidated when the file changes
+    :param input_video_path: full path to the video
+    :param kind: kind of cache entry, e.g. probe
+    :param cache_dir: cache directory; defaults to CACHE_DIR
+    :return: full path to the cache entry, or None for urls, which are not cached
+    '''
+    if utils.is_url(input_video_path):
+        return None
+    stat = os.stat(input_video_path)
+    key = '{}|{}|{}'.format(os.path.abspath(input_video_path), stat.st_size, int(stat.st_mtime))
+    name = hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join(cache_dir or CACHE_DIR, kind, '{}.json'.format(name))
+
+
+def read_cache(path):
+    '''
+    reads a cache entry
+    :param path: full path to the cache entry, or None
+    :return: the cached json value, or None if there is no valid entry
+    '''
+    if path and os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            pass
+    return None
+
+
+def write_cache(path, value):
+    '''
+    writes a cache entry atomically, so concurrent workers never read a partial entry; failures
+    to cache are reported but not raised
+    :param path: full path to the cache entry, or None to skip caching
+    :param value: json serializable value
+    :return:
+    '''
+    if not path:
+        return
+    try:
+        utils.ensure_dir(os.path.dirname(path))
+        tmp = '{}.tmp{}'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(value, f)
+        os.rename(tmp, path)
+    except (IOError, OSError) as ex:
+        print('Cannot write cache {}: {}'.format(path, ex))
+
+
+def bit_depth(stream):
+    '''
+    gets the bits per component of a video stream
+    :param stream: ffprobe stream dictionary
+    :return: bit depth, e.g. 8 or 10
+    '''
+    if stream.get('bits_per_raw_sample'):
+        return int(stream['bits_per_raw_sample'])
+    match = re.search(r'p(?P<depth>\d+)(le|be)$', stream.get('pix_fmt', ''))
+    return int(match.group('depth')) if match else 8
+
+
+def run_ffprobe(input_video_path, runner=None):
+    '''
+    runs ffprobe once for the container and first video stream
+    :param input_video_path: full path or url to the video
+    :param runner: runner.Runner whose process slots and timeout ffprobe runs with, so a hung probe of a remote
+    url is killed; defaults to a new Runner
+    :return: dictionary with duration, start_time, fps, width, height, pix_fmt, bit_depth, codec, field_order, interlaced
+    :raises runner.ProcessError: if ffprobe fails or times out
+    '''
+    # runner imports this module for the cache directory
+    from runner import Runner
+    cmd = ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams',
+           '-select_streams', 'v:0', input_video_path]
+    runner = runner or Runner()
+    out = asyncio.run(runner.run(cmd, stdout=subprocess.PIPE))
+    result = json.loads(out.decode())
+    if not result.get('streams'):
+        raise Exception('Cannot find a video stream in {}'.format(input_video_path))
+    stream = result['streams'][0]
+    fmt = result.get('format', {})
+    # r_frame_rate is the exact rational rate, e.g. 30000/1001; some containers only set the average
+    fps = stream.get('r_frame_rate', '0/0')
+    if fps.endswith('/0') or Fraction(fps) == 0:
+        fps = stream.get('avg_frame_rate', '0/0')
+    if fps.endswith('/0') or Fraction(fps) == 0:
+        raise Exception('Cannot find frame rate for {}'.format(input_video_path))
+    duration = fmt.get('duration') or stream.get('duration')
+    if duration is None:
+        raise Exception('Cannot find duration for {}'.format(input_video_path))
+    field_order = stream.get('field_order', 'unknown')
+    return {'duration': float(duration),
+            # ffmpeg seeks relative to the start time of the container, which is not 0 for e.g. MPEG-TS
+            'start_time': float(fmt.get('start_time') or 0.),
+            'fps': str(Fraction(fps)),
+            'width': int(stream['width']),
+            'height': int(stream['height']),
+            'pix_fmt': stream.get('pix_fmt'),
+            'bit_depth': bit_depth(stream),
+            'codec': stream.get('codec_name'),
+            'field_order': field_order,
+            'interlaced': field_order in ('tt', 'bb', 'tb', 'bt')}
+
+
+def probe(input_video_path, cache_dir=None, runner=None):
+    '''
+    probes a video, reading the result from the on-disk cache when the file has not changed
+    :param input_video_path: full path or url to the video
+    :param cache_dir: cache directory; defaults to CACHE_DIR
+    :param runner: runner.Runner to run ffprobe with when the video is not cached
+    :return: dictionary with duration, start_time, fps, width, height, pix_fmt, bit_depth, codec, field_order, interlaced
+    :Example:
+    info = probe('/Volumes/data/D008_03HD.mov')
+    fps = Fraction(info['fps'])
+    '''
+    if not utils.is_url(input_video_path) and not os.path.exists(input_video_path):
+        raise Exception('{} does not exist'.format(input_video_path))
+    path = cache_path(input_video_path, 'probe', cache_dir)
+    info = read_cache(path)
+    # entries cached before the start time was probed are probed again
+    if info is None or 'start_time' not in info:
+        info = run_ffprobe(input_video_path, runner)
+        write_cache(path, info)
+    return info
+
+
+def frame_rate(info):
+    '''
+    :param info: dictionary returned by probe()
+    :return: exact frame rate as a Fraction, e.g. Fraction(30000, 1001)
+    '''
+    return Fraction(info['fps'])
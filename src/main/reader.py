@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Reads decoded video frames from an ffmpeg rawvideo pipe into numpy arrays
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import time
+import shlex
+import threading
+import subprocess
+import numpy as np
+from runner import ProcessError
+
+
+class FrameReader():
+    def __init__(self, input_string, width, height, bit_depth=8, frames=None, runner=None):
+        '''
+        the FrameReader class runs ffmpeg with rawvideo output to a pipe and reads each
+        decoded frame into a reusable numpy buffer, so frames never touch the disk
+
+        :param input_string: ffmpeg command up to and including the input and filter options
+        :param width: width of the decoded frames
+        :param height: height of the decoded frames
+        :param bit_depth: bits per component of the video; greater than 8 reads 16-bit frames
+        :param frames: maximum number of frames to read, or None to read to the end of the input
+        :param runner: optional runner.Runner; ffmpeg then runs in one of its process slots, and is killed once the
+        reader has waited for frames longer than its timeout in total, so a slow consumer never times ffmpeg out
+
+        :Example:
+        Read every frame of a video
+        reader = FrameReader('ffmpeg -loglevel error -i /Volumes/data/D008_03HD.mov', 1920, 1080)
+        for img in reader:
+            print(img.shape)
+        reader.check()
+        '''
+        self.width = width
+        self.height = height
+        if bit_depth > 8:
+            self.pix_fmt = 'bgr48le'
+            self.dtype = np.dtype('<u2')
+        else:
+            self.pix_fmt = 'bgr24'
+            self.dtype = np.dtype('u1')
+        self.frame_bytes = width * height * 3 * self.dtype.itemsize
+        shell_string = input_string
+        if frames is not None:
+            shell_string += ' -frames:v {}'.format(frames)
+        shell_string += ' -an -f rawvideo -pix_fmt {} pipe:1'.format(self.pix_fmt)
+        self.shell_string = shell_string
+        self.args = shlex.split(shell_string)
+        self.runner = runner
+        self.timeout = runner.timeout if runner is not None else None
+        self.proc = None
+        self.slot = None
+        self.returncode = None
+        # eof is set once ffmpeg closed the pipe, terminated if the reader stopped ffmpeg before that
+        self.eof = False
+        self.terminated = False
+        self.timed_out = False
+        self.waited = 0.
+        self.waiting_since = None
+        # ffmpeg's standard error is collected and printed only if the reader did not stop ffmpeg on purpose,
+        # which makes ffmpeg complain about the broken pipe
+        self.stderr = b''
+        self.drain = None
+        self.lock = threading.Lock()
+        self.close_lock = threading.Lock()
+        self.stop = threading.Event()
+
+    def __iter__(self):
+        '''
+        yields each decoded frame as a height x width x 3 array; the array is a view of a buffer that is
+        reused for the next frame, so callers must copy it if they need it after the next iteration
+        '''
+        print(self.shell_string)
+        if self.runner is not None:
+            self.slot = self.runner.hold()
+        self.proc = subprocess.Popen(self.args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                     bufsize=self.frame_bytes)
+        self.drain = threading.Thread(target=self.read_stderr)
+        self.drain.daemon = True
+        self.drain.start()
+        if self.timeout:
+            watchdog = threading.Thread(target=self.watch)
+            watchdog.daemon = True
+            watchdog.start()
+        buffer = bytearray(self.frame_bytes)
+        view = memoryview(buffer)
+        img = np.frombuffer(buffer, dtype=self.dtype).reshape((self.height, self.width, 3))
+        try:
+            while True:
+                read = 0
+                self.wait_start()
+                try:
+                    while read < self.frame_bytes:
+                        n = self.proc.stdout.readinto(view[read:])
+                        if not n:
+                            break
+                        read += n
+                finally:
+                    self.wait_end()
+                if read < self.frame_bytes:
+                    self.eof = True
+                    break
+                yield img
+        finally:
+            self.close()
+
+    def read_stderr(self):
+        '''
+        reads ffmpeg's standard error so ffmpeg never blocks on a full pipe
+        '''
+        self.stderr = self.proc.stderr.read()
+        self.proc.stderr.close()
+
+    def wait_start(self):
+        with self.lock:
+            self.waiting_since = time.time()
+
+    def wait_end(self):
+        with self.lock:
+            self.waited += time.time() - self.waiting_since
+            self.waiting_since = None
+
+    def watch(self):
+        '''
+        kills ffmpeg once the reader has waited for it longer than the timeout, counting only the time spent
+        waiting for frames and for ffmpeg to exit
+        '''
+        while not self.stop.wait(min(1., self.timeout / 10.)):
+            with self.lock:
+                waited = self.waited + (time.time() - self.waiting_since if self.waiting_since else 0.)
+            if waited > self.timeout:
+                self.timed_out = True
+                self.proc.kill()
+                return
+
+    def close(self):
+        '''
+        waits for ffmpeg to exit after the end of its output, or stops it if the caller stopped reading
+        early, and releases its process slot
+        :return: ffmpeg return code
+        '''
+        # a consumer may close the reader from another thread to stop it
+        with self.close_lock:
+            return self.close_proc()
+
+    def close_proc(self):
+        if self.proc is None or self.returncode is not None:
+            return self.returncode
+        if not self.eof:
+            self.terminated = True
+            self.proc.terminate()
+        self.proc.stdout.close()
+        self.wait_start()
+        try:
+            self.returncode = self.proc.wait()
+        finally:
+            self.wait_end()
+            self.stop.set()
+            if self.slot is not None:
+                self.runner.release(self.slot)
+                self.slot = None
+        self.drain.join()
+        if self.stderr and not self.terminated:
+            print(self.stderr.decode('utf-8', 'replace').strip())
+        return self.returncode
+
+    def check(self):
+        '''
+        closes the reader and checks how ffmpeg exited; stopping ffmpeg because the caller stopped reading
+        early is not a failure
+        :return:
+        :raises runner.ProcessError: if ffmpeg failed or timed out
+        '''
+        returncode = self.close()
+        if self.timed_out:
+            raise ProcessError(self.args, None, 'after {} seconds'.format(self.timeout).encode())
+        if returncode and not self.terminated:
+            raise ProcessError(self.args, returncode, self.stderr)
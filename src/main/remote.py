@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Reads http videos through a local range proxy. ffmpeg opens the video from the proxy, which serves each
+range from a bounded on-disk LRU cache of fixed size blocks and fetches missing blocks from the archive
+over keep-alive connections, so seeking to every step window neither reconnects nor downloads the same
+bytes twice. The blocks of the next window can be prefetched while the current window decodes
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import re
+import hashlib
+import threading
+import http.client
+from urllib.parse import urlsplit, quote, unquote
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from concurrent.futures import ThreadPoolExecutor
+import probe
+import utils
+
+# size of the blocks fetched from the archive and cached
+BLOCK_BYTES = 4 << 20
+# default maximum size of the block cache
+CACHE_BYTES = 2 << 30
+TIMEOUT = 60
+
+
+class BlockCache():
+    def __init__(self, cache_dir=None, max_bytes=CACHE_BYTES):
+        '''
+        the BlockCache class keeps fixed size blocks of remote files in {cache_dir}/{file key}/{block number},
+        evicting the least recently read blocks when the cache grows past max_bytes. Blocks are written
+        atomically, so processes on the same host can share the cache
+
+        :param cache_dir: cache directory; defaults to the remote directory of the probe cache
+        :param max_bytes: maximum size of the cache in bytes
+        '''
+        self.cache_dir = cache_dir or os.path.join(probe.CACHE_DIR, 'remote')
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        utils.ensure_dir(self.cache_dir)
+        self.total = sum(size for _, _, size in self.entries())
+
+    def entries(self):
+        '''
+        :return: list of (last read time, path, size) of every cached block
+        '''
+        entries = []
+        for d in os.scandir(self.cache_dir):
+            if not d.is_dir():
+                continue
+            for f in os.scandir(d.path):
+                if '.tmp' in f.name:
+                    continue
+                try:
+                    stat = f.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, f.path, stat.st_size))
+        return entries
+
+    def path(self, key, block):
+        return os.path.join(self.cache_dir, key, '{:08d}'.format(block))
+
+    def get(self, key, block):
+        '''
+        :return: the cached block, or None
+        '''
+        path = self.path(key, block)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # the modification time orders blocks by their last read for eviction
+            os.utime(path, None)
+            return data
+        except OSError:
+            return None
+
+    def put(self, key, block, data):
+        path = self.path(key, block)
+        utils.ensure_dir(os.path.dirname(path))
+        tmp = '{}.tmp{}_{}'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, path)
+        with self.lock:
+            self.total += len(data)
+            if self.total > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        '''
+        removes the least recently read blocks until the cache is below 90% of its maximum size
+        '''
+        entries = sorted(self.entries())
+        self.total = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self.total <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.total -= size
+
+
+class RemoteFile():
+    def __init__(self, url, cache, block_bytes=BLOCK_BYTES):
+        '''
+        the RemoteFile class reads byte ranges of an http file through a block cache. Idle keep-alive
+        connections to the server are pooled, so the short-lived ffmpeg connections of every window reuse them
+
+        :param url: http or https url of the file
+        :param cache: BlockCache
+        :param block_bytes: size of the blocks requested from the server
+        '''
+        self.url = url
+        self.cache = cache
+        self.block_bytes = block_bytes
+        parts = urlsplit(url)
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.target = parts.path + ('?' + parts.query if parts.query else '')
+        self.idle = []
+        self.inflight = {}
+        self.lock = threading.Lock()
+        response, _ = self.request('HEAD', {})
+        if response.status != 200:
+            raise Exception('Cannot open {}: HTTP {}'.format(url, response.status))
+        self.size = int(response.getheader('Content-Length', 0))
+        self.ranges = response.getheader('Accept-Ranges', '') == 'bytes' and self.size > 0
+        # a changed file on the server gets new cache entries
+        version = '{}|{}|{}|{}'.format(url, self.size, response.getheader('ETag', ''),
+                                       response.getheader('Last-Modified', ''))
+        self.key = hashlib.sha1(version.encode()).hexdigest()
+
+    def connection(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.netloc, timeout=TIMEOUT)
+        return http.client.HTTPConnection(self.netloc, timeout=TIMEOUT)
+
+    def request(self, method, headers):
+        '''
+        sends a request on an idle keep-alive connection and reads the response, retrying once on a new
+        connection if the server closed the idle one
+        :return: (http.client.HTTPResponse, body bytes)
+        '''
+        for attempt in range(2):
+            conn = self.connection()
+            try:
+                conn.request(method, self.target, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if attempt:
+                    raise
+                continue
+            if response.will_close:
+                conn.close()
+            else:
+                with self.lock:
+                    self.idle.append(conn)
+            return response, data
+
+    def fetch(self, block):
+        '''
+        downloads a block from the server
+        :return: block bytes
+        '''
+        first = block * self.block_bytes
+        last = min(self.size, first + self.block_bytes) - 1
+        response, data = self.request('GET', {'Range': 'bytes={}-{}'.format(first, last)})
+        if response.status != 206 or len(data) != last - first + 1:
+            raise Exception('Cannot read bytes {}-{} of {}: HTTP {}'.format(first, last, self.url, response.status))
+        return data
+
+    def block(self, block):
+        '''
+        gets a block from the cache, or downloads and caches it; concurrent reads of the same block
+        wait for a single download
+        :return: block bytes
+        '''
+        data = self.cache.get(self.key, block)
+        if data is not None:
+            return data
+        with self.lock:
+            event = self.inflight.get(block)
+            owner = event is None
+            if owner:
+                event = self.inflight[block] = threading.Event()
+        if not owner:
+            event.wait()
+            data = self.cache.get(self.key, block)
+            if data is not None:
+                return data
+        try:
+            data = self.fetch(block)
+            self.cache.put(self.key, block, data)
+            return data
+        finally:
+            if owner:
+                with self.lock:
+                    del self.inflight[block]
+                event.set()
+
+    def read(self, offset, length):
+        '''
+        reads a byte range
+        :return: generator of byte strings covering offset to offset + length, clipped to the file size
+        '''
+        end = min(self.size, offset + length)
+        while offset < end:
+            block, skip = divmod(offset, self.block_bytes)
+            data = self.block(block)[skip:skip + end - offset]
+            if not data:
+                return
+            offset += len(data)
+            yield data
+
+    def blocks(self, first, last):
+        '''
+        :return: range of the blocks holding bytes first to last
+        '''
+        return range(first // self.block_bytes, min(last, self.size - 1) // self.block_bytes + 1)
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def remote(self):
+        remote = self.server.files.get(unquote(self.path.lstrip('/')))
+        if remote is None:
+            self.send_error(404)
+        return remote
+
+    def do_HEAD(self):
+        remote = self.remote()
+        if remote is None:
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(remote.size))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+    def do_GET(self):
+        remote = self.remote()
+        if remote is None:
+            return
+        first, last = 0, remote.size - 1
+        match = re.match(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                first = int(match.group(1))
+                if match.group(2):
+                    last = min(last, int(match.group(2)))
+            else:
+                first = max(0, remote.size - int(match.group(2)))
+            if first > last:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(remote.size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(first, last, remote.size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(last - first + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        try:
+            for data in remote.read(first, last - first + 1):
+                self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg closes the connection when it seeks
+            self.close_connection = True
+
+
+class RangeProxy(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, cache):
+        '''
+        the RangeProxy class serves registered remote files to ffmpeg on a local port, one thread per connection
+
+        :param cache: BlockCache the files are read through
+        '''
+        HTTPServer.__init__(self, ('127.0.0.1', 0), ProxyHandler)
+        self.cache = cache
+        self.files = {}
+        self.prefetcher = ThreadPoolExecutor(max_workers=2)
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def open(self, url):
+        '''
+        registers a remote file
+        :param url: http or https url
+        :return: (local url to open with ffmpeg, RemoteFile), or (url, None) if the server cannot serve ranges
+        '''
+        name = hashlib.sha1(url.encode()).hexdigest()[:16]
+        remote = self.files.get(name)
+        if remote is None:
+            remote = RemoteFile(url, self.cache)
+            if not remote.ranges:
+                print('{} does not serve byte ranges; reading it directly'.format(url))
+                return url, None
+            self.files[name] = remote
+        return 'http://127.0.0.1:{}/{}'.format(self.server_address[1], quote(name)), remote
+
+    def prefetch(self, remote, first, last):
+        '''
+        downloads the blocks of a byte range in the background
+        :param remote: RemoteFile
+        :param first: first byte
+        :param last: last byte
+        :return:
+        '''
+        for block in remote.blocks(max(0, first), last):
+            self.prefetcher.submit(remote.block, block)
+
+
+proxy = None
+proxy_lock = threading.Lock()
+
+
+def is_http(input_video_path):
+    return input_video_path.lower().startswith(('http://', 'https://'))
+
+
+def get_proxy(cache_bytes=CACHE_BYTES, cache_dir=None):
+    '''
+    gets the range proxy of this process, starting it on first use
+    :param cache_bytes: maximum size of the block cache in bytes
+    :param cache_dir: cache directory; defaults to the remote directory of the probe cache
+    :return: RangeProxy
+    '''
+    global proxy
+    with proxy_lock:
+        if proxy is None:
+            proxy = RangeProxy(BlockCache(cache_dir, cache_bytes))
+        return proxy
+
+
+class RemoteInput():
+    def __init__(self, url, duration, cache_bytes=CACHE_BYTES, cache_dir=None):
+        '''
+        the RemoteInput class opens an http video through the range proxy and prefetches windows by time,
+        estimating their byte range from the average bit rate of the video
+
+        :param url: http or https url of the video
+        :param duration: length of the video in seconds
+        :param cache_bytes: maximum size of the block cache in bytes
+        :param cache_dir: cache directory
+
+        :Example:
+        remote = RemoteInput('http://archive.mbari.org/D0232_20160501T000030Z.mov', 3600)
+        shell_string = 'ffmpeg -i {} ...'.format(remote.url)
+        remote.prefetch(5, 6)
+        '''
+        self.proxy = get_proxy(cache_bytes, cache_dir)
+        self.url, self.file = self.proxy.open(url)
+        self.duration = duration
+
+    def prefetch(self, start_seconds, end_seconds):
+        '''
+        prefetches the bytes of a window in the background, padded by a block on either side for the
+        container index and keyframe before the window
+        :param start_seconds: window start in seconds
+        :param end_seconds: window end in seconds
+        :return:
+        '''
+        if self.file is None or not self.duration:
+            return
+        rate = self.file.size / self.duration
+        pad = self.file.block_bytes
+        self.proxy.prefetch(self.file, int(start_seconds * rate) - pad, int(end_seconds * rate) + pad)
@@ -8,19 +8,22 @@ __maintainer__ = "Danelle Cline"
 __email__ = "dcline at mbari.org"
 __doc__ = '''
 
-Utility for rescaling xml files 
+Utility for rescaling xml files
 
 @author: __author__
 @status: __status__
 @license: __license__
 '''
-import cv2
 import sys
 import os
-import glob
 import shutil
-from bs4 import BeautifulSoup, Tag
-from xml.dom.minidom import parse
+import multiprocessing
+import annotation
+import dataset
+import imageinfo
+
+width = 960
+height = 540
 
 def process_command_line():
   import argparse
@@ -36,74 +39,143 @@ def process_command_line():
                       default='', required=True)
   parser.add_argument('-l', '--label', action='store', help='label to assign to saliency',
                       default='', required=False)
+  parser.add_argument('-j', '--jobs', action='store', help='number of annotations to process in parallel; defaults to the number of CPUs',
+                      default=multiprocessing.cpu_count(), required=False, type=int)
+  parser.add_argument('-n', '--dry_run', action='store_true', help='report which annotations need work from the dataset index, without reading any xml or image',
+                      required=False)
   args = parser.parse_args()
   return args
 
+def image_actions(h, w):
+  '''
+  finds the work an image of h x w needs
+  :return: list of actions: deinterlace and/or rescale
+  '''
+  actions = []
+  if h != height and w != width and h == 1080 and w == 1920:
+    actions.append('deinterlace')
+    h, w = h // 2, w // 2
+  if h < height or w < width:
+    actions.append('rescale')
+  return actions
+
+def row_actions(row):
+  '''
+  finds the work an annotation needs from its dataset index row, without reading the xml or the image
+  :param row: DatasetIndex row
+  :return: list of actions: remove, deinterlace, rescale and/or relabel
+  '''
+  if row['image_size'] is None:
+    return ['remove']
+  # an image whose header could not be read is checked by rescale()
+  actions = image_actions(row['height'], row['width']) if row['width'] else []
+  if row['width'] is None or (row['size_width'], row['size_height']) != (width, height) or \
+          any('saliency' in name or 'Saliency' in name for name in row['labels']):
+    actions.append('relabel')
+  return actions
+
+def rescale(xml_in, label, image_path=None, dims=None):
+  '''
+  deinterlaces or rescales the image of an annotation to width x height, relabels saliency objects
+  and scales their boxes, then atomically replaces the annotation
+  :param xml_in: full path to the annotation xml
+  :param label: label to assign to saliency
+  :param image_path: full path to the image, e.g. from the dataset index; found from the <folder> tag if None
+  :param dims: (h, w) of the image, e.g. from the dataset index; read from the image header if None
+  :return: (xml_in, list of actions)
+  '''
+  root = annotation.read(xml_in)
+  scale_width = float(width/float(root.findtext('size/width')))
+  scale_height = float(height/float(root.findtext('size/height')))
+  root.find('size/width').text = str(width)
+  root.find('size/height').text = str(height)
+
+  # check the image header first, so images already at the right size are never decoded
+  image_path = image_path or annotation.image_path(root, xml_in)
+  if not os.path.exists(image_path):
+    os.remove(xml_in)
+    return xml_in, ['remove']
+  if dims is None:
+    info = imageinfo.read_header(image_path)
+    dims = info['height'], info['width']
+  h, w = dims
+  actions = image_actions(h, w)
+  name = os.path.basename(xml_in).split('.')[0]
+  if actions:
+    # cv2 is only imported in the workers that decode an image
+    import cv2
+    img = cv2.imread(image_path)
+    if img is None:
+      os.remove(xml_in)
+      return xml_in, ['remove']
+    print('Reading {} {}x{}'.format(image_path, h, w))
+
+  if 'deinterlace' in actions:
+    print('Deinterlacing {} {}x{} to {}x{}'.format(name, h, w, height, width))
+    shutil.copyfile(image_path, image_path + '.bak')
+    de_interlaced_img = img[::2, 1::2]
+    cv2.imwrite(image_path, de_interlaced_img)
+    h, w, channels = de_interlaced_img.shape
+
+  if 'rescale' in actions:
+    print('Rescaling {} {}x{} to {}x{}'.format(name, h, w, height, width))
+    resized_image = cv2.resize(img, (width, height))
+    h, w, channels = resized_image.shape
+    cv2.imwrite(image_path, resized_image)
+
+  # replace saliency with the label
+  for o in root.iter('object'):
+    tag_name = o.find('name')
+    if 'saliency' in tag_name.text or 'Saliency' in tag_name.text:
+      tag_name.text = label
+      for tag, scale in (('xmin', scale_width), ('xmax', scale_width), ('ymin', scale_height), ('ymax', scale_height)):
+        v = o.find('bndbox/' + tag)
+        v.text = str(int(round(float(v.text)) * scale))
+
+  print('Writing ' + xml_in)
+  annotation.write(root, xml_in)
+  return xml_in, actions
+
+def rescale_helper(args):
+  '''
+  rescales an annotation, reporting errors instead of raising them so one bad annotation does not stop the batch
+  :return: (xml_in, list of actions, error message or None)
+  '''
+  try:
+    xml_in, actions = rescale(*args)
+    return xml_in, actions, None
+  except Exception as ex:
+    return args[0], [], str(ex)
+
 if __name__ == '__main__':
   args = process_command_line()
-  width = 960
-  height = 540
-  for xml_in in glob.iglob(args.input_dir + '/*.xml'):
-    print('Found {}'.format(xml_in))
-    with open(xml_in, 'r') as myfile:
-        soup = BeautifulSoup(myfile.read(), 'xml')
-        root = os.path.basename(xml_in).split('.')[0]
-        scale_width = float(width/float(soup.annotation.size.width.string))
-        scale_height = float(height/float(soup.annotation.size.height.string))
-        soup.size.width.string = str(width) 
-        soup.size.height.string = str(height)
- 
-        # deinterlace
-        parent_path = xml_in.split(soup.annotation.folder.string)[0] + soup.annotation.folder.string
-        image_path = '{}/{}.png'.format(parent_path, root)
-        img = cv2.imread(image_path)
-        if img is None:
-          os.remove(xml_in)
-          continue
-        h, w, channels = img.shape
-        print('Reading {} {}x{}'.format(image_path, h, w))
-
-        if h != height and w != width and h == 1080 and w == 1920:
-          print('Deinterlacing {} {}x{} to {}x{}'.format(root, h, w, height, width))
-          org_path = '{}/{}.png.bak'.format(parent_path, root)
-          shutil.copyfile(image_path, org_path)
-          de_interlaced_img = img[::2, 1::2]
-          cv2.imwrite(image_path, de_interlaced_img)
-          h, w, channels = de_interlaced_img.shape
-
-        if h < height or w < width:
-          print('Rescaling {} {}x{} to {}x{}'.format(root, h, w, height, width))
-          resized_image = cv2.resize(img, (width, height))
-          h, w, channels = resized_image.shape
-          cv2.imwrite(image_path, resized_image)
-
-        # replace saliency with the label
-        objects = soup.find_all('object')
-        for o in objects:
-          tag_name = o.find('name')
-          if 'saliency' in tag_name.string or 'Saliency' in tag_name.string :
-            tag_name.string = args.label
-            o.bndbox.xmin.string = str(int(round(float(o.bndbox.xmin.string)) * scale_width))
-            o.bndbox.xmax.string = str(int(round(float(o.bndbox.xmax.string)) * scale_width))
-            o.bndbox.ymin.string = str(int(round(float(o.bndbox.ymin.string)) * scale_height))
-            o.bndbox.ymax.string = str(int(round(float(o.bndbox.ymax.string)) * scale_height))
-
-    xml_out = 'tmp.xml'
-    if xml_out == xml_in:
-      raise Exception('{} will be overwritten'.format(xml_out))
-
-    print('Writing ' + xml_out)
-    f = open('tmp.xml', "w")
-    f.write(soup.decode_contents())
-    f.close()
-
-    # a bit of hacky workaround to print a better looking xml than what beautifulsoup produces
-    xmlf = parse('tmp.xml')
-    pretty_xml_as_string = xmlf.toprettyxml()
-    shutil.copyfile(xml_in, xml_in + '.bak')
-    xml_out = xml_in
-    # remove empty lines
-    pretty_xml_as_string = os.linesep.join([s for s in pretty_xml_as_string.splitlines() if s.strip()])
-    with open(xml_out, 'w') as f:
-      f.write(pretty_xml_as_string)
-    f.close()
+  pool = multiprocessing.Pool(processes=max(1, args.jobs))
+  # only annotations that changed since the last run are read to bring the index up to date
+  index = dataset.DatasetIndex(args.input_dir)
+  index.update(pool)
+  rows = index.query()
+  print('Found {} annotations'.format(len(rows)))
+  counts = {}
+  work = []
+  for row in rows:
+    actions = row_actions(row)
+    if args.dry_run and actions:
+      print('{} needs {}'.format(row['xml'], ' '.join(actions)))
+    elif actions:
+      work.append((row['xml'], args.label, row['image'], (row['height'], row['width']) if row['width'] else None))
+    for action in actions:
+      counts[action] = counts.get(action, 0) + 1
+  failed = 0
+  if work:
+    counts = {}
+    for xml_in, actions, error in pool.imap_unordered(rescale_helper, work, chunksize=16):
+      if error:
+        print('Error {}: {}'.format(xml_in, error))
+        failed += 1
+      for action in actions:
+        counts[action] = counts.get(action, 0) + 1
+    index.update(pool, [w[0] for w in work])
+  pool.close()
+  pool.join()
+  index.close()
+  print('{} annotations: {}, {} failed'.format(len(rows), ', '.join('{} {}'.format(counts[a], a) for a in sorted(counts)) or 'no image work', failed))
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Runs ffmpeg and ffprobe with asyncio, without a shell. The number of external processes running on a
+host is capped across all workers with lock files, every process gets a timeout and its exit code is
+checked, and a pipeline runs the ffmpeg decode of the next window while the current window is
+post-processed and tagged, retrying windows whose ffmpeg failed
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import time
+import fcntl
+import shlex
+import asyncio
+import subprocess
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import probe
+import utils
+
+
+class ProcessError(Exception):
+    def __init__(self, args, returncode, stderr=b''):
+        '''
+        raised when an external process exits with an error or times out
+        :param args: command line
+        :param returncode: exit code, or None if the process timed out
+        :param stderr: standard error of the process
+        '''
+        message = stderr.decode('utf-8', 'replace').strip()[-500:]
+        if returncode is None:
+            Exception.__init__(self, '{} timed out {}'.format(' '.join(args), message))
+        else:
+            Exception.__init__(self, '{} exited with {} {}'.format(' '.join(args), returncode, message))
+        self.returncode = returncode
+
+
+def split(command):
+    '''
+    splits an ffmpeg command string into arguments the way a shell would, so commands run without a shell
+    :param command: command string
+    :return: list of arguments
+    '''
+    return shlex.split(command)
+
+
+class Runner():
+    def __init__(self, max_procs=None, timeout=None, retries=2, slots_dir=None):
+        '''
+        the Runner class runs external processes with asyncio
+
+        :param max_procs: maximum number of external processes running at once on this host, shared by every
+        worker using the same slots directory; defaults to the number of cpus
+        :param timeout: seconds before a process is killed, or None for no timeout
+        :param retries: number of times a failed window is decoded again
+        :param slots_dir: directory of the lock files capping the processes; defaults to the slots directory of the
+        probe cache
+
+        :Example:
+        runner = Runner(max_procs=8, timeout=600)
+        runner.call('ffmpeg -y -loglevel error -ss 00:00:05.000 -i D008_03HD.mov -frames:v 1 f.png')
+        '''
+        self.max_procs = max_procs or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.retries = retries
+        self.slots_dir = slots_dir or os.path.join(probe.CACHE_DIR, 'slots')
+        utils.ensure_dir(self.slots_dir)
+
+    def try_slot(self):
+        '''
+        :return: a locked slot file descriptor, or None if every slot is taken
+        '''
+        for i in range(self.max_procs):
+            fd = os.open(os.path.join(self.slots_dir, '{}.lock'.format(i)), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except OSError:
+                os.close(fd)
+        return None
+
+    async def acquire(self):
+        '''
+        waits for a free process slot; the lock is released by the kernel if the worker dies
+        :return: locked slot file descriptor
+        '''
+        while True:
+            fd = self.try_slot()
+            if fd is not None:
+                return fd
+            await asyncio.sleep(0.05)
+
+    def hold(self):
+        '''
+        waits for a free process slot from synchronous code, e.g. for an ffmpeg pipe read frame by frame
+        :return: locked slot file descriptor; release it with release()
+        '''
+        while True:
+            fd = self.try_slot()
+            if fd is not None:
+                return fd
+            time.sleep(0.05)
+
+    def release(self, fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    async def run(self, args, stdout=subprocess.DEVNULL, timeout=None):
+        '''
+        runs a process in a slot and checks its exit code
+        :param args: list of arguments
+        :param stdout: where the standard output of the process goes
+        :param timeout: seconds before the process is killed; defaults to the runner timeout
+        :return: standard output if stdout is subprocess.PIPE, otherwise None
+        '''
+        timeout = timeout or self.timeout
+        fd = await self.acquire()
+        try:
+            proc = await asyncio.create_subprocess_exec(*args, stdout=stdout, stderr=subprocess.PIPE)
+            try:
+                out, err = await asyncio.wait_for(proc.communicate(), timeout)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                raise ProcessError(args, None, 'after {} seconds'.format(timeout).encode())
+            except asyncio.CancelledError:
+                # a cancelled window, e.g. decoding ahead when the worker exits, leaves no ffmpeg behind
+                proc.kill()
+                raise
+        finally:
+            self.release(fd)
+        if proc.returncode != 0:
+            raise ProcessError(args, proc.returncode, err)
+        return out
+
+    def call(self, command, **kwargs):
+        '''
+        runs a command string without a shell and waits for it
+        :param command: command string, e.g. an ffmpeg command line
+        :param kwargs: run() options
+        :return: run() result
+        '''
+        return asyncio.run(self.run(split(command), **kwargs))
+
+    async def retry(self, decode, item):
+        '''
+        awaits decode(item), retrying failed processes
+        '''
+        for attempt in range(self.retries + 1):
+            try:
+                return await decode(item)
+            except ProcessError as ex:
+                if attempt == self.retries:
+                    raise
+                print('Retrying {} after {}'.format(item, ex))
+                await asyncio.sleep(2 ** attempt)
+
+    async def run_pipeline(self, items, decode, finish, ahead):
+        loop = asyncio.get_event_loop()
+        results = []
+        tasks = []
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            for i, item in enumerate(items):
+                # keep the decodes of the next items running while this one finishes
+                while len(tasks) < min(len(items), i + 1 + ahead):
+                    tasks.append(asyncio.ensure_future(self.retry(decode, items[len(tasks)])))
+                try:
+                    result = await tasks[i]
+                except Exception as ex:
+                    result = ex
+                results.append(await loop.run_in_executor(executor, finish, item, result))
+        return results
+
+    def pipeline(self, items, decode, finish, ahead=1):
+        '''
+        decodes items with ahead items decoding while the previous item is finished in a thread, so ffmpeg
+        for window N+1 runs while window N is deinterlaced, tagged and recorded
+        :param items: list of items, e.g. (start, end) windows
+        :param decode: coroutine function decode(item) running the external processes of an item
+        :param finish: function finish(item, result) post-processing an item; result is the exception if its
+        decode failed after all retries
+        :param ahead: number of items decoding ahead of the item being finished
+        :return: list of finish() results
+        '''
+        return asyncio.run(self.run_pipeline(items, decode, finish, max(0, ahead)))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Scene change detection on decoded frames with a histogram of a downscaled view of each frame, cheap
+enough to run on every frame of the decode stream
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import numpy as np
+
+# width in pixels of the downscaled view the histogram is computed on
+VIEW_WIDTH = 64
+# histogram bins per color channel
+BINS = 16
+
+
+def histogram(img):
+    '''
+    computes the normalized per-channel color histogram of a strided, downscaled view of a frame
+    :param img: frame, height x width x 3, 8 or 16-bit
+    :return: array of 3*BINS bin frequencies, each channel summing to 1
+    '''
+    stride = max(1, img.shape[1] // VIEW_WIDTH)
+    view = img[::stride, ::stride]
+    shift = 8*view.dtype.itemsize - int(np.log2(BINS))
+    hist = np.concatenate([np.bincount((view[:, :, c] >> shift).ravel(), minlength=BINS)
+                           for c in range(view.shape[2])])
+    return hist / float(view.shape[0] * view.shape[1])
+
+
+def difference(a, b):
+    '''
+    :param a: histogram of a frame
+    :param b: histogram of another frame
+    :return: difference between the histograms, from 0 for identical to 1 for disjoint colors
+    '''
+    return 0.5 * np.abs(a - b).sum() / (len(a) // BINS)
+
+
+class SceneDetector():
+    def __init__(self, threshold):
+        '''
+        the SceneDetector class flags frames whose histogram differs from the last kept frame
+        by more than a threshold, so slow drifts are caught once they add up
+
+        :param threshold: histogram difference from 0 to 1 that starts a new scene, e.g. 0.3
+
+        :Example:
+        detector = SceneDetector(0.3)
+        kept = [img.copy() for img in frames if detector.changed(img)]
+        '''
+        self.threshold = threshold
+        self.last = None
+
+    def changed(self, img):
+        '''
+        checks if a frame starts a new scene, and if so keeps it as the frame the next ones are compared to
+        :param img: frame
+        :return: True for the first frame and for frames that differ from the last kept frame by more than the threshold
+        '''
+        hist = histogram(img)
+        if self.last is not None and difference(self.last, hist) <= self.threshold:
+            return False
+        self.last = hist
+        return True
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Splits videos into time segments and balances the segments of all videos across a pool
+of workers, longest estimated decode first, so one long dive does not leave cores idle
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import multiprocessing
+from datetime import timedelta
+import probe
+import utils
+from keyframes import KeyframeIndex
+
+# decode cost of an ffmpeg launch and seek, in equivalent seconds of decoded video
+SEEK_COST_SECONDS = 0.5
+
+
+def video_segments(video, step, milliseconds, start_time, end_time, segment_seconds, runner=None):
+    '''
+    splits a video into time segments using the same step/start/end logic as the Extractor
+    :param video: absolute path or url to the video
+    :param step: step in seconds between windows, or None to extract every frame
+    :param milliseconds: milliseconds to extract every step
+    :param start_time: starting time to extract images
+    :param end_time: ending time to finish extracting images, or None for the end of the video
+    :param segment_seconds: approximate length of each segment in seconds; ranges are cut at frame boundaries
+    :param runner: runner.Runner to probe the video with
+    :return: list of (cost, start, end, start_number) segments, where cost is the estimated decode
+    cost in seconds of video and start_number is the number of the first frame when extracting every frame
+    '''
+    info = probe.probe(video, runner=runner)
+    length = int(round(info['duration']))
+    fps = float(probe.frame_rate(info))
+    start_seconds = utils.to_seconds(start_time)
+    segments = []
+    if step is None:
+        # mirror Extractor.process_video, which extracts up to end_time or for milliseconds*1e3 ms
+        if end_time:
+            end_seconds = utils.to_seconds(end_time)
+        else:
+            duration = milliseconds if milliseconds is not None else 1e3/fps + 1
+            end_seconds = start_seconds + duration
+        end_seconds = min(end_seconds, length)
+        # cut at frame boundaries like Extractor.range_windows, so the segments extract exactly the frames of the
+        # whole range and number them without gaps; boundaries are rounded down so a seek never passes its frame
+        frames = utils.range_frames(end_seconds - start_seconds, fps)
+        chunk = max(1, int(round(segment_seconds*fps)))
+        bounds = list(range(0, frames, chunk)) + [frames]
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            segments.append(((b - a)/fps, start_time + timedelta(microseconds=int(a*1e6/fps)),
+                             start_time + timedelta(microseconds=int(b*1e6/fps)), a + 1))
+        return segments
+
+    duration = milliseconds/1e3 if milliseconds is not None else 1./fps + 1e-3
+    windows = 0
+    while start_seconds + windows*step < length:
+        if end_time and start_time + timedelta(seconds=windows*step + duration) > end_time:
+            break
+        windows += 1
+    windows_per_segment = max(1, int(segment_seconds // step))
+    # use the keyframe index if one was already built; building it here would read every video up front
+    keyframes = KeyframeIndex(video, build=False) if not utils.is_url(video) else None
+    for first in range(0, windows, windows_per_segment):
+        n = min(windows_per_segment, windows - first)
+        start = start_time + timedelta(seconds=first*step)
+        # the segment ends with its last window so the Extractor does not drop it
+        end = start + timedelta(seconds=(n - 1)*step + duration)
+        if keyframes:
+            window_starts = [start_seconds + (first + k)*step for k in range(n)]
+            cost = sum(keyframes.decode_seconds(t, t + duration) + SEEK_COST_SECONDS for t in window_starts)
+        else:
+            cost = n*(duration + SEEK_COST_SECONDS)
+        segments.append((cost, start, end, 1))
+    return segments
+
+
+def run(jobs, func, workers):
+    '''
+    runs jobs on a pool of workers, longest estimated cost first, so the pool stays busy until the
+    last segment finishes
+    :param jobs: list of (cost, video, args) tuples; func(args) is run for each job
+    :param func: function to run for each job; must be picklable
+    :param workers: number of worker processes
+    :return: dictionary of video to list of job results
+    '''
+    jobs = sorted(jobs, key=lambda job: job[0], reverse=True)
+    print('Scheduling {} segments with {:.0f} seconds of estimated decode on {} workers'.format(
+        len(jobs), sum(job[0] for job in jobs), workers))
+    pool = multiprocessing.Pool(processes=workers)
+    try:
+        results = pool.map(func, [job[2] for job in jobs], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    by_video = {}
+    for job, result in zip(jobs, results):
+        by_video.setdefault(job[1], []).append(result)
+    return by_video
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Writes frames to size-bounded tar shards in the WebDataset layout: each frame is a pair of members
+{name}.{ext} and {name}.json sharing a name, written sequentially through a large buffer. A json lines
+index records the shard, byte offset and size of every frame so frames can be read back by timestamp
+without scanning the shards
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import io
+import json
+import time
+import glob
+import bisect
+import tarfile
+import utils
+
+# buffer size of the shard files
+BUFFER_BYTES = 8 << 20
+
+
+class ShardWriter():
+    def __init__(self, shard_dir, name, max_bytes=1 << 30):
+        '''
+        the ShardWriter class appends frames to {shard_dir}/{name}-NNNNNN.tar, starting a new shard when the
+        current one would grow past max_bytes, and indexes them in {shard_dir}/{name}-index.jsonl. Every run
+        starts a new shard, so shards from an interrupted run are never appended to
+
+        :param shard_dir: directory of the shards and their index
+        :param name: name of the shards, unique to each concurrent writer, e.g. the video key and segment start
+        :param max_bytes: maximum shard size in bytes
+
+        :Example:
+        shards = ShardWriter('/Volumes/data/out/D008_03HD/shards', 'D008_03HD_00-00-00')
+        shards.write('D008_03HD_00-00-05_001', 'png', data, {'Dive': 'D008', 'Datetime': '20160501T000035.000Z'})
+        shards.close()
+        '''
+        utils.ensure_dir(shard_dir)
+        self.shard_dir = shard_dir
+        self.name = name
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(shard_dir, '{}-index.jsonl'.format(name))
+        self.number = 0
+        while os.path.exists(self.shard_path(self.number)):
+            self.number += 1
+        self.file = None
+        self.tar = None
+        self.index = open(self.index_path, 'a')
+        # shard and end offset of the members of each frame written, until they are recorded with take()
+        self.written = {}
+
+    def shard_path(self, number):
+        return os.path.join(self.shard_dir, '{}-{:06d}.tar'.format(self.name, number))
+
+    def add(self, name, data):
+        '''
+        appends a member to the current shard
+        :return: byte offset of the member data in the shard
+        '''
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        offset = self.tar.offset + len(info.tobuf(self.tar.format, self.tar.encoding, self.tar.errors))
+        self.tar.addfile(info, io.BytesIO(data))
+        return offset
+
+    def write(self, name, ext, data, meta):
+        '''
+        writes an encoded frame and its json sidecar to the current shard and indexes it
+        :param name: frame name without extension, unique in the video
+        :param ext: extension of the encoded frame, e.g. png
+        :param data: encoded frame bytes
+        :param meta: dictionary written as the json sidecar, e.g. with the Dive, Datetime and frame number
+        :return:
+        '''
+        sidecar = json.dumps(meta).encode('utf-8')
+        if self.tar is not None and self.tar.offset + len(data) + len(sidecar) + 2048 > self.max_bytes:
+            self.close_shard()
+        if self.tar is None:
+            self.file = open(self.shard_path(self.number), 'wb', buffering=BUFFER_BYTES)
+            self.tar = tarfile.open(fileobj=self.file, mode='w', format=tarfile.USTAR_FORMAT)
+        offset = self.add('{}.{}'.format(name, ext), data)
+        self.add('{}.json'.format(name), sidecar)
+        self.written[name] = (self.shard_path(self.number), self.tar.offset, ['{}.{}'.format(name, ext),
+                                                                           '{}.json'.format(name)])
+        entry = dict(meta)
+        entry.update({'name': name, 'shard': os.path.basename(self.shard_path(self.number)), 'offset': offset,
+                      'size': len(data), 'ext': ext})
+        self.index.write(json.dumps(entry) + '\n')
+
+    def take(self, names):
+        '''
+        looks up the shards holding frames, so a window can be recorded with the shards it must find on resume
+        :param names: names of frames written, as passed to write()
+        :return: dictionary of full shard path to (bytes the shard must hold, list of member names)
+        '''
+        shards = {}
+        for name in names:
+            if name not in self.written:
+                continue
+            path, end, members = self.written.pop(name)
+            shard = shards.setdefault(path, [0, []])
+            shard[0] = max(shard[0], end)
+            shard[1].extend(members)
+        return dict((path, tuple(shard)) for path, shard in shards.items())
+
+    def flush(self):
+        '''
+        flushes the frames written so far to the shard and the index
+        :return:
+        '''
+        if self.file is not None:
+            self.file.flush()
+        self.index.flush()
+
+    def close_shard(self):
+        if self.tar is not None:
+            self.tar.close()
+            self.file.close()
+            self.tar = None
+            self.file = None
+            self.number += 1
+
+    def close(self):
+        self.close_shard()
+        self.index.close()
+
+
+class ShardIndex():
+    def __init__(self, shard_dir):
+        '''
+        the ShardIndex class reads frames back from the shards of a video by timestamp, merging the
+        indexes of every writer
+
+        :param shard_dir: directory of the shards and their indexes
+
+        :Example:
+        index = ShardIndex('/Volumes/data/out/D008_03HD/shards')
+        entry = index.find('20160501T000035.000Z')
+        png = index.read(entry)
+        '''
+        self.shard_dir = shard_dir
+        entries = {}
+        for index_path in sorted(glob.glob(os.path.join(shard_dir, '*-index.jsonl'))):
+            with open(index_path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    # frames extracted again by a later run replace the earlier copies
+                    entries[entry['name']] = entry
+        self.entries = sorted(entries.values(), key=lambda e: (e.get('Datetime') or '', e['name']))
+        self.times = [e.get('Datetime') or '' for e in self.entries]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def find(self, timestamp):
+        '''
+        :param timestamp: frame datetime in the Datetime tag format, e.g. 20160501T000035.000Z
+        :return: index entry of the first frame at or after timestamp, or None
+        '''
+        i = bisect.bisect_left(self.times, timestamp)
+        return self.entries[i] if i < len(self.entries) else None
+
+    def between(self, start, end):
+        '''
+        :return: index entries of the frames from start up to but excluding end, in time order
+        '''
+        return self.entries[bisect.bisect_left(self.times, start):bisect.bisect_left(self.times, end)]
+
+    def read(self, entry):
+        '''
+        reads the encoded bytes of a frame with a single seek
+        :param entry: index entry
+        :return: encoded frame bytes
+        '''
+        with open(os.path.join(self.shard_dir, entry['shard']), 'rb') as f:
+            f.seek(entry['offset'])
+            return f.read(entry['size'])
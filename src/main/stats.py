@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Per-stage timers and counters for a video, written as a json lines run report with one record per window,
+per failure and per video
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import json
+import glob
+import time
+import socket
+import threading
+import traceback
+from contextlib import contextmanager
+import utils
+
+# stages timed by the extractor
+STAGES = ['ffmpeg', 'deinterlace', 'encode', 'tag', 'fs']
+
+
+class RunStats():
+    def __init__(self, video, report_path=None):
+        '''
+        the RunStats class accumulates the seconds spent in each stage and counters such as frames and bytes
+        written. Timers may be updated from several threads, e.g. the encoder pool, so stage seconds add up the
+        time of every thread and can exceed the wall clock time
+
+        :param video: video the stats are for
+        :param report_path: json lines file to append the report records to, or None to only keep totals
+
+        :Example:
+        stats = RunStats('/Volumes/data/D008_03HD.mov', '/Volumes/data/out/run_report.jsonl')
+        with stats.window('00:00:05.000-00:00:06.000'):
+            with stats.timer('ffmpeg'):
+                subprocess.call(shell_string, shell=True)
+            stats.count('frames', 30)
+        stats.close()
+        '''
+        self.video = video
+        self.report_path = report_path
+        self.seconds = dict((stage, 0.) for stage in STAGES)
+        self.counters = {'frames': 0, 'bytes': 0, 'windows': 0, 'skipped': 0, 'failures': 0}
+        self.lock = threading.Lock()
+        self.t_start = time.time()
+        self.fd = None
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.) + seconds
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def timer(self, stage):
+        '''
+        times the block and adds its seconds to stage
+        '''
+        t_start = time.time()
+        try:
+            yield
+        finally:
+            self.add(stage, time.time() - t_start)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.seconds), dict(self.counters)
+
+    @contextmanager
+    def window(self, window):
+        '''
+        reports the stage seconds and counters of the block as a window record; an exception in the block
+        is reported as a failure record and raised again
+        :param window: window key, or a range of window keys for a multi-window pass
+        '''
+        seconds, counters = self.snapshot()
+        t_start = time.time()
+        try:
+            yield
+        except Exception as ex:
+            self.failure(window, ex)
+            raise
+        now_seconds, now_counters = self.snapshot()
+        elapsed = time.time() - t_start
+        frames = now_counters['frames'] - counters['frames']
+        self.count('windows')
+        self.write({'type': 'window', 'window': window, 'seconds': elapsed,
+                    'stages': dict((k, now_seconds[k] - seconds.get(k, 0.)) for k in now_seconds),
+                    'counters': dict((k, now_counters[k] - counters.get(k, 0)) for k in now_counters),
+                    'frames_per_sec': frames / max(elapsed, 1e-6)})
+
+    def failure(self, window, ex):
+        '''
+        counts and reports a failure with its traceback
+        :param window: window key, or None for a failure of the whole video
+        :param ex: exception
+        '''
+        self.count('failures')
+        self.write({'type': 'failure', 'window': window, 'error': '{}: {}'.format(type(ex).__name__, ex),
+                    'traceback': traceback.format_exc()})
+
+    def summary(self):
+        '''
+        :return: video record with the total seconds, stage seconds, counters and throughput
+        '''
+        seconds, counters = self.snapshot()
+        elapsed = time.time() - self.t_start
+        return {'type': 'video', 'seconds': elapsed, 'stages': seconds, 'counters': counters,
+                'frames_per_sec': counters['frames'] / max(elapsed, 1e-6),
+                'mb_per_sec': counters['bytes'] / 1e6 / max(elapsed, 1e-6)}
+
+    def write(self, record):
+        '''
+        appends a record to the report with a single write, so records from concurrent videos never interleave
+        '''
+        if not self.report_path:
+            return
+        record.update({'video': self.video, 'host': socket.gethostname(), 'pid': os.getpid(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())})
+        with self.lock:
+            if self.fd is None:
+                self.fd = os.open(self.report_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            os.write(self.fd, (json.dumps(record) + '\n').encode())
+
+    def close(self):
+        '''
+        writes the video record and closes the report
+        :return: the video record
+        '''
+        record = self.summary()
+        self.write(record)
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        return record
+
+
+def part_path(report_path):
+    '''
+    :param report_path: full path to a run report, e.g. {output_dir}/run_report.jsonl
+    :return: path of the part of the report written by this process, so processes on different nodes never
+    append to the same file on shared storage
+    '''
+    base, ext = os.path.splitext(report_path)
+    return '{}.{}-{}{}'.format(base, socket.gethostname(), os.getpid(), ext)
+
+
+def read_records(path):
+    '''
+    :param path: full path to a run report or run report part
+    :return: list of the records in the file; an unreadable line, e.g. cut short by a killed worker, is skipped
+    '''
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def merge_reports(report_path):
+    '''
+    merges the parts of a run report written by part_path() processes into the report, in time order. Records
+    already in the report, e.g. from earlier runs into the same output directory or an earlier merge, are kept
+    and never duplicated
+    :param report_path: full path to the run report
+    :return: number of records merged from the parts
+    '''
+    base, ext = os.path.splitext(report_path)
+    records = read_records(report_path)
+    seen = set(json.dumps(r, sort_keys=True) for r in records)
+    merged = 0
+    for path in sorted(glob.glob('{}.*{}'.format(base, ext))):
+        for record in read_records(path):
+            key = json.dumps(record, sort_keys=True)
+            if key not in seen:
+                seen.add(key)
+                records.append(record)
+                merged += 1
+    records.sort(key=lambda r: r.get('time', ''))
+    utils.write_atomic(report_path, ''.join(json.dumps(r) + '\n' for r in records).encode())
+    return merged
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Writes PNG tEXt metadata chunks, e.g. Dive and Datetime, without running exiftool.
+The chunks are the same PNG:Dive and PNG:Datetime tags defined in mbari.config, so
+they can still be read with exiftool -config mbari.config. Jpeg frames carry the tags
+in a comment, other formats in a json sidecar
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import json
+import struct
+import zlib
+import utils
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def text_chunk(keyword, text):
+    '''
+    builds a PNG tEXt chunk
+    :param keyword: chunk keyword, e.g. Dive
+    :param text: chunk text
+    :return: the chunk bytes including length and crc
+    '''
+    data = keyword.encode('latin-1') + b'\x00' + text.encode('latin-1')
+    crc = zlib.crc32(b'tEXt' + data) & 0xffffffff
+    return struct.pack('>I', len(data)) + b'tEXt' + data + struct.pack('>I', crc)
+
+
+def add_text(png, tags):
+    '''
+    adds tEXt chunks to an encoded png, right after the IHDR chunk; existing tEXt chunks with
+    the same keywords are replaced so a png can be re-tagged
+    :param png: encoded png bytes
+    :param tags: list of (keyword, text) tuples
+    :return: the encoded png bytes with the tags
+    '''
+    if png[:8] != PNG_SIGNATURE:
+        raise Exception('Not a png')
+    keywords = set(k.encode('latin-1') for k, _ in tags)
+    chunks = []
+    pos = 8
+    while pos < len(png):
+        length, chunk_type = struct.unpack('>I4s', png[pos:pos + 8])
+        end = pos + 12 + length
+        if chunk_type == b'tEXt' and png[pos + 8:end - 4].split(b'\x00', 1)[0] in keywords:
+            pass
+        else:
+            chunks.append(png[pos:end])
+            if chunk_type == b'IHDR':
+                chunks.extend(text_chunk(k, v) for k, v in tags)
+        pos = end
+    return PNG_SIGNATURE + b''.join(chunks)
+
+
+def tag_png(path, tags):
+    '''
+    adds tEXt chunks to a png file in place; the file is replaced atomically so no backup is left behind
+    :param path: full path to the png
+    :param tags: list of (keyword, text) tuples
+    :return:
+    '''
+    with open(path, 'rb') as f:
+        png = f.read()
+    utils.write_atomic(path, add_text(png, tags))
+
+
+def jpeg_app_end(jpeg):
+    '''
+    finds the end of the APPn segments that follow the jpeg SOI marker, e.g. APP0/JFIF and APP1/Exif,
+    which must stay first in the file
+    :param jpeg: encoded jpeg bytes
+    :return: offset of the first segment after them
+    '''
+    pos = 2
+    while pos + 4 <= len(jpeg) and jpeg[pos] == 0xff and 0xe0 <= jpeg[pos + 1] <= 0xef:
+        pos += 2 + struct.unpack('>H', jpeg[pos + 2:pos + 4])[0]
+    return pos
+
+
+def add_jpeg_comment(jpeg, tags):
+    '''
+    adds the tags as a json COM segment right after the APPn segments following the jpeg SOI marker
+    :param jpeg: encoded jpeg bytes
+    :param tags: list of (keyword, text) tuples
+    :return: the encoded jpeg bytes with the comment
+    '''
+    if jpeg[:2] != b'\xff\xd8':
+        raise Exception('Not a jpeg')
+    comment = json.dumps(dict(tags)).encode('utf-8')
+    pos = jpeg_app_end(jpeg)
+    return jpeg[:pos] + b'\xff\xfe' + struct.pack('>H', len(comment) + 2) + comment + jpeg[pos:]
+
+
+def write_sidecar(path, tags):
+    '''
+    writes the tags of a frame to a json file next to it, e.g. frame.json for frame.webp
+    :param path: full path to the frame
+    :param tags: list of (keyword, text) tuples
+    :return:
+    '''
+    utils.write_atomic(os.path.splitext(path)[0] + '.json', json.dumps(dict(tags)).encode('utf-8'))
+
+
+def read_tags(path):
+    '''
+    reads the tags of a frame without decoding it: png tEXt chunks before the image data, the json
+    COM segment of a jpeg, or else the json sidecar
+    :param path: full path to the frame
+    :return: dictionary of keyword to text, empty if the frame is not tagged
+    '''
+    tags = {}
+    with open(path, 'rb') as f:
+        signature = f.read(8)
+        if signature == PNG_SIGNATURE:
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    break
+                length, chunk_type = struct.unpack('>I4s', header)
+                if chunk_type in (b'IDAT', b'IEND'):
+                    break
+                if chunk_type == b'tEXt':
+                    keyword, text = f.read(length).split(b'\x00', 1)
+                    tags[keyword.decode('latin-1')] = text.decode('latin-1')
+                    f.seek(4, 1)
+                else:
+                    f.seek(length + 4, 1)
+            return tags
+        if signature[:2] == b'\xff\xd8':
+            # the json COM segment follows the APPn segments, before the scan
+            f.seek(2)
+            while True:
+                header = f.read(4)
+                if len(header) < 4 or header[0] != 0xff or header[1] in (0xda, 0xd9):
+                    break
+                length = struct.unpack('>H', header[2:])[0]
+                if header[1] != 0xfe:
+                    f.seek(length - 2, 1)
+                    continue
+                try:
+                    return json.loads(f.read(length - 2).decode('utf-8'))
+                except ValueError:
+                    pass
+    sidecar = os.path.splitext(path)[0] + '.json'
+    if os.path.exists(sidecar):
+        with open(sidecar, 'r') as f:
+            tags = json.load(f)
+    return tags
@@ -14,50 +14,26 @@ Utility class
 '''
  
 import os 
-import subprocess 
 import re
   
 def get_dims(image):
     """
-    get the height and width of a tile
+    get the height and width of a tile from its png or jpeg header, without decoding it
     :param image: the image file
     :return: height, width
     """
-    cmd = 'identify "%s"' % (image)
-    subproc = subprocess.Popen(cmd, env=os.environ, shell=True, stdin=subprocess.PIPE, stderr=subprocess.PIPE,
-                               stdout=subprocess.PIPE)
-    out, err = subproc.communicate()
-    # get image height and width of raw tile
-    p = re.compile(r'(?P<width>\d+)x(?P<height>\d+)')
-    match = re.search(pattern=p, string=out)
-    if (match):
-        width = match.group("width")
-        height = match.group("height")
-        return height, width
-
-    raise Exception('Cannot find height/width for image %s' % image)
+    import imageinfo
+    info = imageinfo.read_header(image)
+    return info['height'], info['width']
 
 def get_framerate(video_file):
     """
        get the frame rate of a video file
        :param video_file: the video file
-       :return: height, width
+       :return: frames per second, e.g. 29.97002997
        """
-    cmd = 'ffprobe -i {}'.format(video_file)
-    print(cmd)
-    subproc = subprocess.Popen(cmd, env=os.environ, shell=True, stdin=subprocess.PIPE, 
-                               stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-    out, err = subproc.communicate() 
-    print(out)
-    print(err)
-    # many thanks to https://regexr.com/ for helping simplify testing these expressions !
-    p = re.compile('(\d?.\d) fps')
-    match = re.search(pattern=p, string=str(err))
-    if (match):
-        fps = float(match.groups(0)[0])
-        return fps
-
-    raise Exception('Cannot find frame rate for image {}'.format(video_file))
+    import probe
+    return float(probe.frame_rate(probe.probe(video_file)))
 
 def ensure_dir(d):
     """
@@ -68,6 +44,19 @@ def ensure_dir(d):
     if not os.path.exists(d):
         os.makedirs(d)
   
+def write_atomic(path, data):
+    """
+    writes data to a temporary file next to path and renames it over path, so readers never
+    see a partially written file
+    :param path: full path to the file
+    :param data: bytes to write
+    :return:
+    """
+    tmp = '{}.tmp{}'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.rename(tmp, path)
+
 def f_exists(fname):
     """
     checks if a file exists
@@ -109,21 +98,50 @@ def validate_iso8601(str):
     return False
 
 
+def is_url(input_video_path):
+    '''
+    checks if a video path is a url, e.g. a live or streamed http, rtsp or udp input
+    :param input_video_path: path or url to the video
+    :return: True if a url
+    '''
+    return re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*://', input_video_path) is not None
+
+
+def to_seconds(t):
+    '''
+    converts a time of day, e.g. a timecode parsed with strptime('%H:%M:%S'), to seconds
+    :param t: datetime or time
+    :return: seconds since midnight
+    '''
+    return t.hour*3600 + t.minute*60 + t.second + t.microsecond/1e6
+
+
+def range_frames(seconds, fps):
+    '''
+    counts the whole frames in a range, allowing for the microsecond rounding of range boundaries cut at
+    frame boundaries
+    :param seconds: length of the range in seconds
+    :param fps: frames per second
+    :return: number of frames
+    '''
+    return int(seconds*fps + 1e-3)
+
+
 def get_length(input_video_path):
     '''
-    gets the length of a video in seconds using ffprobe
+    gets the length of a video in seconds using ffprobe; the probe is cached so repeated calls are free
     :return: length: length of video in nearest seconds found at self.input_video_path
     :rtype   length: int
     '''
-    #TODO: check if URL valid
-    if 'http' not in input_video_path and not os.path.exists(input_video_path):
-        raise Exception('{} does not exist'.format(input_video_path))
-
-    shell_string = "ffprobe -i {} -show_entries format=duration -v quiet -of csv='p=0'".format(input_video_path)
-    result = subprocess.Popen(shell_string,
-                              stdout=subprocess.PIPE,
-                              stderr=subprocess.STDOUT,
-                              shell=True)
-    length = result.communicate()[0]
-    length = int(round(float(length.decode().strip('\n'))))
-    return length
+    import probe
+    return int(round(probe.probe(input_video_path)['duration']))
+
+
+def get_video_dims(input_video_path):
+    '''
+    gets the frame dimensions and pixel format of a video using ffprobe
+    :return: width, height, pixel format, bits per component, e.g. 1920, 1080, 'yuv422p10le', 10
+    '''
+    import probe
+    info = probe.probe(input_video_path)
+    return info['width'], info['height'], info['pix_fmt'], info['bit_depth']
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Tests of the frame catalog: presentation times do not drift over long videos, and compacting a catalog
+keeps the last record of each frame
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from fractions import Fraction
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+try:
+    import numpy as np
+    import catalog
+except ImportError:
+    catalog = None
+
+FPS = Fraction(30000, 1001)
+START = datetime(2016, 5, 1)
+
+
+def names(numbers):
+    return ['D0232_03HD_{:06d}.png'.format(n + 1) for n in numbers]
+
+
+@unittest.skipIf(catalog is None, 'needs numpy')
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'catalog.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def record(self, numbers, dive='D0232'):
+        c = catalog.Catalog(self.path)
+        c.record(names(numbers), numbers, catalog.frame_pts(numbers, FPS),
+                 catalog.frame_times(START, numbers, FPS), dive)
+        c.close()
+
+    def test_frame_pts(self):
+        pts = catalog.frame_pts([0, 1, 3, 30000, 10 * 3600 * 30000], FPS)
+        # 1001/30000 s per frame, rounded to the nearest microsecond without drifting
+        self.assertEqual(pts.tolist(), [0, 33367, 100100, 1001000000, 36036000000000])
+
+    def test_frame_times(self):
+        times = catalog.frame_times(START, [0, 1, 1799], FPS)
+        self.assertEqual(catalog.datetime_tags(times), ['20160501T000000.000Z', '20160501T000000.033Z',
+                                                        '20160501T000100.026Z'])
+
+    def test_record(self):
+        self.record(np.arange(3))
+        self.record(np.arange(3, 5))
+        with open(self.path, 'r') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], ','.join(catalog.COLUMNS))
+        self.assertEqual(lines[2], 'D0232_03HD_000002.png,1,0.033367,2016-05-01T00:00:00.033Z,D0232')
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(len(catalog.read_rows(self.path)), 5)
+
+    def test_compact(self):
+        self.record(np.arange(3, 6))
+        # a segment that created the catalog at the same time also wrote the header
+        with open(self.path, 'a') as f:
+            f.write(','.join(catalog.COLUMNS) + '\n')
+        self.record(np.arange(0, 4))
+        # a later run extracting frame 2 again
+        self.record(np.array([2]), dive='D0233')
+        count, npy = catalog.compact(self.path)
+        self.assertEqual(count, 6)
+        self.assertEqual(npy, os.path.join(self.tmp_dir, 'catalog.npy'))
+        with open(self.path, 'r') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], ','.join(catalog.COLUMNS))
+        self.assertEqual([line.split(',')[1] for line in lines[1:]], ['0', '1', '2', '3', '4', '5'])
+        records = np.load(npy)
+        self.assertEqual(records['number'].tolist(), list(range(6)))
+        self.assertEqual(records['frame'][2], 'D0232_03HD_000003.png')
+        self.assertEqual(records['dive'][2], 'D0233')
+        self.assertAlmostEqual(records['pts'][1], 0.033367)
+        self.assertEqual(records['time'][1], np.datetime64('2016-05-01T00:00:00.033'))
+        self.assertEqual(catalog.load(self.path)['number'].tolist(), list(range(6)))
+
+
+if __name__ == '__main__':
+    unittest.main()
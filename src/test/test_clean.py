@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Tests of the bounding box fixups of clean.py; needs lxml
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+try:
+    import clean
+except ImportError:
+    clean = None
+
+XML = '''<annotation><folder>imgs</folder><filename>f.png</filename><size><width>1000</width><height>600</height>
+<depth>3</depth></size><object><name>fish</name><bndbox><xmin>10.6</xmin><ymin>20</ymin><xmax>101</xmax>
+<ymax>51</ymax></bndbox></object></annotation>'''
+
+
+@unittest.skipIf(clean is None, 'needs lxml')
+class TestClean(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.xml = os.path.join(self.tmp_dir, 'f.xml')
+        with open(self.xml, 'w') as f:
+            f.write(XML)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_transform(self):
+        fixups = [('scale', (500, 300)), ('flip', 'h'), ('clamp', None)]
+        b, w, h = clean.transform([10.6, 20., 1101., 51.], fixups, 1000, 600)
+        self.assertEqual((w, h), (500, 300))
+        for value, expected in zip(b, [0., 10., 494.7, 25.5]):
+            self.assertAlmostEqual(value, expected)
+        self.assertEqual(clean.transform([1., 9., 3., 4.], [('swap', None), ('order', None)], 10, 10)[0],
+                         [1., 4., 3., 9.])
+
+    def test_rounds_once(self):
+        self.assertEqual(clean.clean(self.xml, [('scale', (500, 300))]), (self.xml, 2, None))
+        root = clean.annotation.read(self.xml)
+        # 10.6 scaled to 5.3, not rounded to 11 first and scaled to 5.5
+        self.assertEqual(clean.annotation.box(root.find('object')), [5., 10., 50., 26.])
+        self.assertEqual(clean.annotation.size(root), (500, 300))
+        self.assertTrue(os.path.exists(self.xml + '.bak'))
+
+
+if __name__ == '__main__':
+    unittest.main()
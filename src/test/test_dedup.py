@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Tests of finding near-duplicate frames: hashes within the Hamming distance are found through their bands,
+the first frame of a run of duplicates is kept, and linked duplicates carry the records of their original
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from fractions import Fraction
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+try:
+    import numpy as np
+    import dedup
+    import catalog
+except ImportError:
+    dedup = None
+
+FPS = Fraction(30000, 1001)
+
+
+@unittest.skipIf(dedup is None, 'needs numpy and opencv')
+class TestHammingIndex(unittest.TestCase):
+    def test_pack(self):
+        bits = np.zeros((2, 64), dtype=bool)
+        bits[0, 0] = True
+        bits[1, 63] = True
+        self.assertEqual(dedup.pack(bits), [1 << 63, 1])
+
+    def test_query(self):
+        h = 0xf0f0f0f0f0f0f0f0
+        index = dedup.HammingIndex(4)
+        index.add(h, 'a')
+        index.add(h ^ 0xffff, 'b')
+        # one differing bit in every band but one still shares that band
+        near = h ^ (1 << 2) ^ (1 << 15) ^ (1 << 30) ^ (1 << 45)
+        self.assertEqual(index.query(near), [(4, 'a')])
+        self.assertEqual(index.query(h ^ 1), [(1, 'a')])
+        self.assertEqual(index.query(h ^ 0xff), [])
+        self.assertEqual(index.query(h ^ 0xfff0), [(4, 'b')])
+        self.assertEqual(dedup.distance(h, near), 4)
+
+
+@unittest.skipIf(dedup is None, 'needs numpy and opencv')
+class TestDedup(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.key_dir = os.path.join(self.tmp_dir, 'D0232_03HD')
+        self.imgs = os.path.join(self.key_dir, 'imgs')
+        os.makedirs(self.imgs)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write(self, k, img):
+        path = os.path.join(self.imgs, 'D0232_03HD_{:06d}.npy'.format(k))
+        np.save(path, img)
+        return path
+
+    def test_find_duplicates(self):
+        rng = np.random.RandomState(0)
+        a = rng.randint(0, 256, (64, 72, 3)).astype(np.uint8)
+        b = rng.randint(0, 256, (64, 72, 3)).astype(np.uint8)
+        paths = [self.write(1, a), self.write(2, a), self.write(3, b), self.write(4, a // 2 + 64)]
+        self.write(5, np.zeros((4, 4), dtype=np.uint8))
+        frames = dedup.find_frames(self.tmp_dir)
+        self.assertEqual(list(frames), ['D0232_03HD'])
+        duplicates, hashed, unreadable = dedup.find_duplicates(frames)
+        # a frame with less contrast has the same hashes; the first of the run is kept
+        self.assertEqual([d[:2] for d in duplicates], [(paths[1], paths[0]), (paths[3], paths[0])])
+        self.assertEqual(hashed, 4)
+        self.assertEqual(unreadable, [os.path.join(self.imgs, 'D0232_03HD_000005.npy')])
+
+    def frame(self, k, tags=None):
+        path = os.path.join(self.imgs, 'D0232_03HD_{:06d}.png'.format(k))
+        with open(path, 'wb') as f:
+            f.write(bytes([k]) * 10)
+        if tags:
+            with open(os.path.splitext(path)[0] + '.json', 'w') as f:
+                json.dump(tags, f)
+        return path
+
+    def test_link(self):
+        original = self.frame(1, {'Datetime': '20160501T000000.000Z'})
+        duplicate = self.frame(2, {'Datetime': '20160501T000000.033Z'})
+        self.assertTrue(dedup.remove_duplicate(duplicate, original, 'link'))
+        self.assertTrue(os.path.samefile(duplicate, original))
+        self.assertTrue(os.path.samefile(os.path.splitext(duplicate)[0] + '.json', os.path.splitext(original)[0] + '.json'))
+        # linked already, or to a frame of another format
+        self.assertFalse(dedup.remove_duplicate(duplicate, original, 'link'))
+        self.assertFalse(dedup.remove_duplicate(duplicate, os.path.join(self.imgs, 'D0232_03HD_000001.jpg'), 'link'))
+        self.assertEqual(sorted(os.listdir(self.imgs)), ['D0232_03HD_000001.json', 'D0232_03HD_000001.png',
+                                                         'D0232_03HD_000002.json', 'D0232_03HD_000002.png'])
+
+    def test_delete(self):
+        original = self.frame(1)
+        duplicate = self.frame(2, {'Datetime': '20160501T000000.033Z'})
+        self.assertTrue(dedup.remove_duplicate(duplicate, original, 'delete'))
+        self.assertEqual(os.listdir(self.imgs), ['D0232_03HD_000001.png'])
+        self.assertFalse(dedup.remove_duplicate(original, original, 'report'))
+
+    def test_update_catalogs(self):
+        path = os.path.join(self.key_dir, 'catalog.csv')
+        c = catalog.Catalog(path)
+        numbers = np.arange(3)
+        c.record(['D0232_03HD_{:06d}.png'.format(n + 1) for n in numbers], numbers, catalog.frame_pts(numbers, FPS),
+                 catalog.frame_times(datetime(2016, 5, 1), numbers, FPS), 'D0232')
+        c.close()
+        dedup.update_catalogs([(self.frame(3), self.frame(1))])
+        rows = catalog.read_rows(path)
+        self.assertEqual(rows['D0232_03HD_000003.png'][1:], rows['D0232_03HD_000001.png'][1:])
+        self.assertEqual(rows['D0232_03HD_000002.png'][1], '1')
+        self.assertTrue(os.path.exists(os.path.join(self.key_dir, 'catalog.npy')))
+
+
+if __name__ == '__main__':
+    unittest.main()
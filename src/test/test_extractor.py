@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Tests of the Extractor API as documented: streaming frames with iter_frames() without a start time, and of
+the staging directories of killed runs being swept. The end to end test needs ffmpeg and numpy and generates
+a tiny clip with the ffmpeg testsrc source
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import sys
+import glob
+import asyncio
+import shutil
+import tempfile
+import unittest
+import importlib.util
+import subprocess
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+import extractor
+
+CLIP_NAME = 'D0232_20160501T000030Z.mov'
+INFO = {'duration': 20., 'start_time': 0., 'fps': '30000/1001', 'width': 64, 'height': 48, 'bit_depth': 8,
+        'pix_fmt': 'yuv420p', 'field_order': 'progressive'}
+HAS_FFMPEG = shutil.which('ffmpeg') is not None and importlib.util.find_spec('numpy') is not None
+
+
+class TestIterFrames(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    @mock.patch('probe.probe', return_value=INFO)
+    def test_default_start(self, _):
+        e = extractor.Extractor(os.path.join(self.tmp_dir, CLIP_NAME), self.tmp_dir, 'drop', step=5)
+        self.assertEqual((e.start.hour, e.start.minute, e.start.second), (0, 0, 0))
+        windows = e.step_windows()
+        self.assertEqual([extractor.utils.to_seconds(start) for start, _ in windows], [0, 5, 10, 15])
+        input_string, positions = e.frame_passes()[0]
+        self.assertIn('-ss 00:00:00.000', input_string)
+        self.assertEqual(positions[0], (windows[0][0], 0))
+
+    @mock.patch('probe.probe', return_value=INFO)
+    def test_overlapping_windows(self, _):
+        path = os.path.join(self.tmp_dir, CLIP_NAME)
+        e = extractor.Extractor(path, self.tmp_dir, 'drop', step=1, duration=2000, single_pass=True)
+        # each window is decoded on its own, so every window gets all its frames
+        self.assertFalse(e.single_pass)
+        passes = e.frame_passes()
+        self.assertEqual(len(passes), 20)
+        self.assertEqual([len(positions) for _, positions in passes], [59]*20)
+        self.assertNotIn('select', passes[0][0])
+        e = extractor.Extractor(path, self.tmp_dir, 'drop', step=2, duration=1000, single_pass=True)
+        self.assertTrue(e.single_pass)
+        self.assertEqual(len(e.frame_passes()), 1)
+
+    @unittest.skipUnless(HAS_FFMPEG, 'needs ffmpeg and numpy')
+    def test_documented_call(self):
+        clip = os.path.join(self.tmp_dir, CLIP_NAME)
+        subprocess.check_call(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi', '-i',
+                               'testsrc=size=64x48:rate=30000/1001', '-t', '12', clip])
+        Extractor = extractor.Extractor
+        frames = []
+        for timestamp, dive, img in Extractor(clip, self.tmp_dir, 'drop', step=5).iter_frames():
+            frames.append((timestamp, dive, img.shape))
+        # the default duration of 1000 ms every step, in the windows at 0, 5 and 10 seconds
+        self.assertEqual(len(frames), 3*29)
+        self.assertEqual(frames[0][1], 'D0232')
+        self.assertEqual(frames[0][2], (24, 32, 3))
+        # closing the generator early stops ffmpeg without an error
+        stream = Extractor(clip, self.tmp_dir, 'drop', step=5).iter_frames()
+        next(stream)
+        stream.close()
+
+
+@mock.patch('probe.probe', return_value=INFO)
+class TestStaging(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def extractor(self):
+        return extractor.Extractor(os.path.join(self.tmp_dir, CLIP_NAME), self.tmp_dir, 'drop', step=1, duration=500)
+
+    def age(self, path):
+        os.utime(path, (0, 0))
+
+    def test_sweep(self, _):
+        live = self.extractor()
+        live_dir = live.staging()
+        self.age(live_dir + '.lock')
+        # a run killed before it removed its staging directory, and the directory an earlier release left in imgs
+        dead_dir = os.path.join(live.staging_root, 'run_killed')
+        os.mkdir(dead_dir)
+        open(dead_dir + '.lock', 'w').close()
+        open(os.path.join(dead_dir, '00000001.png'), 'w').close()
+        self.age(dead_dir + '.lock')
+        old_dir = os.path.join(live.output_dir, '.drop_old')
+        os.mkdir(old_dir)
+        self.age(old_dir)
+        other = self.extractor()
+        other_dir = other.staging()
+        self.assertFalse(os.path.exists(dead_dir))
+        self.assertFalse(os.path.exists(dead_dir + '.lock'))
+        self.assertFalse(os.path.exists(old_dir))
+        # the run still holding its lock keeps its frames
+        self.assertTrue(os.path.isdir(live_dir))
+        live.remove_staging()
+        other.remove_staging()
+        self.assertEqual(os.listdir(other.staging_root), [])
+
+    def test_cancelled_decode(self, _):
+        e = self.extractor()
+        window = e.step_windows()[0]
+        with mock.patch.object(e.runner, 'run', side_effect=asyncio.CancelledError):
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(e.decode_window(window))
+        self.assertEqual(glob.glob('{}/drop_*'.format(e.staging_dir)), [])
+
+    def test_interrupted_stage(self, _):
+        e = self.extractor()
+        with mock.patch.object(e.runner, 'run', side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                e.stage_frames('ffmpeg -i {}'.format(e.input_url), [])
+        self.assertEqual(os.listdir(e.staging_dir), [])
+        self.assertEqual(os.listdir(e.output_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
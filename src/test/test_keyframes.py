@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Tests of the keyframe index loaded from the probe cache: keyframe times relative to the container start,
+and seeking like without an index when no keyframe precedes a window
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+import probe
+import extractor
+from keyframes import KeyframeIndex
+
+INFO = {'duration': 20., 'start_time': 1.5, 'fps': '30000/1001', 'width': 64, 'height': 48, 'bit_depth': 8,
+        'pix_fmt': 'yuv420p', 'field_order': 'progressive'}
+
+
+class TestKeyframeIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.video = os.path.join(self.tmp_dir, 'D0232_20160501T000030Z.mov')
+        open(self.video, 'w').close()
+        probe.write_cache(probe.cache_path(self.video, 'probe', self.tmp_dir), INFO)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def index(self, keyframes):
+        probe.write_cache(probe.cache_path(self.video, 'keyframes', self.tmp_dir), keyframes)
+        return KeyframeIndex(self.video, self.tmp_dir, build=False)
+
+    def test_seek_point(self):
+        index = self.index([[1.5, 48], [3.5, 9000], [5.5, 20000]])
+        self.assertEqual(index.times, [0., 2., 4.])
+        self.assertEqual(index.seek_point(3.), (2., 9000))
+        self.assertEqual(index.seek_point(4.), (4., 20000))
+        self.assertEqual(index.decode_seconds(3., 4.), 2.)
+        self.assertIsNone(index.seek_point(-1.))
+
+    def test_empty(self):
+        index = self.index([])
+        self.assertEqual(len(index), 0)
+        self.assertIsNone(index.seek_point(7.))
+        self.assertEqual(index.decode_seconds(7., 8.), 1.)
+
+    def test_extractor_without_keyframes(self):
+        with mock.patch('probe.probe', return_value=INFO):
+            e = extractor.Extractor(self.video, self.tmp_dir, 'drop', step=5)
+        e.keyframes = self.index([])
+        start = datetime.strptime('00:00:07.250', '%H:%M:%S.%f')
+        # the input is seeked to the window as without an index, not decoded from the start of the file
+        self.assertEqual(e.seek_input(start), ' -accurate_seek -ss 00:00:07.250 -i {}'.format(self.video))
+        self.assertFalse(e.continue_decoding(datetime.strptime('00:00:06', '%H:%M:%S'), start))
+        e.keyframes = self.index([[1.5, 48], [7.5, 9000]])
+        self.assertEqual(e.seek_input(start), ' -ss 6.000000 -i {} -ss 1.250000'.format(self.video))
+
+
+if __name__ == '__main__':
+    unittest.main()
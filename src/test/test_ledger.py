@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Tests of the work ledger: claims, lease expiry, re-leases and completions by workers whose lease expired
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+import ledger
+
+
+class TestLedger(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.ledger = ledger.Ledger(os.path.join(self.tmp_dir, 'test.ledger'), lease_seconds=0.5, max_attempts=3)
+        self.ledger.add([(10., 'a.mov', {'video': 'a.mov', 'start_time': 0}),
+                         (20., 'b.mov', {'video': 'b.mov', 'start_time': 0})])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def state(self, video):
+        '''
+        :return: (state, owner, attempts) of the job of a video
+        '''
+        job = self.ledger.summary()[video][0]
+        return job['state'], job['owner'], job['attempts']
+
+    def test_claim(self):
+        self.assertEqual(self.ledger.add([(20., 'b.mov', {'video': 'b.mov', 'start_time': 0})]), 0)
+        job_b = self.ledger.claim('A')
+        job_a = self.ledger.claim('B')
+        # costliest first, and each job is leased once
+        self.assertEqual(job_b[1]['video'], 'b.mov')
+        self.assertEqual(job_a[1]['video'], 'a.mov')
+        self.assertIsNone(self.ledger.claim('C'))
+        self.assertEqual(self.ledger.counts(), {'pending': 0, 'leased': 2, 'done': 0, 'failed': 0})
+        self.assertTrue(self.ledger.complete(job_b[0], 'A', True))
+        self.assertEqual(self.state('b.mov'), ('done', 'A', 1))
+
+    def test_expiry(self):
+        job = self.ledger.claim('A')
+        self.ledger.claim('A')
+        self.assertTrue(self.ledger.renew(job[0], 'A'))
+        self.assertFalse(self.ledger.renew(job[0], 'B'))
+        self.assertIsNone(self.ledger.claim('B'))
+        time.sleep(0.6)
+        # the lease expired without being renewed
+        self.assertEqual(self.ledger.claim('B'), job)
+        self.assertEqual(self.state('b.mov'), ('leased', 'B', 2))
+
+    def test_release(self):
+        job = self.ledger.claim('A')
+        self.assertTrue(self.ledger.complete(job[0], 'A', False))
+        self.assertEqual(self.state('b.mov'), ('pending', 'A', 1))
+        self.assertEqual(self.ledger.claim('B'), job)
+        self.assertTrue(self.ledger.complete(job[0], 'B', False))
+        self.assertEqual(self.ledger.claim('C'), job)
+        # out of attempts
+        self.assertTrue(self.ledger.complete(job[0], 'C', False))
+        self.assertEqual(self.state('b.mov'), ('failed', 'C', 3))
+        self.assertEqual(self.ledger.claim('D')[1]['video'], 'a.mov')
+
+    def test_stale_completion(self):
+        job = self.ledger.claim('A')
+        time.sleep(0.6)
+        self.assertEqual(self.ledger.claim('B'), job)
+        # A's lease expired and B holds the job now, whether A succeeded or failed
+        self.assertFalse(self.ledger.complete(job[0], 'A', False))
+        self.assertFalse(self.ledger.complete(job[0], 'A', True))
+        self.assertFalse(self.ledger.renew(job[0], 'A'))
+        self.assertEqual(self.state('b.mov'), ('leased', 'B', 2))
+        # C can only claim the other job while B holds its lease
+        self.assertEqual(self.ledger.claim('C')[1]['video'], 'a.mov')
+        self.assertIsNone(self.ledger.claim('C'))
+        self.assertTrue(self.ledger.complete(job[0], 'B', True))
+        self.assertFalse(self.ledger.complete(job[0], 'B', True))
+        self.assertEqual(self.state('b.mov'), ('done', 'B', 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Tests of the progress manifest: a resumed run skips only the windows whose frames are still intact
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+from manifest import Manifest
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.imgs = os.path.join(self.tmp_dir, 'imgs')
+        os.makedirs(self.imgs)
+        self.path = os.path.join(self.tmp_dir, 'manifest.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def frames(self, start, count):
+        files = []
+        for k in range(start, start + count):
+            path = os.path.join(self.imgs, 'D0232_03HD_{:06d}.png'.format(k))
+            with open(path, 'wb') as f:
+                f.write(bytes([k]) * 100)
+            files.append(path)
+        return files
+
+    def record(self):
+        manifest = Manifest(self.path)
+        manifest.record('00:00:00.000-00:00:01.000', self.frames(1, 3))
+        manifest.record('00:00:01.000-00:00:02.000', self.frames(4, 3))
+        manifest.close()
+        return Manifest(self.path)
+
+    def test_resume(self):
+        manifest = self.record()
+        self.assertTrue(manifest.done('00:00:00.000-00:00:01.000', verify=True))
+        self.assertTrue(manifest.done('00:00:01.000-00:00:02.000', verify=True))
+        self.assertFalse(manifest.done('00:00:02.000-00:00:03.000'))
+        self.assertEqual(manifest.frames('00:00:01.000-00:00:02.000'), 3)
+        # frame names are relative to the manifest so the output directory can move
+        self.assertEqual(sorted(manifest.windows['00:00:00.000-00:00:01.000']['files']),
+                         ['imgs/D0232_03HD_{:06d}.png'.format(k) for k in range(1, 4)])
+
+    def test_missing_frame(self):
+        manifest = self.record()
+        os.remove(os.path.join(self.imgs, 'D0232_03HD_000002.png'))
+        self.assertFalse(manifest.done('00:00:00.000-00:00:01.000'))
+        self.assertTrue(manifest.done('00:00:01.000-00:00:02.000'))
+
+    def test_changed_frame(self):
+        manifest = self.record()
+        with open(os.path.join(self.imgs, 'D0232_03HD_000004.png'), 'r+b') as f:
+            f.truncate(50)
+        self.assertFalse(manifest.done('00:00:01.000-00:00:02.000'))
+        # a frame rewritten with the same size is only caught by its checksum
+        with open(os.path.join(self.imgs, 'D0232_03HD_000001.png'), 'wb') as f:
+            f.write(b'\x00' * 100)
+        self.assertTrue(manifest.done('00:00:00.000-00:00:01.000'))
+        self.assertFalse(manifest.done('00:00:00.000-00:00:01.000', verify=True))
+
+    def test_cut_short(self):
+        self.record()
+        with open(self.path, 'a') as f:
+            f.write('{"window": "00:00:02.000-00:00:03.000", "frames": 3, "fi')
+        manifest = Manifest(self.path)
+        self.assertFalse(manifest.done('00:00:02.000-00:00:03.000'))
+        self.assertTrue(manifest.done('00:00:01.000-00:00:02.000'))
+
+    def test_recorded_again(self):
+        manifest = self.record()
+        # the last record of a window wins, e.g. after duplicates were removed from it
+        manifest.record('00:00:00.000-00:00:01.000', self.frames(1, 2), frames=2)
+        manifest.close()
+        os.remove(os.path.join(self.imgs, 'D0232_03HD_000003.png'))
+        manifest = Manifest(self.path)
+        self.assertTrue(manifest.done('00:00:00.000-00:00:01.000', verify=True))
+        self.assertEqual(manifest.frames('00:00:00.000-00:00:01.000'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Tests of probing videos through the runner, so the probe runs in a process slot with the runner timeout, and
+of the on-disk probe cache
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+import probe
+from runner import ProcessError
+
+FFPROBE = {'streams': [{'r_frame_rate': '30000/1001', 'width': 1920, 'height': 1080, 'pix_fmt': 'yuv422p10le',
+                        'codec_name': 'prores', 'field_order': 'tt'}],
+           'format': {'duration': '12.5', 'start_time': '0.5'}}
+
+
+class FakeRunner():
+    '''
+    stands in for runner.Runner, recording the commands it runs
+    '''
+    def __init__(self, out=None, error=None):
+        self.out = out
+        self.error = error
+        self.commands = []
+
+    async def run(self, args, stdout=None, timeout=None):
+        self.commands.append(args)
+        if self.error is not None:
+            raise self.error
+        return self.out
+
+
+class TestProbe(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.video = os.path.join(self.tmp_dir, 'D0232_20160501T000030Z.mov')
+        open(self.video, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_runner(self):
+        runner = FakeRunner(json.dumps(FFPROBE).encode())
+        info = probe.probe(self.video, self.tmp_dir, runner)
+        self.assertEqual(runner.commands[0][0], 'ffprobe')
+        self.assertEqual((info['duration'], info['start_time'], info['fps']), (12.5, 0.5, '30000/1001'))
+        self.assertEqual((info['bit_depth'], info['interlaced']), (10, True))
+        # the second probe reads the cache
+        self.assertEqual(probe.probe(self.video, self.tmp_dir, runner), info)
+        self.assertEqual(len(runner.commands), 1)
+
+    def test_timeout(self):
+        runner = FakeRunner(error=ProcessError(['ffprobe'], None, b'after 5 seconds'))
+        with self.assertRaises(ProcessError):
+            probe.probe(self.video, self.tmp_dir, runner)
+        self.assertIsNone(probe.read_cache(probe.cache_path(self.video, 'probe', self.tmp_dir)))
+
+
+if __name__ == '__main__':
+    unittest.main()
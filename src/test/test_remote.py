@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Tests of the remote video input against a local http.server stand-in for the archive: range parsing and
+416 responses of the proxy, eviction of the block cache, and single-flight block downloads
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+import remote
+
+DATA = bytes(range(256)) * 40
+
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    '''
+    serves DATA with byte ranges, counting the GET requests of each range
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(DATA)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+
+    def do_GET(self):
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        with self.server.lock:
+            self.server.gets.append(self.headers.get('Range'))
+        time.sleep(self.server.delay)
+        if match:
+            first, last = int(match.group(1)), min(int(match.group(2)), len(DATA) - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(first, last, len(DATA)))
+        else:
+            first, last = 0, len(DATA) - 1
+            self.send_response(200)
+        self.send_header('Content-Length', str(last - first + 1))
+        self.end_headers()
+        self.wfile.write(DATA[first:last + 1])
+
+
+class Archive(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, delay=0.):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), ArchiveHandler)
+        self.delay = delay
+        self.gets = []
+        self.lock = threading.Lock()
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def url(self):
+        return 'http://127.0.0.1:{}/D0232_20160501T000030Z.mov'.format(self.server_address[1])
+
+
+def get(url, headers=None):
+    '''
+    :return: (status, headers, body) of a GET request
+    '''
+    request = urllib.request.Request(url, headers=headers or {})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as ex:
+        return ex.code, ex.headers, ex.read()
+
+
+class TestRangeProxy(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.archive = Archive()
+        self.proxy = remote.RangeProxy(remote.BlockCache(self.cache_dir))
+        self.url, self.file = self.proxy.open(self.archive.url())
+
+    def tearDown(self):
+        self.proxy.shutdown()
+        self.proxy.server_close()
+        self.archive.shutdown()
+        self.archive.server_close()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_ranges(self):
+        status, headers, body = get(self.url, {'Range': 'bytes=10-99'})
+        self.assertEqual(status, 206)
+        self.assertEqual(headers['Content-Range'], 'bytes 10-99/{}'.format(len(DATA)))
+        self.assertEqual(body, DATA[10:100])
+        status, headers, body = get(self.url, {'Range': 'bytes=10000-'})
+        self.assertEqual((status, body), (206, DATA[10000:]))
+        status, headers, body = get(self.url, {'Range': 'bytes=-24'})
+        self.assertEqual((status, body), (206, DATA[-24:]))
+        status, headers, body = get(self.url, {'Range': 'bytes=10200-20000'})
+        self.assertEqual((status, body), (206, DATA[10200:]))
+        status, headers, body = get(self.url)
+        self.assertEqual((status, body), (200, DATA))
+        # every range was served from the one cached block
+        self.assertEqual(len(self.archive.gets), 1)
+
+    def test_unsatisfiable(self):
+        status, headers, body = get(self.url, {'Range': 'bytes={}-'.format(len(DATA))})
+        self.assertEqual(status, 416)
+        self.assertEqual(headers['Content-Range'], 'bytes */{}'.format(len(DATA)))
+        self.assertEqual(body, b'')
+
+    def test_unknown_file(self):
+        status, _, _ = get(self.url + 'x')
+        self.assertEqual(status, 404)
+
+
+class TestRemoteFile(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.archive = Archive(delay=0.2)
+        self.cache = remote.BlockCache(self.cache_dir)
+        self.file = remote.RemoteFile(self.archive.url(), self.cache, block_bytes=1024)
+
+    def tearDown(self):
+        self.archive.shutdown()
+        self.archive.server_close()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_read_across_blocks(self):
+        self.assertEqual(b''.join(self.file.read(1000, 2100)), DATA[1000:3100])
+        self.assertEqual(b''.join(self.file.read(len(DATA) - 10, 100)), DATA[-10:])
+        self.assertEqual(sorted(self.archive.gets), ['bytes=0-1023', 'bytes=1024-2047', 'bytes=2048-3071',
+                                                     'bytes=3072-4095', 'bytes=9216-10239'])
+
+    def test_single_flight(self):
+        results = []
+
+        def read():
+            results.append(self.file.block(2))
+        threads = [threading.Thread(target=read) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [DATA[2048:3072]] * 8)
+        self.assertEqual(self.archive.gets, ['bytes=2048-3071'])
+
+    def test_cached_across_instances(self):
+        self.file.block(0)
+        other = remote.RemoteFile(self.archive.url(), remote.BlockCache(self.cache_dir), block_bytes=1024)
+        self.assertEqual(other.block(0), DATA[:1024])
+        self.assertEqual(self.archive.gets, ['bytes=0-1023'])
+
+
+class TestBlockCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_eviction(self):
+        cache = remote.BlockCache(self.cache_dir, max_bytes=4000)
+        for block in range(3):
+            cache.put('key', block, bytes(1000))
+            # order the blocks by their last read
+            os.utime(cache.path('key', block), (1000 + block, 1000 + block))
+        self.assertIsNotNone(cache.get('key', 0))
+        cache.put('key', 3, bytes(1000))
+        cache.put('key', 4, bytes(1000))
+        # the cache is evicted below 90% of its size, least recently read first
+        self.assertLessEqual(cache.total, 3600)
+        self.assertIsNone(cache.get('key', 1))
+        self.assertIsNone(cache.get('key', 2))
+        self.assertIsNotNone(cache.get('key', 0))
+        self.assertIsNotNone(cache.get('key', 4))
+        self.assertEqual(cache.total, sum(size for _, _, size in cache.entries()))
+
+    def test_total_on_restart(self):
+        cache = remote.BlockCache(self.cache_dir, max_bytes=4000)
+        cache.put('key', 0, bytes(1000))
+        cache.put('other', 0, bytes(500))
+        self.assertEqual(remote.BlockCache(self.cache_dir, max_bytes=4000).total, 1500)
+
+
+if __name__ == '__main__':
+    unittest.main()
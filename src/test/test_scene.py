@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Tests of scene detection: frames are kept when their color histogram moves away from the last kept frame
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+try:
+    import numpy as np
+    import scene
+except ImportError:
+    scene = None
+
+
+def frame(white_rows, dtype='uint8'):
+    '''
+    :return: 20 x 128 rgb frame, black but for white_rows of the 10 rows of its half-size view
+    '''
+    img = np.zeros((20, 128, 3), dtype=dtype)
+    img[:2*white_rows] = np.iinfo(dtype).max
+    return img
+
+
+@unittest.skipIf(scene is None, 'needs numpy')
+class TestScene(unittest.TestCase):
+    def test_histogram(self):
+        for dtype in ('uint8', 'uint16'):
+            hist = scene.histogram(frame(5, dtype))
+            self.assertEqual(len(hist), 3 * scene.BINS)
+            self.assertAlmostEqual(hist[:scene.BINS].sum(), 1.)
+            self.assertAlmostEqual(hist[0], 0.5)
+            self.assertAlmostEqual(hist[scene.BINS - 1], 0.5)
+
+    def test_difference(self):
+        black = scene.histogram(frame(0))
+        self.assertEqual(scene.difference(black, black), 0.)
+        self.assertAlmostEqual(scene.difference(black, scene.histogram(frame(10))), 1.)
+        self.assertAlmostEqual(scene.difference(black, scene.histogram(frame(3))), 0.3)
+
+    def test_changed(self):
+        detector = scene.SceneDetector(0.25)
+        kept = [k for k in range(10) if detector.changed(frame(k))]
+        # a slow drift is caught once it adds up from the last kept frame
+        self.assertEqual(kept, [0, 3, 6, 9])
+
+    def test_cut(self):
+        detector = scene.SceneDetector(0.25)
+        self.assertEqual([detector.changed(frame(k)) for k in (0, 0, 10, 10, 0)], [True, False, True, False, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Tests of splitting videos into segments: the segments of a range extract the same frames, with the same
+numbers, as the whole range, and the segments of a stepped extraction end with their last window
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import sys
+import math
+import unittest
+from datetime import datetime, timedelta
+from fractions import Fraction
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+import utils
+import scheduler
+
+INFO = {'duration': 20., 'start_time': 0., 'fps': '30000/1001'}
+FPS = float(Fraction(INFO['fps']))
+
+
+def timecode(t):
+    return datetime.strptime(t, '%H:%M:%S.%f')
+
+
+def extracted(segments):
+    '''
+    the frames the Extractor writes for each segment: it seeks to the segment start with millisecond -ss
+    timecodes, decodes the whole frames of the segment and numbers them from the segment start_number
+    :return: dictionary of output frame number to source frame number
+    '''
+    frames = {}
+    for _, start, end, start_number in segments:
+        seek = math.floor(utils.to_seconds(start)*1e3)/1e3
+        first = math.ceil(seek*FPS - 1e-6)
+        for i in range(utils.range_frames((end - start).total_seconds(), FPS)):
+            frames[start_number + i] = first + i
+    return frames
+
+
+@mock.patch('probe.probe', return_value=INFO)
+class TestRangeSegments(unittest.TestCase):
+    def segments(self, start, end, segment_seconds):
+        return scheduler.video_segments('D0232_03HD.mov', None, None, timecode(start), timecode(end),
+                                        segment_seconds)
+
+    def test_same_frames(self, _):
+        whole = extracted(self.segments('00:00:01.0', '00:00:09.0', 3600))
+        self.assertEqual(sorted(whole), list(range(1, 240)))
+        for segment_seconds in (3, 1, 2.5):
+            self.assertEqual(extracted(self.segments('00:00:01.0', '00:00:09.0', segment_seconds)), whole)
+
+    def test_frame_boundaries(self, _):
+        segments = self.segments('00:00:00.0', '00:00:09.0', 3)
+        self.assertEqual([s[3] for s in segments], [1, 91, 181])
+        self.assertEqual([utils.range_frames((s[2] - s[1]).total_seconds(), FPS) for s in segments], [90, 90, 89])
+        # each segment ends where the next starts
+        for a, b in zip(segments[:-1], segments[1:]):
+            self.assertEqual(a[2], b[1])
+
+
+class FakeKeyframes():
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def decode_seconds(self, start, end):
+        return self.seconds
+
+
+@mock.patch('probe.probe', return_value=INFO)
+class TestStepSegments(unittest.TestCase):
+    def segments(self, end, segment_seconds, keyframes=None):
+        with mock.patch('scheduler.KeyframeIndex', return_value=keyframes or []):
+            return scheduler.video_segments('D0232_03HD.mov', 5, 1000, timecode('00:00:00.0'),
+                                            timecode(end) if end else None, segment_seconds)
+
+    def test_windows(self, _):
+        segments = self.segments(None, 10)
+        self.assertEqual([s[1] for s in segments], [timecode('00:00:00.0'), timecode('00:00:10.0')])
+        # each segment ends with the whole of its last window
+        self.assertEqual([s[2] for s in segments], [timecode('00:00:06.0'), timecode('00:00:16.0')])
+        self.assertEqual([s[3] for s in segments], [1, 1])
+        self.assertEqual([s[0] for s in segments], [3., 3.])
+
+    def test_end_time(self, _):
+        # the window at 15 s would end past the end time, so the last segment holds the window at 10 s only
+        segments = self.segments('00:00:11.0', 10)
+        self.assertEqual(len(segments), 2)
+        self.assertEqual(segments[1][1:3], (timecode('00:00:10.0'), timecode('00:00:11.0')))
+        self.assertEqual([s[0] for s in segments], [3., 1.5])
+
+    def test_short_segments(self, _):
+        # segments shorter than the step still hold one window each
+        segments = self.segments(None, 2)
+        self.assertEqual(len(segments), 4)
+        self.assertEqual([s[2] - s[1] for s in segments], [timedelta(seconds=1)]*4)
+
+    def test_keyframe_cost(self, _):
+        segments = self.segments(None, 10, FakeKeyframes(2.))
+        self.assertEqual([s[0] for s in segments], [2*(2. + scheduler.SEEK_COST_SECONDS)]*2)
+
+
+if __name__ == '__main__':
+    unittest.main()
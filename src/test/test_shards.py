@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Tests of the tar shards: reading frames back by timestamp with ShardIndex, and resuming windows recorded
+in the manifest only while their shards still hold their frames
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import sys
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+from shards import ShardWriter, ShardIndex
+from manifest import Manifest
+
+
+def frame(k):
+    return 'D0232_03HD_{:06d}'.format(k), bytes([k]) * (100 + k), {'Dive': 'D0232',
+                                                                    'Datetime': '20160501T0000{:02d}.000Z'.format(k),
+                                                                    'frame': k}
+
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.shard_dir = os.path.join(self.tmp_dir, 'D0232_03HD', 'shards')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write(self, name, frames, max_bytes=1 << 30):
+        writer = ShardWriter(self.shard_dir, name, max_bytes)
+        for k in frames:
+            key, data, meta = frame(k)
+            writer.write(key, 'png', data, meta)
+        return writer
+
+    def test_index(self):
+        self.write('D0232_03HD_00-00-00', range(1, 10), max_bytes=4096).close()
+        # a later run extracting a frame again replaces the earlier copy
+        self.write('D0232_03HD_00-00-05', [5, 12]).close()
+        self.assertGreater(len(os.listdir(self.shard_dir)), 3)
+        index = ShardIndex(self.shard_dir)
+        self.assertEqual(len(index), 10)
+        entry = index.find('20160501T000003.500Z')
+        self.assertEqual((entry['name'], entry['frame']), ('D0232_03HD_000004', 4))
+        self.assertEqual(index.read(entry), frame(4)[1])
+        self.assertEqual(index.read(index.find('20160501T000005.000Z'))[:1], bytes([5]))
+        self.assertEqual([e['frame'] for e in index.between('20160501T000002.000Z', '20160501T000005.000Z')], [2, 3, 4])
+        self.assertIsNone(index.find('20160501T000013.000Z'))
+        with tarfile.open(os.path.join(self.shard_dir, 'D0232_03HD_00-00-05-000000.tar')) as tar:
+            self.assertEqual(tar.getnames(), ['D0232_03HD_000005.png', 'D0232_03HD_000005.json',
+                                              'D0232_03HD_000012.png', 'D0232_03HD_000012.json'])
+
+    def test_resume(self):
+        manifest = Manifest(os.path.join(self.tmp_dir, 'D0232_03HD', 'manifest.jsonl'))
+        # two frames per shard
+        writer = self.write('D0232_03HD_00-00-00', range(1, 7), max_bytes=6144)
+        writer.flush()
+        manifest.record('w1', [], frames=3, shards=writer.take([frame(k)[0] for k in range(1, 4)]))
+        manifest.record('w2', [], frames=3, shards=writer.take([frame(k)[0] for k in range(4, 7)]))
+        writer.close()
+        manifest.close()
+        manifest = Manifest(manifest.path)
+        self.assertEqual(sorted(manifest.windows['w1']['shards']), ['shards/D0232_03HD_00-00-00-000000.tar',
+                                                                     'shards/D0232_03HD_00-00-00-000001.tar'])
+        self.assertTrue(manifest.done('w1', verify=True))
+        self.assertTrue(manifest.done('w2', verify=True))
+        # a shard cut short loses the windows with frames past the cut
+        last = os.path.join(self.shard_dir, 'D0232_03HD_00-00-00-000002.tar')
+        with open(last, 'r+b') as f:
+            f.truncate(600)
+        self.assertTrue(manifest.done('w1'))
+        self.assertFalse(manifest.done('w2'))
+        os.remove(os.path.join(self.shard_dir, 'D0232_03HD_00-00-00-000000.tar'))
+        self.assertFalse(manifest.done('w1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
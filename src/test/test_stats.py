@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Tests of merging the run report parts of distributed workers into the run report
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+import stats
+
+
+def write(path, records):
+    with open(path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+class TestMergeReports(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.report = os.path.join(self.tmp_dir, 'run_report.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_keeps_earlier_records(self):
+        earlier = {'type': 'video', 'video': 'a.mov', 'time': '2020-01-01T00:00:00Z'}
+        write(self.report, [earlier])
+        write(os.path.join(self.tmp_dir, 'run_report.node1-10.jsonl'),
+              [{'type': 'video', 'video': 'b.mov', 'time': '2020-01-02T00:00:02Z'}])
+        write(os.path.join(self.tmp_dir, 'run_report.node2-20.jsonl'),
+              [{'type': 'window', 'video': 'c.mov', 'time': '2020-01-02T00:00:01Z'}])
+        self.assertEqual(stats.merge_reports(self.report), 2)
+        records = stats.read_records(self.report)
+        self.assertEqual([r['video'] for r in records], ['a.mov', 'c.mov', 'b.mov'])
+        # merging again adds nothing
+        self.assertEqual(stats.merge_reports(self.report), 0)
+        self.assertEqual(stats.read_records(self.report), records)
+
+    def test_skips_cut_lines(self):
+        with open(os.path.join(self.tmp_dir, 'run_report.node1-10.jsonl'), 'w') as f:
+            f.write('{"type": "video", "video": "a.mov", "time": "2020-01-01T00:00:00Z"}\n{"type": "win')
+        self.assertEqual(stats.merge_reports(self.report), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
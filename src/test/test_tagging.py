@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+__author__ = "Danelle Cline"
+__copyright__ = "Copyright 2020, MBARI"
+__credits__ = ["MBARI"]
+__license__ = "GPL"
+__maintainer__ = "Danelle Cline"
+__email__ = "dcline at mbari.org"
+__doc__ = '''
+
+Tests of tagging frames: png tEXt chunks, jpeg COM segments and json sidecars read back the tags they
+were written with, and tagged frames keep headers other readers understand
+
+@author: __author__
+@status: __status__
+@license: __license__
+'''
+
+import os
+import sys
+import json
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+import tagging
+import imageinfo
+
+TAGS = [('Dive', 'D0232'), ('Datetime', '20160501T000035.033Z')]
+
+
+def chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff)
+
+
+def segment(marker, data):
+    return b'\xff' + bytes([marker]) + struct.pack('>H', len(data) + 2) + data
+
+
+def make_png(width=4, height=2):
+    '''
+    :return: an 8-bit rgb png of width x height black pixels
+    '''
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    raw = (b'\x00' + b'\x00' * 3 * width) * height
+    return tagging.PNG_SIGNATURE + chunk(b'IHDR', ihdr) + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b'')
+
+
+def make_jpeg(width=4, height=2):
+    '''
+    :return: the marker layout of a jpeg with APP0/JFIF and APP1/Exif segments; the scan is not decodable
+    '''
+    return (b'\xff\xd8' +
+            segment(0xe0, b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00') +
+            segment(0xe1, b'Exif\x00\x00' + b'\x00' * 8) +
+            segment(0xdb, b'\x00' + b'\x01' * 64) +
+            segment(0xc0, struct.pack('>BHHB', 8, height, width, 3) + b'\x01\x11\x00\x02\x11\x00\x03\x11\x00') +
+            segment(0xda, b'\x03\x01\x00\x02\x00\x03\x00\x00\x3f\x00') + b'\x00' * 16 + b'\xff\xd9')
+
+
+def markers(jpeg):
+    '''
+    :return: list of the segment markers before the scan
+    '''
+    found = []
+    pos = 2
+    while jpeg[pos + 1] != 0xda:
+        found.append(jpeg[pos + 1])
+        pos += 2 + struct.unpack('>H', jpeg[pos + 2:pos + 4])[0]
+    return found
+
+
+class TestTagging(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_png(self):
+        path = self.write('D0232_03HD_000001.png', make_png())
+        tagging.tag_png(path, TAGS)
+        self.assertEqual(tagging.read_tags(path), dict(TAGS))
+        self.assertEqual(imageinfo.read_header(path)['width'], 4)
+        # the chunks stay intact, with the tags right after the header
+        with open(path, 'rb') as f:
+            png = f.read()
+        self.assertEqual(png[12:16], b'IHDR')
+        self.assertEqual(png[37:41], b'tEXt')
+        self.assertTrue(png.endswith(chunk(b'IEND', b'')))
+
+    def test_png_retag(self):
+        path = self.write('D0232_03HD_000001.png', make_png())
+        tagging.tag_png(path, TAGS)
+        tagging.tag_png(path, [('Dive', 'D0233')])
+        self.assertEqual(tagging.read_tags(path), {'Dive': 'D0233', 'Datetime': TAGS[1][1]})
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read().count(b'tEXtDive'), 1)
+
+    def test_png_not_tagged(self):
+        path = self.write('D0232_03HD_000001.png', make_png())
+        self.assertEqual(tagging.read_tags(path), {})
+        with self.assertRaises(Exception):
+            tagging.add_text(make_jpeg(), TAGS)
+
+    def test_jpeg(self):
+        jpeg = tagging.add_jpeg_comment(make_jpeg(), TAGS)
+        # the comment follows the APPn segments, so JFIF stays first
+        self.assertEqual(markers(jpeg), [0xe0, 0xe1, 0xfe, 0xdb, 0xc0])
+        path = self.write('D0232_03HD_000001.jpg', jpeg)
+        self.assertEqual(tagging.read_tags(path), dict(TAGS))
+        info = imageinfo.read_header(path)
+        self.assertEqual((info['width'], info['height'], info['channels']), (4, 2, 3))
+
+    def test_jpeg_without_app(self):
+        jpeg = make_jpeg()
+        jpeg = jpeg[:2] + jpeg[2 + 18 + 18:]
+        self.assertEqual(markers(tagging.add_jpeg_comment(jpeg, TAGS)), [0xfe, 0xdb, 0xc0])
+
+    def test_sidecar(self):
+        path = self.write('D0232_03HD_000001.webp', b'RIFF')
+        self.assertEqual(tagging.read_tags(path), {})
+        tagging.write_sidecar(path, TAGS)
+        with open(os.path.join(self.tmp_dir, 'D0232_03HD_000001.json'), 'r') as f:
+            self.assertEqual(json.load(f), dict(TAGS))
+        self.assertEqual(tagging.read_tags(path), dict(TAGS))
+        # a jpeg without a comment falls back to its sidecar
+        path = self.write('D0232_03HD_000002.jpg', make_jpeg())
+        tagging.write_sidecar(path, TAGS)
+        self.assertEqual(tagging.read_tags(path), dict(TAGS))
+
+
+if __name__ == '__main__':
+    unittest.main()